@@ -176,6 +176,7 @@ void startServer() {
 void startBLE() {
   deviceUUID = getDeviceUUID();
   BLEDevice::init("ESP32-WiFi-Setup");
+  BLEDevice::setMTU(517);  // let the Pi negotiate the largest ATT MTU
   BLEServer *server = BLEDevice::createServer();
   BLEService *service = server->createService("0000ffff-0000-1000-8000-00805f9b34fb");
 
@@ -4,7 +4,7 @@ import { PrismaClient } from "@prisma/client";
 import { v4 as uuid } from "uuid";
 
 // ⬇️  bring in both helpers from the websocket module
-import { sendToPi, pendingPings, pendingPiPings, piSockets, PING_TIMEOUT_MS } from "../websockets/ws-pi.js";
+import { sendToPi, pendingPings, pendingBatchPings, pendingPiPings, piSockets, PING_TIMEOUT_MS } from "../websockets/ws-pi.js";
 
 const prisma = new PrismaClient();
 
@@ -96,6 +96,28 @@ cron.schedule("*/1 * * * *", async () => {
         continue;
       }
 
+      // Pis that announced pingEspBatch get one frame for all their devices
+      if (ws._features?.has("pingEspBatch")) {
+        const msgId = uuid();
+        const devices = Object.fromEntries(devs.map(d => [d.lanName, d.id]));
+        pendingBatchPings.set(msgId, {
+          devices,
+          expiresAt: Date.now() + PING_TIMEOUT_MS
+        });
+        const sent = sendToPi(hbId, {
+          type    : "pingEspBatch",
+          lanNames: Object.keys(devices),
+          msgId
+        });
+        if (!sent) {
+          console.warn(`[PING-ESP] ❌ Failed to send batch ping to hb=${hbId}`);
+          pendingBatchPings.delete(msgId);
+        } else {
+          console.log(`[PING-ESP] 🛰️ Sent batch ping for ${devs.length} device(s) to hb=${hbId}`);
+        }
+        continue;
+      }
+
       devs.forEach(d => {
         const msgId = uuid();
         pendingPings.set(msgId, {
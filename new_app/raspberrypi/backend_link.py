@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+import websockets
+
+import wire_codec
+from outbox import Outbox
+
+log = logging.getLogger("ws_client")
+
+
+class BackendLink:
+    """
+    The current backend socket plus its outbound writer.
+
+    send() only enqueues. A writer task waits <coalesce_window_s> after the
+    first queued message and ships everything that arrived meanwhile (up to
+    <max_batch>) as one "batch" frame, so a burst of acks costs one write.
+
+    Frames sent with durable=True are parked in the outbox while the socket
+    is down (or if they were still queued when it dropped) and flushed in
+    bulk after the next register; everything else is dropped, since e.g. a
+    late pong is useless.
+    """
+
+    def __init__(self, outbox: Outbox, coalesce_window_s: float = 0.02,
+                 max_batch: int = 50, flush_batch: int = 50):
+        self.ws = None
+        self.outbox = outbox
+        self.encoding = "json"        # switched by the backend's "registered" reply
+        self.coalesce_window_s = coalesce_window_s
+        self.max_batch = max_batch
+        self.flush_batch = flush_batch
+        self._queue = deque()         # (payload, durable)
+        self._wakeup = asyncio.Event()
+        self._writer = None
+        self._frame_times = deque()   # send times over the last minute, for frames/s
+        self.messages_sent = 0
+        self.frames_sent = 0
+        self.bytes_sent = 0
+
+    def attach(self, ws):
+        self.ws = ws
+        self.encoding = "json"
+        self._writer = asyncio.create_task(self._write_loop(ws))
+
+    def detach(self):
+        self.ws = None
+        if self._writer is not None:
+            self._writer.cancel()
+            self._writer = None
+        while self._queue:
+            self._park(*self._queue.popleft())
+
+    def _park(self, payload: dict, durable: bool):
+        if durable:
+            self.outbox.put(payload)
+            log.info(f"Offline, queued {payload.get('type')} {payload.get('msgId')}")
+        else:
+            log.warning(f"Offline, dropped {payload.get('type')}")
+
+    async def send(self, payload: dict, durable: bool = False):
+        if self.ws is None:
+            self._park(payload, durable)
+            return
+        self._queue.append((payload, durable))
+        self._wakeup.set()
+
+    async def _write_loop(self, ws):
+        while True:
+            await self._wakeup.wait()
+            if self.coalesce_window_s:
+                await asyncio.sleep(self.coalesce_window_s)
+            self._wakeup.clear()
+
+            batch = []
+            while self._queue and len(batch) < self.max_batch:
+                batch.append(self._queue.popleft())
+            if self._queue:
+                self._wakeup.set()
+            if not batch:
+                continue
+
+            try:
+                await self._send_frame(ws, [payload for payload, _ in batch])
+            except websockets.ConnectionClosed:
+                # recv() sees the close too and drives the reconnect
+                for item in batch:
+                    self._park(*item)
+                return
+            except asyncio.CancelledError:
+                for item in batch:
+                    self._park(*item)
+                raise
+
+    async def _send_frame(self, ws, payloads):
+        if len(payloads) == 1:
+            frame = wire_codec.encode(payloads[0], self.encoding)
+        else:
+            frame = wire_codec.encode({"type": "batch", "messages": payloads}, self.encoding)
+        await ws.send(frame)
+
+        now = time.monotonic()
+        self._frame_times.append(now)
+        while self._frame_times and now - self._frame_times[0] > 60:
+            self._frame_times.popleft()
+        self.frames_sent += 1
+        self.messages_sent += len(payloads)
+        self.bytes_sent += len(frame)
+
+    async def flush(self):
+        sent = 0
+        while self.ws is not None:
+            queued = self.outbox.peek(self.flush_batch)
+            if not queued:
+                break
+            await self.ws.send(wire_codec.encode({
+                "type": "batch",
+                "messages": [payload for _, payload in queued],
+            }, self.encoding))
+            self.outbox.remove([row_id for row_id, _ in queued])
+            sent += len(queued)
+        if sent:
+            log.info(f"Flushed {sent} queued frame(s) from outbox")
+
+    def queued(self) -> int:
+        return len(self._queue)
+
+    def stats(self) -> dict:
+        return {
+            "messages": self.messages_sent,
+            "frames": self.frames_sent,
+            "framesPerSec": round(len(self._frame_times) / 60, 2),
+            "bytesSent": self.bytes_sent,
+            "queued": self.queued(),
+        }
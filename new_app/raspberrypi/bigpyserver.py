@@ -4,12 +4,17 @@ HomeBase WiFi Provisioning Server - Final Working Version
 """
 
 import logging
-import requests
-from bluezero import async_tools, adapter, peripheral
 import time
 import json
 from typing import Optional, Dict
 
+import chunked_transfer
+from chunked_transfer import TransferReceiver
+from credential_bundle import CredentialAssembler, decode_bundle
+from homebase_config import config
+from homebase_logging import setup_logging
+from phase_timer import PhaseTimer
+
 # Configuration
 SERVICE_UUID = '12345678-1234-5678-1234-56789abcdef0'
 CHARACTERISTIC_UUIDS = {
@@ -17,7 +22,9 @@ CHARACTERISTIC_UUIDS = {
     'wifi_password': '12345678-1234-5678-1234-56789abcdef2',
     'status': '12345678-1234-5678-1234-56789abcdef3',
     'homebase_id': '12345678-1234-5678-1234-56789abcdef4',
-    'user_token': '12345678-1234-5678-1234-56789abcdef5'
+    'user_token': '12345678-1234-5678-1234-56789abcdef5',
+    'credentials': '12345678-1234-5678-1234-56789abcdef7',
+    'transfer': '12345678-1234-5678-1234-56789abcdef8'
 }
 
 BACKEND_URL = "http://192.168.1.120:3001/homebase/claim"
@@ -29,6 +36,7 @@ STATUS_WIFI_SUCCESS = 0x02
 STATUS_CLAIM_SUCCESS = 0x03
 STATUS_WIFI_FAILED = 0x04
 STATUS_CLAIM_FAILED = 0x05
+STATUS_CREDENTIALS_INVALID = 0x09
 
 class ProvisioningServer:
     def __init__(self):
@@ -41,23 +49,24 @@ class ProvisioningServer:
             'token': None
         }
         self.homebase_id = self._read_homebase_id()
+        self.timer: Optional[PhaseTimer] = None
+        self.assembler = CredentialAssembler()
+        self.transfer_characteristic = None
+        self.transfer_receiver = TransferReceiver(
+            self._transfer_complete, self._send_transfer_ack,
+            targets=(chunked_transfer.TARGET_TOKEN, chunked_transfer.TARGET_CREDENTIALS))
 
     @staticmethod
     def _setup_logging():
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s [SERVER] %(message)s',
-            datefmt='%Y-%m-%d %H:%M:%S'
-        )
-        return logging.getLogger()
+        setup_logging()
+        return logging.getLogger("server")
 
     def _read_homebase_id(self):
-        try:
-            with open('/etc/homebase-id', 'r') as f:
-                return f.read().strip()
-        except Exception as e:
-            self.logger.error(f"Error reading HomeBase ID: {e}")
+        homebase_id = config.get("homebaseId")
+        if not homebase_id:
+            self.logger.error(f"Error reading HomeBase ID: not set in {config.path}")
             return "UNKNOWN-HOMEBASE-ID"
+        return homebase_id
 
     def _write_status(self, code: int, description: str):
         if self.status_characteristic:
@@ -70,10 +79,11 @@ class ProvisioningServer:
         return True  # Always return True for testing
 
     def _claim_homebase(self) -> bool:
+        import requests  # slow to import and only needed once, at claim time
         try:
             response = requests.post(
                 BACKEND_URL,
-                json={"homebaseId": self.homebase_id},
+                json={"homebaseId": self.homebase_id, "onboarding": self.timer.summary()},
                 headers={
                     "Authorization": f"Bearer {self.credentials['token']}",
                     "Content-Type": "application/json"
@@ -85,17 +95,27 @@ class ProvisioningServer:
             self.logger.error(f"Backend error: {str(e)}")
             return False
 
+    def _start_timer(self):
+        if self.timer is None:
+            self.timer = PhaseTimer()
+            self.timer.mark("ble_first_write")
+
     def _process_provisioning(self):
+        self.timer.mark("ble_credentials_complete")
         try:
             self._write_status(STATUS_WIFI_CONNECTING, "Connecting WiFi")
-            if not self._simulate_wifi_connection(self.credentials['ssid'], self.credentials['password']):
+            with self.timer.phase("wifi_connect"):
+                wifi_ok = self._simulate_wifi_connection(self.credentials['ssid'], self.credentials['password'])
+            if not wifi_ok:
                 self._write_status(STATUS_WIFI_FAILED, "WiFi failed")
                 return
             
             self._write_status(STATUS_WIFI_SUCCESS, "WiFi connected")
             time.sleep(1)
             
-            if self._claim_homebase():
+            with self.timer.phase("claim"):
+                claimed = self._claim_homebase()
+            if claimed:
                 time.sleep(1.5)
                 self._write_status(STATUS_CLAIM_SUCCESS, "Claim success")
             else:
@@ -104,27 +124,71 @@ class ProvisioningServer:
             self.logger.error(f"Provisioning error: {str(e)}")
             self._write_status(STATUS_IDLE, "Error")
         finally:
+            self.timer.mark("provisioning_done")
+            self.logger.info(f"Onboarding timings: {self.timer.summary()}")
+            self.timer = None
             self.credentials = {k: None for k in self.credentials}
 
     # BLE Callbacks
     def _ssid_callback(self, value, options):
+        self._start_timer()
         self.credentials['ssid'] = bytes(value).decode('utf-8')
         self.logger.info(f"Got SSID: {self.credentials['ssid']}")
         if all(self.credentials.values()):
             self._process_provisioning()
 
     def _password_callback(self, value, options):
+        self._start_timer()
         self.credentials['password'] = bytes(value).decode('utf-8')
         self.logger.info("Got password")
         if all(self.credentials.values()):
             self._process_provisioning()
 
     def _token_callback(self, value, options):
+        self._start_timer()
         self.credentials['token'] = bytes(value).decode('utf-8')
         self.logger.info("Got token")
         if all(self.credentials.values()):
             self._process_provisioning()
 
+    def _credentials_callback(self, value, options):
+        # SSID, password and token in one framed write (see credential_bundle.py)
+        try:
+            fields = self.assembler.feed(bytes(value))
+        except ValueError as e:
+            self.logger.warning(f"Rejected credentials bundle: {e}")
+            self._write_status(STATUS_CREDENTIALS_INVALID, "Invalid credentials bundle")
+            return
+        if not fields:
+            return
+        self._start_timer()
+        self.credentials.update(fields)
+        self.logger.info(f"Got credentials bundle for SSID: {fields['ssid']}")
+        self._process_provisioning()
+
+    def _transfer_callback(self, value, options):
+        self.transfer_receiver.feed(bytes(value))
+
+    def _send_transfer_ack(self, frame: bytes):
+        self.transfer_characteristic.set_value(list(frame))
+
+    def _transfer_complete(self, target: int, payload: bytes):
+        # Large values over the chunked transfer characteristic (see chunked_transfer.py)
+        try:
+            if target == chunked_transfer.TARGET_TOKEN:
+                fields = {'token': payload.decode('utf-8')}
+            else:
+                fields = decode_bundle(payload)
+        except ValueError as e:
+            self.logger.warning(f"Rejected transfer: {e}")
+            self._write_status(STATUS_CREDENTIALS_INVALID, "Invalid credentials bundle")
+            return
+        self._start_timer()
+        self.credentials.update(fields)
+        self.logger.info(f"Got {', '.join(fields)} over chunked transfer")
+        if all(self.credentials.values()):
+            self._process_provisioning()
+
     def _status_notify_callback(self, notifying, characteristic):
         if notifying:
             self.logger.info("Status notifications enabled")
@@ -132,6 +196,7 @@ class ProvisioningServer:
 
     def setup_ble_service(self, adapter_address: str):
         """Properly configured BLE service setup"""
+        from bluezero import peripheral
         self.ble_peripheral = peripheral.Peripheral(
             adapter_address,
             local_name='HomeBase Provisioning',
@@ -186,11 +251,34 @@ class ProvisioningServer:
             write_callback=self._token_callback,
             notifying=False
         )
+
+        # All credentials in one (possibly chunked) write; kept alongside the
+        # per-field characteristics for older apps
+        self.ble_peripheral.add_characteristic(
+            srv_id=1, chr_id=6,
+            uuid=CHARACTERISTIC_UUIDS['credentials'],
+            value=[],
+            flags=['write', 'write-without-response'],
+            write_callback=self._credentials_callback,
+            notifying=False
+        )
+
+        # Chunked transfer with acks for values beyond one MTU, e.g. long tokens
+        self.ble_peripheral.add_characteristic(
+            srv_id=1, chr_id=7,
+            uuid=CHARACTERISTIC_UUIDS['transfer'],
+            value=[],
+            flags=['write', 'write-without-response', 'notify'],
+            write_callback=self._transfer_callback,
+            notifying=False
+        )
         
         # Store status characteristic reference
         self.status_characteristic = self.ble_peripheral.characteristics[2]
+        self.transfer_characteristic = self.ble_peripheral.characteristics[6]
 
     def run(self):
+        from bluezero import adapter, async_tools
         adapters = list(adapter.Adapter.available())
         if not adapters:
             raise RuntimeError("No Bluetooth adapters found")
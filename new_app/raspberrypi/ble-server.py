@@ -1,6 +1,9 @@
+import asyncio
 import logging
-import subprocess
 from bluezero import adapter, peripheral
+from gi.repository import GLib
+
+import wifi_backend
 
 # UUIDs
 CUSTOM_SRVC_UUID = '12341000-1234-1234-1234-123456789abc'
@@ -13,6 +16,10 @@ wifi_ssid = None
 wifi_password = None
 status_characteristic = None
 
+# Wi-Fi runs on an asyncio loop beside GLib so BLE stays responsive
+wifi = wifi_backend.default_backend()
+wifi_loop = wifi_backend.start_loop_thread()
+
 def ssid_write(value, options):
     global wifi_ssid
     wifi_ssid = bytes(value).decode('utf-8').strip()
@@ -28,26 +35,28 @@ def password_write(value, options):
 def attempt_connection_if_ready():
     if wifi_ssid and wifi_password:
         print("Attempting Wi-Fi connection...")
-        success = connect_to_wifi(wifi_ssid, wifi_password)
-        notify_status("SUCCESS" if success else "FAILURE")
+        future = asyncio.run_coroutine_threadsafe(
+            wifi.connect(wifi_ssid, wifi_password, progress=report_progress), wifi_loop)
+        future.add_done_callback(connection_done)
         reset_state()
 
-def connect_to_wifi(ssid, password):
-    try:
-        # Delete previous connection if exists
-        subprocess.run(['nmcli', 'connection', 'delete', ssid], check=False)
+def on_glib(fn, *args):
+    # Characteristics belong to the GLib thread; run fn there once
+    def once():
+        fn(*args)
+        return False
+    GLib.idle_add(once)
 
-        # Add new connection
-        result = subprocess.run([
-            'nmcli', 'device', 'wifi', 'connect', ssid,
-            'password', password, 'ifname', 'wlan0'
-        ], capture_output=True, text=True)
+def report_progress(stage):
+    on_glib(notify_status, stage.upper())
 
-        print("nmcli output:", result.stdout.strip(), result.stderr.strip())
-        return result.returncode == 0
+def connection_done(future):
+    try:
+        success = future.result()
     except Exception as e:
         print(f"Wi-Fi connection error: {e}")
-        return False
+        success = False
+    on_glib(notify_status, "SUCCESS" if success else "FAILURE")
 
 def notify_status(message):
     global status_characteristic
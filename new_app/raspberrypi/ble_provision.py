@@ -1,121 +1,167 @@
+import argparse
 import asyncio
-from bleak import BleakScanner, BleakClient
+from bleak import BleakClient
 import json
+import logging
 import sys
 import os
-import requests
 import signal
 
+from ble_scanner import AddressCache, DeviceFilter, StreamingScanner
+from chunked_transfer import negotiate_mtu
+from homebase_config import config
+from homebase_logging import setup_logging
+from registration_client import RegistrationClient
+
+log = logging.getLogger("ble")
+
 SSID = os.environ.get("PROVISION_SSID", "TestNetwork")
 PASS = os.environ.get("PROVISION_PASS", "correctpassword")
-WIFI_SSID_FILE = "/etc/wifi-ssid"
-WIFI_PASS_FILE = "/etc/wifi-pass"
 
 STATUS_CHAR = "0000cccc-0000-1000-8000-00805f9b34fb"
 SSID_CHAR = "0000aaaa-0000-1000-8000-00805f9b34fb"
 PASS_CHAR = "0000bbbb-0000-1000-8000-00805f9b34fb"
 INFO_CHAR = "0000dddd-0000-1000-8000-00805f9b34fb"
 
+ESP32_NAME = "ESP32-WiFi-Setup"
+ESP32_SERVICE_UUID = "0000ffff-0000-1000-8000-00805f9b34fb"
+SCAN_TIMEOUT_S = 10
+STATUS_TIMEOUT_S = 20
+# BlueZ gets flaky beyond a few simultaneous LE connections
+MAX_CONCURRENT_CONNECTIONS = 3
+
 
 
 def read_wifi_creds():
-    try:
-        with open(WIFI_SSID_FILE, "r") as f:
-            ssid = f.read().strip()
-        with open(WIFI_PASS_FILE, "r") as f:
-            pw = f.read().strip()
-        print(f"[BLE] Using SSID: {ssid}, PW: {'*' * len(pw)}")
-        return ssid, pw
-    except Exception as e:
-        print("[BLE] Failed to load WiFi credentials:", e)
+    settings = config.load()
+    ssid, pw = settings.get("wifiSsid"), settings.get("wifiPassword")
+    if not ssid or not pw:
+        log.warning(f"Failed to load WiFi credentials from {config.path}")
         return None, None
-
-async def run():
-    print("[BLE] Scanning for ESP32...")
-    device = None
-    devices = await BleakScanner.discover(timeout=10)
-    for d in devices:
-        if d.name == "ESP32-WiFi-Setup":
-            print(f"[BLE] Found device: {d.address} (RSSI {d.rssi})")
-            device = d
-            break
-
-    if not device:
-        print("[BLE] ESP32 not found.")
+    log.info(f"Using SSID: {ssid}, PW: {'*' * len(pw)}")
+    return ssid, pw
+
+async def provision_device(device, ssid, pw, slots, cache=None):
+    """
+    Provision one ESP32 and read its info. Returns
+    {"address", "ok", "info"} or {"address", "ok": False, "error"}.
+    """
+    async with slots:
+        try:
+            async with BleakClient(device) as client:
+                log.info(f"Connected to ESP32 at {device.address}")
+                mtu = await negotiate_mtu(client)
+                log.info(f"{device.address} ATT MTU: {mtu}")
+
+                result = asyncio.get_running_loop().create_future()
+
+                # 1. Subscribe to notifications BEFORE writing credentials
+                def handle_notify(sender, data):
+                    status = data.decode()
+                    log.info(f"{device.address} status: {status}")
+                    if status in ("CONNECTED", "FAILED") and not result.done():
+                        result.set_result(status)
+
+                await client.start_notify(STATUS_CHAR, handle_notify)
+
+                # 2. Now write credentials
+                await client.write_gatt_char(SSID_CHAR, ssid.encode())
+                await client.write_gatt_char(PASS_CHAR, pw.encode())
+
+                # 3. Wait for notification
+                try:
+                    status = await asyncio.wait_for(result, timeout=STATUS_TIMEOUT_S)
+                except asyncio.TimeoutError:
+                    log.warning(f"No status notification from {device.address} "
+                                f"within {STATUS_TIMEOUT_S} seconds.")
+                    status = None
+                if status == "FAILED":
+                    return {"address": device.address, "ok": False, "error": "wifi_failed"}
+
+                # Now read device info (uuid/type)
+                info = json.loads(bytes(await client.read_gatt_char(INFO_CHAR)).decode())
+                log.info(f"{device.address} device info: {info}")
+                if cache is not None:
+                    cache.remember(device, deviceId=info.get("uuid"))
+                return {"address": device.address, "ok": True, "info": info}
+        except Exception as e:
+            log.warning(f"Provisioning {device.address} failed: {e}")
+            return {"address": device.address, "ok": False, "error": str(e)}
+
+async def run(expected=1, max_concurrent=MAX_CONCURRENT_CONNECTIONS,
+              device_filter=None, addresses=()):
+    ssid, pw = read_wifi_creds()
+    if not ssid or not pw:
+        log.warning("Missing WiFi credentials, aborting.")
         return
 
-    async with BleakClient(device) as client:
-        print(f"[BLE] Connected to ESP32 at {device.address}")
-
-        ssid, pw = read_wifi_creds()
-        if not ssid or not pw:
-            print("[BLE] Missing WiFi credentials, aborting.")
+    registrations = RegistrationClient()
+    try:
+        # Anything a previous run couldn't register goes out with this run's batch
+        if registrations.pending():
+            log.info(f"{registrations.pending()} registration(s) queued from an earlier run")
+
+        cache = AddressCache()
+        # Known addresses connect straight away; only the rest need a scan
+        devices = [d for d in map(cache.ble_device, addresses) if d is not None]
+        for address in set(addresses) - {d.address for d in devices}:
+            log.info(f"{address} not in the address cache, will scan for it")
+        missing = expected - len(devices) if expected else 0
+        if missing > 0 or not expected:
+            log.info(f"Scanning for {missing or 'all'} ESP32(s)...")
+            scanner = StreamingScanner(device_filter or DeviceFilter(name=ESP32_NAME), cache)
+            devices += await scanner.find(missing, SCAN_TIMEOUT_S,
+                                          exclude={d.address for d in devices})
+        if not devices:
+            log.warning("ESP32 not found.")
+            await registrations.drain()
             return
 
-        device_provisioned = asyncio.Event()
-
-        # 1. Subscribe to notifications BEFORE writing credentials
-        print("[BLE] Subscribing to status notifications...")
-        def handle_notify(sender, data):
-            status = data.decode()
-            print(f"[BLE] [NOTIFY] Status: {status}")
-            if status == "CONNECTED":
-                print("[BLE] [NOTIFY] Provisioned!")
-                device_provisioned.set()
-            elif status == "FAILED":
-                print("[BLE] [NOTIFY] Failed to connect to WiFi.")
-                device_provisioned.set()
-
-        await client.start_notify(STATUS_CHAR, handle_notify)
-
-        # 2. Now write credentials
-        print("[BLE] Writing SSID...")
-        await client.write_gatt_char(SSID_CHAR, ssid.encode())
-        print("[BLE] Writing Password...")
-        await client.write_gatt_char(PASS_CHAR, pw.encode())
-
-        # 3. Wait for notification
-        try:
-            await asyncio.wait_for(device_provisioned.wait(), timeout=20)
-        except asyncio.TimeoutError:
-            print("[BLE] [ERROR] Did not receive a status notification from ESP32 within 20 seconds.")
-
-        # Now read device info (uuid/type)
-        await report_device(client)
-
-
-async def report_device(client):
-    print("[BLE] Reading device info characteristic...")
-    info_bytes = await client.read_gatt_char(INFO_CHAR)
-    info = json.loads(info_bytes.decode())
-    print(f"[BLE] Device info: {info}")
-
-    # Read homebase ID from local file
-    with open("/etc/homebase-id") as f:
-        homebase_id = f.read().strip()
-    claim_device_with_backend(homebase_id, info)
-
-def claim_device_with_backend(homebase_id, device_info):
-    url = "http://192.168.1.114:3001/device/register"  # Update as needed
-    lan_name = f"esp32-{device_info['uuid'][:4].lower()}.local" 
-    payload = {
-        "homeBaseId": homebase_id,
+        slots = asyncio.Semaphore(max_concurrent)
+        results = await asyncio.gather(*(provision_device(d, ssid, pw, slots, cache) for d in devices))
+        cache.save()
+        log.info(f"Provisioned {sum(r['ok'] for r in results)}/{len(results)} device(s)")
+
+        homebase_id = config.get("homebaseId")
+        registrations.enqueue(homebase_id,
+                              [device_record(r["info"]) for r in results if r["ok"]],
+                              [r for r in results if not r["ok"]])
+        await registrations.drain()
+    finally:
+        registrations.close()
+
+
+def device_record(device_info):
+    lan_name = f"esp32-{device_info['uuid'][:4].lower()}.local"
+    return {
         "deviceId": device_info["uuid"],
         "name": device_info.get("name", "ESP32 Device"),
         "type": device_info.get("type", "unknown"),
         "lanName": lan_name,
         "online": True
     }
-    try:
-        resp = requests.post(url, json=payload, timeout=5)
-        print("[BACKEND] Claim response:", resp.status_code, resp.text)
-    except Exception as e:
-        print("[BACKEND] Failed to register device:", e)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Provision nearby ESP32 controllers over BLE")
+    parser.add_argument("--expected", type=int, default=1,
+                        help="stop scanning once this many controllers are seen (0: scan the full timeout)")
+    parser.add_argument("--max-concurrent", type=int, default=MAX_CONCURRENT_CONNECTIONS,
+                        help="simultaneous BLE connections")
+    parser.add_argument("--name", default=ESP32_NAME,
+                        help="advertised name to match ('' to match any)")
+    parser.add_argument("--service-uuid", default=None,
+                        help=f"advertised service UUID to match, e.g. {ESP32_SERVICE_UUID}")
+    parser.add_argument("--manufacturer-id", type=lambda v: int(v, 0), default=None,
+                        help="company ID that must appear in the manufacturer data")
+    parser.add_argument("--address", action="append", default=[],
+                        help="known device address to connect to without scanning (repeatable)")
+    args = parser.parse_args()
+    setup_logging()
+    device_filter = DeviceFilter(name=args.name or None, service_uuid=args.service_uuid,
+                                 manufacturer_id=args.manufacturer_id)
     try:
-        asyncio.run(run())
+        asyncio.run(run(args.expected, args.max_concurrent, device_filter, args.address))
     finally:
         # This prints even if run() raised but was handled inside asyncio.run
         # or if you interrupted with Ctrl-C and the KeyboardInterrupt bubbled up.
-        print("[BLE] ble_provision.py finished – exiting process.")
+        log.info("ble_provision.py finished – exiting process.")
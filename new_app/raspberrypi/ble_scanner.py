@@ -0,0 +1,141 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+from bleak import BleakScanner
+from bleak.backends.device import BLEDevice
+
+log = logging.getLogger("ble")
+
+KNOWN_DEVICES = "/home/admin/ble-devices.json"
+KNOWN_DEVICE_MAX_AGE_S = 30 * 24 * 3600
+
+
+class DeviceFilter:
+    """
+    Which advertisements count as a match. Every criterion given must hold:
+    <name> is the advertised local name, <service_uuid> one of the advertised
+    service UUIDs, <manufacturer_id> a company ID in the manufacturer data,
+    optionally with its payload starting with <manufacturer_prefix>.
+    """
+
+    def __init__(self, name=None, service_uuid=None, manufacturer_id=None,
+                 manufacturer_prefix=b""):
+        self.name = name
+        self.service_uuid = service_uuid.lower() if service_uuid else None
+        self.manufacturer_id = manufacturer_id
+        self.manufacturer_prefix = manufacturer_prefix
+
+    def matches(self, device, adv) -> bool:
+        if self.name and (adv.local_name or device.name) != self.name:
+            return False
+        if self.service_uuid and self.service_uuid not in (u.lower() for u in adv.service_uuids):
+            return False
+        if self.manufacturer_id is not None:
+            data = adv.manufacturer_data.get(self.manufacturer_id)
+            if data is None or not bytes(data).startswith(self.manufacturer_prefix):
+                return False
+        return True
+
+
+class AddressCache:
+    """
+    Devices seen before, keyed by address and persisted to <path>, so a
+    known device can be connected to without scanning for it first.
+    """
+
+    def __init__(self, path: str = KNOWN_DEVICES, max_age_s: float = KNOWN_DEVICE_MAX_AGE_S):
+        self.path = path
+        self.max_age_s = max_age_s
+        self.entries = self._load()
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        cutoff = time.time() - self.max_age_s
+        return {addr: e for addr, e in entries.items() if e.get("lastSeen", 0) >= cutoff}
+
+    def save(self):
+        tmp = f"{self.path}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(self.entries, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            log.warning(f"Could not write {self.path}: {e}")
+
+    def remember(self, device, **extra):
+        entry = self.entries.setdefault(device.address, {})
+        entry.update(extra, name=device.name, lastSeen=time.time())
+        details = device.details if isinstance(device.details, dict) else {}
+        if details.get("path"):
+            entry["path"] = details["path"]  # BlueZ object path
+
+    def get(self, address: str):
+        return self.entries.get(address)
+
+    def ble_device(self, address: str):
+        """
+        A BLEDevice BleakClient can connect to directly (BlueZ skips the
+        scan when it is handed the object path), or None if unknown.
+        """
+        entry = self.entries.get(address)
+        if not entry or not entry.get("path"):
+            return None
+        details = {"path": entry["path"], "props": {}}
+        try:
+            return BLEDevice(address, entry.get("name"), details)
+        except TypeError:  # bleak < 1.0 still wants rssi
+            return BLEDevice(address, entry.get("name"), details, -127)
+
+
+class StreamingScanner:
+    """
+    Scans with a detection callback and returns as soon as enough matching
+    devices have advertised, instead of waiting out a fixed discover().
+    """
+
+    def __init__(self, device_filter: DeviceFilter, cache: AddressCache = None):
+        self.filter = device_filter
+        self.cache = cache
+
+    async def find(self, expected: int = 1, timeout_s: float = 10, exclude=()) -> list:
+        """
+        Up to the first <expected> distinct matches (0: all matches seen
+        within <timeout_s>), in the order they showed up.
+        """
+        found = {}
+        enough = asyncio.Event()
+        started = time.monotonic()
+
+        def on_detect(device, adv):
+            if device.address in found or device.address in exclude:
+                return
+            if not self.filter.matches(device, adv):
+                return
+            log.info(f"Found device: {device.address} (RSSI {adv.rssi}) "
+                     f"after {time.monotonic() - started:.2f}s")
+            found[device.address] = device
+            if self.cache is not None:
+                self.cache.remember(device)
+            if expected and len(found) >= expected:
+                enough.set()
+
+        async with BleakScanner(detection_callback=on_detect):
+            try:
+                await asyncio.wait_for(enough.wait(), timeout_s)
+            except asyncio.TimeoutError:
+                pass
+        if self.cache is not None and found:
+            self.cache.save()
+        devices = list(found.values())
+        return devices[:expected] if expected else devices
+
+    async def find_first(self, timeout_s: float = 10):
+        devices = await self.find(1, timeout_s)
+        return devices[0] if devices else None
@@ -0,0 +1,242 @@
+import asyncio
+import logging
+import struct
+import zlib
+
+log = logging.getLogger("ble")
+
+# Chunked transfer over one GATT characteristic (write + notify)
+#
+#   START   [0x01][xid][target][total u32][crc32 u32][window][chunk u16]
+#   DATA    [0x02][xid][seq u16][chunk bytes]   seq bit 15: last of its window
+#   ACK     [0x03][xid][status][next_seq u16]
+#
+# All integers are big-endian. The sender writes START, then DATA frames
+# without response, <window> at a time, flags the last frame of each window
+# and waits for an ACK. The receiver answers every flagged frame with the
+# next seq it needs (PROGRESS, or RESEND if frames went missing), answers
+# the first duplicate or gap in a window straight away in case the flagged
+# frame is lost too, and answers the last chunk with DONE or CRC_ERROR after
+# checking the CRC-32 of the reassembled payload. A window with no ACK is
+# resent, and the resent duplicates draw a fresh ACK.
+FRAME_START = 0x01
+FRAME_DATA = 0x02
+FRAME_ACK = 0x03
+
+ACK_PROGRESS = 0x00
+ACK_DONE = 0x01
+ACK_RESEND = 0x02
+ACK_CRC_ERROR = 0x03
+ACK_REJECTED = 0x04  # too large, unknown target or no transfer in progress
+
+# What a transfer carries
+TARGET_TOKEN = 0x01        # user token (JWT), utf-8
+TARGET_CREDENTIALS = 0x02  # credential_bundle.encode_bundle() payload
+
+ATT_HEADER = 3             # opcode + handle in every write / notification
+DATA_HEADER = 4
+DEFAULT_MTU = 23
+MAX_MTU = 517
+DEFAULT_WINDOW = 8
+MAX_TRANSFER_BYTES = 16 * 1024
+
+SEQ_LAST_IN_WINDOW = 0x8000
+SEQ_MASK = 0x7FFF
+
+_START = struct.Struct(">BBBIIBH")
+_DATA = struct.Struct(">BBH")
+_ACK = struct.Struct(">BBBH")
+
+
+def chunk_size(mtu: int) -> int:
+    """
+    Largest DATA payload that fits one write at <mtu>.
+    """
+    return max(1, min(mtu, MAX_MTU) - ATT_HEADER - DATA_HEADER)
+
+
+def start_frame(xid: int, target: int, payload: bytes, window: int, size: int) -> bytes:
+    return _START.pack(FRAME_START, xid, target, len(payload),
+                       zlib.crc32(payload), window, size)
+
+
+def data_frame(xid: int, seq: int, chunk: bytes, last_in_window: bool = False) -> bytes:
+    return _DATA.pack(FRAME_DATA, xid, seq | (SEQ_LAST_IN_WINDOW if last_in_window else 0)) + chunk
+
+
+def ack_frame(xid: int, status: int, next_seq: int) -> bytes:
+    return _ACK.pack(FRAME_ACK, xid, status, next_seq)
+
+
+def parse_ack(frame: bytes):
+    """
+    (xid, status, next_seq) for an ACK frame, None for anything else.
+    """
+    if len(frame) != _ACK.size or frame[0] != FRAME_ACK:
+        return None
+    _, xid, status, next_seq = _ACK.unpack(frame)
+    return xid, status, next_seq
+
+
+class TransferReceiver:
+    """
+    Reassembles one transfer at a time from START/DATA frames.
+
+    send_ack(frame) delivers ACKs back to the sender (a notify on the
+    peripheral, a write on the central); on_complete(target, payload) is
+    called once the CRC checks out. Both are called from feed()'s thread.
+    """
+
+    def __init__(self, on_complete, send_ack, max_bytes: int = MAX_TRANSFER_BYTES,
+                 targets=None):
+        self.on_complete = on_complete
+        self.send_ack = send_ack
+        self.max_bytes = max_bytes
+        self.targets = targets  # accepted targets, None for any
+        self._done_xid = None   # last completed transfer, in case its DONE was lost
+        self._reset()
+
+    def _reset(self):
+        self.xid = None
+        self.chunks = []
+        self.expected = 0
+        self._last_seq = -1
+        self._stale_acked = False  # answered a duplicate/gap in this burst
+
+    def feed(self, frame: bytes):
+        if not frame:
+            return
+        if frame[0] == FRAME_START and len(frame) == _START.size:
+            self._start(frame)
+        elif frame[0] == FRAME_DATA and len(frame) >= _DATA.size:
+            self._data(frame)
+
+    def _start(self, frame: bytes):
+        _, xid, target, total, crc, window, size = _START.unpack(frame)
+        self._reset()
+        self._done_xid = None
+        if total > self.max_bytes or size == 0 or window == 0 \
+                or (self.targets is not None and target not in self.targets):
+            self.send_ack(ack_frame(xid, ACK_REJECTED, 0))
+            return
+        self.xid, self.target, self.total, self.crc = xid, target, total, crc
+        self.window, self.count = window, max(1, -(-total // size))
+        if total == 0:
+            self._finish()
+
+    def _data(self, frame: bytes):
+        _, xid, seq = _DATA.unpack_from(frame)
+        if xid == self._done_xid and self.xid is None:
+            self.send_ack(ack_frame(xid, ACK_DONE, 0))
+            return
+        if xid != self.xid:
+            self.send_ack(ack_frame(xid, ACK_REJECTED, 0))
+            return
+        seq, last_in_window = seq & SEQ_MASK, bool(seq & SEQ_LAST_IN_WINDOW)
+        # Within a burst seqs only go up; going back means the sender timed
+        # out and resent, so whatever we answered last time was lost
+        if seq <= self._last_seq:
+            self._stale_acked = False
+        self._last_seq = seq
+        stale = seq != self.expected
+        if not stale:
+            self.chunks.append(frame[_DATA.size:])
+            self.expected += 1
+            if self.expected == self.count:
+                self._finish()
+                return
+        if last_in_window:
+            # The sender is now waiting on us
+            self._ack()
+            self._stale_acked = False
+        elif stale and not self._stale_acked:
+            # Duplicate (our ack was lost) or gap (a frame was lost): say where
+            # we are straight away, in case the window's last frame is lost too
+            self._stale_acked = True
+            self._ack()
+
+    def _ack(self):
+        # RESEND and PROGRESS both move the sender to <expected>; RESEND
+        # just says frames went missing
+        status = ACK_PROGRESS if self._last_seq < self.expected else ACK_RESEND
+        self.send_ack(ack_frame(self.xid, status, self.expected))
+
+    def _finish(self):
+        xid, target = self.xid, self.target
+        payload = b"".join(self.chunks)
+        ok = len(payload) == self.total and zlib.crc32(payload) == self.crc
+        self._reset()
+        self._done_xid = xid if ok else None
+        self.send_ack(ack_frame(xid, ACK_DONE if ok else ACK_CRC_ERROR, 0))
+        if ok:
+            self.on_complete(target, payload)
+
+
+class TransferSender:
+    """
+    Sends payloads with windowed acks. write(frame, response) is a coroutine
+    writing one frame; ACK frames from the peer go to on_ack().
+    """
+
+    def __init__(self, write, mtu: int = DEFAULT_MTU, window: int = DEFAULT_WINDOW,
+                 ack_timeout_s: float = 2.0, retries: int = 3):
+        self.write = write
+        self.mtu = mtu
+        self.window = window
+        self.ack_timeout_s = ack_timeout_s
+        self.retries = retries
+        self._xid = 0
+        self._acks = asyncio.Queue()
+
+    def on_ack(self, frame: bytes):
+        ack = parse_ack(bytes(frame))
+        if ack and ack[0] == self._xid:
+            self._acks.put_nowait(ack)
+
+    async def send(self, target: int, payload: bytes) -> bool:
+        self._xid = (self._xid + 1) & 0xFF
+        size = chunk_size(self.mtu)
+        chunks = [payload[i:i + size] for i in range(0, len(payload), size)] or [b""]
+        while not self._acks.empty():
+            self._acks.get_nowait()
+
+        await self.write(start_frame(self._xid, target, payload, self.window, size), True)
+        base, misses = 0, 0
+        while True:
+            end = min(base + self.window, len(chunks))
+            for seq in range(base, end):
+                await self.write(data_frame(self._xid, seq, chunks[seq], seq == end - 1), False)
+            try:
+                _, status, next_seq = await asyncio.wait_for(self._acks.get(), self.ack_timeout_s)
+                # The receiver may have answered more than once; the last
+                # answer is its current state
+                while not self._acks.empty():
+                    _, status, next_seq = self._acks.get_nowait()
+            except asyncio.TimeoutError:
+                misses += 1
+                if misses > self.retries:
+                    log.warning(f"Transfer {self._xid} gave up after {misses} silent windows")
+                    return False
+                continue  # resend the same window
+            misses = 0
+            if status == ACK_DONE:
+                return True
+            if status in (ACK_PROGRESS, ACK_RESEND):
+                base = next_seq
+                continue
+            log.warning(f"Transfer {self._xid} failed with status 0x{status:02X}")
+            return False
+
+
+async def negotiate_mtu(client) -> int:
+    """
+    Largest ATT MTU for a connected BleakClient. BlueZ only exchanges the
+    MTU on demand, so ask its backend first; other backends report it as is.
+    """
+    acquire = getattr(getattr(client, "_backend", None), "_acquire_mtu", None)
+    if acquire is not None:
+        try:
+            await acquire()
+        except Exception as e:
+            log.warning(f"MTU exchange failed, staying at {client.mtu_size}: {e}")
+    return min(client.mtu_size, MAX_MTU)
@@ -0,0 +1,105 @@
+import struct
+
+# Bundled credentials characteristic
+#
+# The app writes every field in one go instead of three separate GATT writes:
+#
+#   bundle : [version=1] + TLV*      TLV = [type][len u16 BE][value utf-8]
+#   chunk  : [flags][seq] + part     flags bit0 = first, bit1 = last
+#
+# A bundle that fits in one write is sent as a single chunk with both flags
+# set. Larger bundles go out as MTU-sized chunks with seq counting up from 0;
+# a chunk with the first flag always starts over.
+BUNDLE_VERSION = 1
+FIELD_SSID = 0x01
+FIELD_PASSWORD = 0x02
+FIELD_TOKEN = 0x03
+FIELD_NAMES = {FIELD_SSID: "ssid", FIELD_PASSWORD: "password", FIELD_TOKEN: "token"}
+
+CHUNK_FIRST = 0x01
+CHUNK_LAST = 0x02
+MAX_BUNDLE_BYTES = 4096
+MAX_SSID_BYTES = 32
+
+
+def encode_bundle(ssid: str, password: str, token: str) -> bytes:
+    out = bytearray([BUNDLE_VERSION])
+    for field, value in ((FIELD_SSID, ssid), (FIELD_PASSWORD, password), (FIELD_TOKEN, token)):
+        data = value.encode("utf-8")
+        out += struct.pack(">BH", field, len(data)) + data
+    return bytes(out)
+
+
+def chunk_bundle(bundle: bytes, mtu: int = 23) -> list:
+    """
+    Split <bundle> into writes of at most mtu - 3 bytes (ATT header).
+    """
+    room = max(1, mtu - 3 - 2)
+    parts = [bundle[i:i + room] for i in range(0, len(bundle), room)] or [b""]
+    chunks = []
+    for seq, part in enumerate(parts):
+        flags = (CHUNK_FIRST if seq == 0 else 0) | (CHUNK_LAST if seq == len(parts) - 1 else 0)
+        chunks.append(bytes([flags, seq & 0xFF]) + part)
+    return chunks
+
+
+def decode_bundle(bundle: bytes) -> dict:
+    if not bundle or bundle[0] != BUNDLE_VERSION:
+        raise ValueError("Unsupported credentials bundle version")
+    fields, pos = {}, 1
+    while pos < len(bundle):
+        if pos + 3 > len(bundle):
+            raise ValueError("Truncated field header")
+        field, length = struct.unpack_from(">BH", bundle, pos)
+        pos += 3
+        if pos + length > len(bundle):
+            raise ValueError("Truncated field value")
+        if field in FIELD_NAMES:  # unknown fields are skipped for forward compat
+            fields[FIELD_NAMES[field]] = bundle[pos:pos + length].decode("utf-8")
+        pos += length
+    missing = [name for name in FIELD_NAMES.values() if not fields.get(name)]
+    if missing:
+        raise ValueError(f"Missing fields: {', '.join(missing)}")
+    if len(fields["ssid"].encode("utf-8")) > MAX_SSID_BYTES:
+        raise ValueError("SSID longer than 32 bytes")
+    return fields
+
+
+class CredentialAssembler:
+    """
+    Reassembles chunked writes. feed() returns the decoded fields once the
+    last chunk is in, None while more are expected, and raises ValueError
+    (after resetting) on anything malformed.
+    """
+
+    def __init__(self):
+        self._buf = None
+        self._next_seq = 0
+
+    def reset(self):
+        self._buf = None
+        self._next_seq = 0
+
+    def feed(self, chunk: bytes):
+        if len(chunk) < 2:
+            self.reset()
+            raise ValueError("Chunk too short")
+        flags, seq = chunk[0], chunk[1]
+        if flags & CHUNK_FIRST:
+            self._buf, self._next_seq = bytearray(), 0
+        if self._buf is None or seq != self._next_seq:
+            self.reset()
+            raise ValueError("Chunk out of sequence")
+        self._buf += chunk[2:]
+        self._next_seq = (seq + 1) & 0xFF
+        if len(self._buf) > MAX_BUNDLE_BYTES:
+            self.reset()
+            raise ValueError("Credentials bundle too large")
+        if not flags & CHUNK_LAST:
+            return None
+        bundle = bytes(self._buf)
+        self.reset()
+        try:
+            return decode_bundle(bundle)
+        except UnicodeDecodeError as e:
+            raise ValueError(f"Invalid UTF-8 in bundle: {e}")
@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import random
+import time
+
+log = logging.getLogger("health")
+
+
+class DeviceHealth:
+    """
+    In-memory health table for every ESP32 the Pi has been asked about.
+
+    Each tracked lanName is re-probed in the background every <interval_s>
+    (+/- <jitter_s>, so devices aren't all hit at once). status() answers
+    straight from the table when the last probe is younger than <fresh_s>
+    and only probes live for stale or unknown devices.
+
+    A device nobody has asked about for <expire_after> intervals (deleted
+    or renamed on the backend) is dropped and no longer probed.
+    """
+
+    def __init__(self, probe, interval_s: float = 30, jitter_s: float = 5,
+                 fresh_s: float = 45, down_after: int = 2, expire_after: int = 10):
+        self.probe = probe            # async (lanName) -> (online or None, rtt_ms)
+        self.interval_s = interval_s
+        self.jitter_s = jitter_s
+        self.fresh_s = fresh_s
+        self.down_after = down_after
+        self.expire_after = expire_after
+        self._table = {}              # lanName -> entry dict, see _entry()
+        self._probers = {}            # lanName -> asyncio.Task
+        self._running = False
+
+    @staticmethod
+    def _entry():
+        return {
+            "state": "unknown",       # "up" | "down" | "unknown"
+            "lastSeen": None,         # wall-clock time of last successful probe
+            "rttMs": None,
+            "failures": 0,            # consecutive failed probes
+            "checkedAt": None,        # time.monotonic() of last probe
+            "requestedAt": None,      # time.monotonic() of last track()
+        }
+
+    def record(self, lan: str, online: bool, rtt_ms=None):
+        e = self._table.setdefault(lan, self._entry())
+        e["checkedAt"] = time.monotonic()
+        if online:
+            e["state"] = "up"
+            e["lastSeen"] = time.time()
+            e["rttMs"] = rtt_ms
+            e["failures"] = 0
+        else:
+            e["failures"] += 1
+            if e["failures"] >= self.down_after or e["state"] == "unknown":
+                e["state"] = "down"
+
+    async def check(self, lan: str):
+        """
+        Live probe; updates the table. Returns (online, rtt_ms). A probe
+        that returns None (skipped, the device is busy) leaves the table as
+        it was and the last known state is returned.
+        """
+        online, rtt_ms = await self.probe(lan)
+        if online is None:
+            e = self._table.get(lan) or self._entry()
+            return e["state"] == "up", e["rttMs"]
+        self.record(lan, online, rtt_ms)
+        return online, rtt_ms
+
+    async def status(self, lan: str):
+        """
+        (online, rtt_ms) from the table if fresh, otherwise from a live probe.
+        """
+        self.track(lan)
+        e = self._table.get(lan)
+        if e and e["checkedAt"] is not None \
+                and time.monotonic() - e["checkedAt"] < self.fresh_s:
+            return e["state"] == "up", e["rttMs"]
+        return await self.check(lan)
+
+    def track(self, lan: str):
+        self._table.setdefault(lan, self._entry())["requestedAt"] = time.monotonic()
+        if self._running and lan not in self._probers:
+            self._probers[lan] = asyncio.create_task(self._probe_loop(lan))
+
+    def untrack(self, lan: str):
+        self._table.pop(lan, None)
+        task = self._probers.pop(lan, None)
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+
+    def _expired(self, lan: str) -> bool:
+        requested = self._table.get(lan, {}).get("requestedAt")
+        return requested is None \
+            or time.monotonic() - requested > self.expire_after * self.interval_s
+
+    async def _probe_loop(self, lan: str):
+        # Random initial offset spreads a freshly loaded device list over the interval
+        await asyncio.sleep(random.uniform(0, self.interval_s))
+        while True:
+            if self._expired(lan):
+                log.info(f"No requests for {lan} in {self.expire_after} intervals, dropping it")
+                self.untrack(lan)
+                return
+            try:
+                await self.check(lan)
+            except Exception as e:
+                log.warning(f"Probe of {lan} failed: {e}")
+            await asyncio.sleep(self.interval_s + random.uniform(-self.jitter_s, self.jitter_s))
+
+    def snapshot(self) -> dict:
+        return {lan: dict(e) for lan, e in self._table.items()}
+
+    def start(self):
+        self._running = True
+        for lan in self._table:
+            self.track(lan)
+
+    def stop(self):
+        self._running = False
+        for task in self._probers.values():
+            task.cancel()
+        self._probers.clear()
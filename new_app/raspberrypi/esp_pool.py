@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import time
+
+import aiohttp
+
+from metrics import metrics
+
+log = logging.getLogger("esp_pool")
+
+ESP32_HTTP_SECONDS = metrics.histogram(
+    "homebase_esp32_http_seconds", "ESP32 HTTP round trip, including the mDNS lookup",
+    labels=("method", "outcome"))
+
+# A cached IP gets this long to accept the TCP connection before we assume
+# the device moved (new DHCP lease) and look it up again
+CACHED_IP_CONNECT_TIMEOUT_S = 1
+
+# What a request to a stale IP fails with: refused/unreachable, or (most
+# often, the address being dead) a connect timeout. ConnectionTimeoutError
+# is aiohttp >= 3.10; older versions raise ServerTimeoutError.
+STALE_IP_ERRORS = (
+    aiohttp.ClientConnectorError,
+    getattr(aiohttp, "ConnectionTimeoutError", aiohttp.ServerTimeoutError),
+    aiohttp.ClientOSError,
+)
+
+
+class EspPool:
+    """
+    One keep-alive aiohttp session per ESP32 lanName.
+
+    Sessions are created on first use, closed again once a device has been
+    idle for <idle_evict_s>, and count how many requests went out on a fresh
+    TCP connection versus a reused one.
+
+    With a <resolver> the request goes to the cached IP (Host header keeps the
+    lanName); a connection failure triggers one fresh lookup and a retry.
+    """
+
+    def __init__(self, max_connections: int = 2, keepalive_s: float = 30,
+                 idle_evict_s: float = 120, resolver=None):
+        self.resolver = resolver
+        self.max_connections = max_connections
+        self.keepalive_s = keepalive_s
+        self.idle_evict_s = idle_evict_s
+        self._sessions = {}   # lanName -> aiohttp.ClientSession
+        self._last_used = {}  # lanName -> time.monotonic()
+        self._stats = {}      # lanName -> {"requests", "new", "reused"}
+        self._evictor = None
+
+    def _trace_config(self, stats: dict) -> aiohttp.TraceConfig:
+        async def on_create(session, ctx, params):
+            stats["new"] += 1
+
+        async def on_reuse(session, ctx, params):
+            stats["reused"] += 1
+
+        tc = aiohttp.TraceConfig()
+        tc.on_connection_create_end.append(on_create)
+        tc.on_connection_reuseconn.append(on_reuse)
+        return tc
+
+    def session(self, lan: str) -> aiohttp.ClientSession:
+        self._last_used[lan] = time.monotonic()
+        s = self._sessions.get(lan)
+        if s is None or s.closed:
+            stats = self._stats.setdefault(lan, {"requests": 0, "new": 0, "reused": 0})
+            connector = aiohttp.TCPConnector(
+                limit=self.max_connections,
+                keepalive_timeout=self.keepalive_s,
+            )
+            s = self._sessions[lan] = aiohttp.ClientSession(
+                connector=connector,
+                trace_configs=[self._trace_config(stats)],
+            )
+        self._stats[lan]["requests"] += 1
+        return s
+
+    async def _send(self, method: str, lan: str, host: str, path: str,
+                    timeout_s: float, connect_s: float = None, **kw) -> int:
+        async with self.session(lan).request(
+                method, f"http://{host}{path}",
+                headers={"Host": lan},
+                timeout=aiohttp.ClientTimeout(total=timeout_s, sock_connect=connect_s),
+                **kw) as r:
+            await r.read()  # drain so the connection goes back to the pool
+            return r.status
+
+    async def request(self, method: str, lan: str, path: str,
+                      timeout_s: float, **kw) -> int:
+        started = time.monotonic()
+        outcome = "error"
+        try:
+            status = await self._request(method, lan, path, timeout_s, **kw)
+            outcome = str(status)
+            return status
+        finally:
+            ESP32_HTTP_SECONDS.observe(time.monotonic() - started, method=method, outcome=outcome)
+
+    async def _request(self, method: str, lan: str, path: str,
+                       timeout_s: float, **kw) -> int:
+        if self.resolver is None:
+            return await self._send(method, lan, lan, path, timeout_s, **kw)
+
+        ip = await self.resolver.resolve(lan)
+        if ip is None:
+            raise aiohttp.ClientConnectionError(f"Cannot resolve {lan}")
+        started = time.monotonic()
+        try:
+            return await self._send(method, lan, ip, path, timeout_s,
+                                    min(timeout_s, CACHED_IP_CONNECT_TIMEOUT_S), **kw)
+        except STALE_IP_ERRORS:
+            # Device may have picked up a new DHCP lease; look it up once more
+            fresh = await self.resolver.resolve(lan, fresh=True)
+            if fresh is None or fresh == ip:
+                raise
+            remaining = max(timeout_s - (time.monotonic() - started), CACHED_IP_CONNECT_TIMEOUT_S)
+            return await self._send(method, lan, fresh, path, remaining, **kw)
+
+    async def get(self, lan: str, path: str, timeout_s: float) -> int:
+        return await self.request("GET", lan, path, timeout_s)
+
+    async def post(self, lan: str, path: str, json: dict, timeout_s: float) -> int:
+        return await self.request("POST", lan, path, timeout_s, json=json)
+
+    async def evict_idle(self):
+        now = time.monotonic()
+        for lan, last in list(self._last_used.items()):
+            if now - last >= self.idle_evict_s:
+                s = self._sessions.pop(lan, None)
+                self._last_used.pop(lan, None)
+                if s is not None:
+                    await s.close()
+                    log.info(f"Evicted idle session for {lan}")
+
+    async def _evict_loop(self):
+        while True:
+            await asyncio.sleep(self.idle_evict_s / 2)
+            await self.evict_idle()
+
+    def start(self):
+        if self._evictor is None:
+            self._evictor = asyncio.create_task(self._evict_loop())
+        if self.resolver is not None:
+            self.resolver.start()
+
+    async def close(self):
+        if self.resolver is not None:
+            self.resolver.stop()
+        if self._evictor is not None:
+            self._evictor.cancel()
+            self._evictor = None
+        for s in self._sessions.values():
+            await s.close()
+        self._sessions.clear()
+        self._last_used.clear()
+
+    def stats(self) -> dict:
+        """
+        Per-lanName counters: requests sent, connections opened, connections reused.
+        """
+        return {lan: dict(s) for lan, s in self._stats.items()}
+
+    async def __aenter__(self):
+        self.start()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
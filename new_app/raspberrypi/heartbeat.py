@@ -0,0 +1,98 @@
+import asyncio
+import logging
+import time
+from collections import deque
+
+from metrics import LATENCY_BUCKETS_S, metrics
+
+log = logging.getLogger("ws_client")
+
+# Cumulative, for the Prometheus scrape; pongPi gets the RttWindow instead
+RTT_SECONDS = metrics.histogram("homebase_ws_ping_seconds", "Heartbeat ping to pong round trip")
+
+
+class RttWindow:
+    """
+    The last <window> RTTs in ms, so a link that is getting worse shows up
+    now rather than after hours of older samples. Same buckets as
+    RTT_SECONDS.
+    """
+
+    def __init__(self, window: int = 120, buckets_s=LATENCY_BUCKETS_S):
+        self.buckets = tuple(round(b * 1000) for b in buckets_s)
+        self.samples = deque(maxlen=window)
+
+    def add(self, ms: float):
+        self.samples.append(ms)
+
+    def percentile(self, p: float):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+    def snapshot(self) -> dict:
+        counts = {str(b): 0 for b in self.buckets}
+        counts["+Inf"] = 0
+        for ms in self.samples:
+            for b in self.buckets:
+                if ms <= b:
+                    counts[str(b)] += 1
+                    break
+            else:
+                counts["+Inf"] += 1
+        return {
+            "samples": len(self.samples),
+            "buckets": counts,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+        }
+
+
+class Heartbeat:
+    """
+    Sends a websocket ping every <interval_s> and expects the pong within
+    <timeout_s>. A missed pong means the connection is half-open, so the
+    transport is aborted and the receive loop drops into reconnect.
+
+    mode "ping" runs the heartbeat, "off" leaves liveness to the websockets
+    library's own keepalive.
+    """
+
+    def __init__(self, mode: str = "ping", interval_s: float = 15, timeout_s: float = 10):
+        self.mode = mode
+        self.interval_s = interval_s
+        self.timeout_s = timeout_s
+        self.window = RttWindow()
+        self.last_ms = None
+        self.stalls = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.mode == "ping"
+
+    async def run(self, ws):
+        if not self.enabled:
+            return
+        while True:
+            await asyncio.sleep(self.interval_s)
+            started = time.monotonic()
+            try:
+                pong_waiter = await ws.ping()
+                await asyncio.wait_for(pong_waiter, self.timeout_s)
+            except asyncio.TimeoutError:
+                self.stalls += 1
+                log.warning(f"No pong within {self.timeout_s}s, dropping connection")
+                ws.transport.abort()
+                return
+            self.last_ms = round((time.monotonic() - started) * 1000, 1)
+            self.window.add(self.last_ms)
+            RTT_SECONDS.observe(self.last_ms / 1000)
+
+    def stats(self) -> dict:
+        return {
+            "mode": self.mode,
+            "lastMs": self.last_ms,
+            "stalls": self.stalls,
+            **self.window.snapshot(),
+        }
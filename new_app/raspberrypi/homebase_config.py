@@ -0,0 +1,193 @@
+import contextlib
+import fcntl
+import json
+import logging
+import os
+import sys
+import threading
+
+log = logging.getLogger("config")
+
+CONFIG_PATH = "/etc/homebase.json"
+SCHEMA_VERSION = 1
+
+# The backend every Pi script talks to (claim, device registration,
+# websocket). Set "backendHost" in the config to point a unit elsewhere.
+BACKEND_HOST = "35.223.147.76"
+BACKEND_HTTP_PORT = 3001
+BACKEND_WS_PORT = 8081
+
+# Single-value files the config replaces; read once to seed a new config
+LEGACY_FILES = {
+    "homebaseId": "/etc/homebase-id",
+    "homebaseToken": "/etc/homebase-token",
+    "wifiSsid": "/etc/wifi-ssid",
+    "wifiPassword": "/etc/wifi-pass",
+}
+
+
+def _migrate_v0(data: dict) -> dict:
+    # v0: the legacy files, collected as-is
+    return {k: v for k, v in data.items() if k in LEGACY_FILES and v}
+
+
+# version -> function upgrading a config of that version by one step
+MIGRATIONS = {0: _migrate_v0}
+
+
+class HomebaseConfig:
+    """
+    All persistent HomeBase state (ID, token, Wi-Fi credentials) in one
+    JSON file.
+
+    Writes go to a temp file in the same directory, are fsynced and then
+    renamed over the config (and the directory fsynced), so a power cut
+    leaves either the old or the new file, never a truncated one. Reads are
+    cached per process and only re-parsed when the file's mtime/inode
+    changes, which is how one process sees another's writes.
+    """
+
+    def __init__(self, path: str = CONFIG_PATH, legacy_files=None):
+        self.path = path
+        self.legacy_files = LEGACY_FILES if legacy_files is None else legacy_files
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._data = {}
+
+    # ---- reads ------------------------------------------------------------
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    def load(self) -> dict:
+        with self._lock:
+            return dict(self._load())
+
+    def _load(self, locked: bool = False) -> dict:
+        # Caller holds self._lock, and the file lock if <locked>
+        stamp = self._file_stamp()
+        if stamp is None:
+            if self._stamp is None and not self._data:
+                self._data = self._import_legacy(locked)
+            return self._data
+        if stamp != self._stamp:
+            try:
+                with open(self.path) as f:
+                    raw = json.load(f)
+            except (OSError, ValueError) as e:
+                # Can't happen through _write(); keep the last good copy
+                log.warning(f"Could not read {self.path}: {e}")
+                return self._data
+            self._data = self._upgrade(raw)
+            self._stamp = stamp
+        return self._data
+
+    def get(self, key: str, default=None):
+        return self.load().get(key, default)
+
+    def _import_legacy(self, locked: bool = False) -> dict:
+        data = {}
+        for key, path in self.legacy_files.items():
+            try:
+                with open(path) as f:
+                    data[key] = f.read().strip()
+            except OSError:
+                continue
+        if not data:
+            return {}
+        data = self._upgrade({"version": 0, **data})
+        try:
+            if locked:
+                return self._write_legacy(data)
+            # Same lock as update(): both write through {path}.tmp
+            with self._file_lock():
+                return self._write_legacy(data)
+        except OSError as e:
+            log.warning(f"Could not write {self.path}, using legacy files: {e}")
+        return data
+
+    def _write_legacy(self, data: dict) -> dict:
+        # Caller holds the file lock
+        if self._file_stamp() is not None:
+            return self._load(locked=True)  # another process got here first
+        log.info(f"Migrating {', '.join(sorted(data))} into {self.path}")
+        self._write(data)
+        return data
+
+    def _upgrade(self, raw: dict) -> dict:
+        version = raw.get("version", 0)
+        data = raw.get("values", raw) if version else raw
+        while version < SCHEMA_VERSION:
+            data = MIGRATIONS[version](data)
+            version += 1
+        if version > SCHEMA_VERSION:
+            log.warning(f"{self.path} is schema v{version}, newer than v{SCHEMA_VERSION}")
+        return data
+
+    # ---- writes -----------------------------------------------------------
+
+    def update(self, **values):
+        """
+        Set (or with None, remove) keys, atomically. Concurrent writers in
+        other processes are serialised with a lock file.
+        """
+        with self._lock, self._file_lock():
+            self._stamp = None  # re-read under the lock, another process may have written
+            data = dict(self._load(locked=True))
+            for key, value in values.items():
+                if value is None:
+                    data.pop(key, None)
+                else:
+                    data[key] = value
+            self._write(data)
+
+    @contextlib.contextmanager
+    def _file_lock(self):
+        with open(f"{self.path}.lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+    def _write(self, data: dict):
+        directory = os.path.dirname(self.path) or "."
+        tmp = f"{self.path}.tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump({"version": SCHEMA_VERSION, "values": data}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        dir_fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+        self._data = dict(data)
+        self._stamp = self._file_stamp()
+
+
+config = HomebaseConfig()
+
+
+def backend_http_url(path: str) -> str:
+    return f"http://{config.get('backendHost', BACKEND_HOST)}:{BACKEND_HTTP_PORT}{path}"
+
+
+def backend_ws_url() -> str:
+    return f"ws://{config.get('backendHost', BACKEND_HOST)}:{BACKEND_WS_PORT}"
+
+
+if __name__ == "__main__":
+    # For shell scripts: `homebase_config.py get homebaseToken` prints the
+    # value and exits 1 when it isn't set
+    if len(sys.argv) == 3 and sys.argv[1] == "get":
+        value = config.get(sys.argv[2])
+        if value is None:
+            sys.exit(1)
+        print(value)
+    else:
+        print(f"usage: {sys.argv[0]} get <key>", file=sys.stderr)
+        sys.exit(2)
@@ -0,0 +1,227 @@
+import startup_profile  # first, so HOMEBASE_PROFILE_STARTUP times everything below
+import asyncio
+import importlib
+import logging
+import signal
+import threading
+import time
+
+from homebase_config import config
+from homebase_logging import setup_logging
+
+log = logging.getLogger("daemon")
+
+# Modes
+PROVISIONING = "provisioning"  # BLE peripheral up, waiting for the app
+ONLINE = "online"              # websocket client up, ESP32 central on demand
+
+WS_RESTART_DELAY_S = 5
+
+
+class PeripheralSubsystem:
+    """
+    The bluezero provisioning server (pyserver.py), in-process.
+
+    bluezero needs a GLib main loop, so the first start() builds the
+    peripheral and runs its publish() in a dedicated thread for the life of
+    the daemon. stop()/start() after that only unregister/re-register the
+    advertisement and GATT application on that thread, so switching modes
+    doesn't re-export D-Bus objects or re-initialise the BLE stack.
+    """
+
+    def __init__(self, on_finish):
+        self.on_finish = on_finish  # (success, timer), called on the daemon loop
+        self.running = False
+        self._server = None         # the pyserver module, imported on first start
+        self._peripheral = None
+
+    async def _on_glib(self, fn):
+        from gi.repository import GLib
+        loop = asyncio.get_running_loop()
+        done = loop.create_future()
+
+        def call():
+            try:
+                fn()
+                loop.call_soon_threadsafe(done.set_result, None)
+            except Exception as e:
+                loop.call_soon_threadsafe(done.set_exception, e)
+            return False
+
+        GLib.idle_add(call)
+        await done
+
+    def _register(self):
+        p = self._peripheral
+        p.srv_mng.register_application(p.app, {})
+        p.ad_manager.register_advertisement(p.advert, {})
+
+    def _unregister(self):
+        p = self._peripheral
+        p.ad_manager.unregister_advertisement(p.advert)
+        p.srv_mng.unregister_application(p.app)
+
+    async def start(self):
+        if self.running:
+            return
+        loop = asyncio.get_running_loop()
+        if self._peripheral is None:
+            self._server = importlib.import_module("pyserver")
+            from bluezero import adapter
+
+            def finish(success):  # GLib thread
+                timer = self._server.provisioning.timer
+                loop.call_soon_threadsafe(self.on_finish, success, timer)
+
+            address = list(adapter.Adapter.available())[0].address
+            self._peripheral = self._server.build(address, on_finish=finish)
+            threading.Thread(target=self._peripheral.publish, name="glib", daemon=True).start()
+        else:
+            self._server.provisioning.reset()
+            await self._on_glib(self._register)
+        self.running = True
+        log.info("BLE provisioning server advertising")
+        startup_profile.mark("advertising", report=True)
+
+    async def stop(self):
+        if not self.running:
+            return
+        await self._on_glib(self._unregister)
+        self.running = False
+        log.info("BLE provisioning server stopped")
+
+
+class CentralSubsystem:
+    """
+    ble_provision.py's ESP32 provisioning, run as a task on the daemon loop
+    instead of a new process per start_provisioning.
+    """
+
+    def __init__(self):
+        self._task = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, expected: int = 1):
+        # Called synchronously from ws_client's message handler
+        if self.running:
+            log.info("ESP32 provisioning already running")
+            return
+        ble_provision = importlib.import_module("ble_provision")
+        self._task = asyncio.get_running_loop().create_task(ble_provision.run(expected))
+        self._task.add_done_callback(self._done)
+
+    @staticmethod
+    def _done(task):
+        if not task.cancelled() and task.exception():
+            log.warning(f"ESP32 provisioning failed: {task.exception()}")
+
+    async def stop(self):
+        if self.running:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+
+class WsClientSubsystem:
+    """
+    ws_client.connect_and_run() as a task. on_exit() is called if it returns
+    by itself (no token configured) rather than being stopped.
+    """
+
+    def __init__(self, central: CentralSubsystem, on_exit):
+        self.central = central
+        self.on_exit = on_exit
+        self._task = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self, onboarding=None):
+        if self.running:
+            return
+        ws_client = importlib.import_module("ws_client")
+        ws_client.start_esp32_provisioning = self.central.start
+        self._task = asyncio.create_task(ws_client.connect_and_run(onboarding))
+        self._task.add_done_callback(self._done)
+
+    def _done(self, task):
+        if task.cancelled():
+            return
+        if task.exception():
+            log.warning(f"Websocket client crashed: {task.exception()}")
+        self.on_exit()
+
+    async def stop(self):
+        if self.running:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+
+class HomebaseDaemon:
+    """
+    One long-lived process for the whole HomeBase: provisioning mode until
+    the HomeBase is claimed, then online mode. Subsystems are started and
+    stopped in-process, so a mode switch costs no interpreter start-up or
+    re-imports.
+    """
+
+    def __init__(self):
+        self.mode = None
+        self.central = CentralSubsystem()
+        self.peripheral = PeripheralSubsystem(self._provisioned)
+        self.ws = WsClientSubsystem(self.central, self._ws_exited)
+        self._switching = asyncio.Lock()
+        self._stop = None
+
+    async def enter(self, mode: str, onboarding=None):
+        async with self._switching:
+            started = time.monotonic()
+            if mode == ONLINE:
+                await self.peripheral.stop()
+                await self.ws.start(onboarding)
+            else:
+                await self.ws.stop()
+                await self.central.stop()
+                await self.peripheral.start()
+            self.mode = mode
+            log.info(f"{mode} mode in {(time.monotonic() - started) * 1000:.0f} ms")
+
+    def _provisioned(self, success, timer):
+        if not success:
+            return  # peripheral stays up for another attempt
+        if timer is not None:
+            timer.mark("handoff")
+        asyncio.get_running_loop().create_task(self.enter(ONLINE, timer))
+
+    def _ws_exited(self):
+        if self._stop is None or self._stop.is_set():
+            return
+        if config.get("homebaseToken"):
+            log.info(f"Websocket client exited, restarting in {WS_RESTART_DELAY_S}s")
+            asyncio.get_running_loop().call_later(
+                WS_RESTART_DELAY_S, lambda: asyncio.create_task(self.enter(ONLINE)))
+        else:
+            log.info("No HomeBase token, back to provisioning")
+            asyncio.get_running_loop().create_task(self.enter(PROVISIONING))
+
+    async def run(self):
+        self._stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self._stop.set)
+
+        await self.enter(ONLINE if config.get("homebaseToken") else PROVISIONING)
+        await self._stop.wait()
+
+        log.info("Shutting down")
+        await self.ws.stop()
+        await self.central.stop()
+        await self.peripheral.stop()
+
+
+if __name__ == "__main__":
+    setup_logging()
+    asyncio.run(HomebaseDaemon().run())
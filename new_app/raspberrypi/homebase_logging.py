@@ -0,0 +1,160 @@
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+# Everything the HomeBase logs, as JSON lines, rotated by size so the SD
+# card never fills up. onBoot.sh's onboot.log only keeps what bypasses
+# logging (bash, tracebacks from a crash at start-up).
+LOG_PATH = os.environ.get("HOMEBASE_LOG", "/home/admin/homebase.log")
+LOG_MAX_BYTES = 1_000_000
+LOG_BACKUPS = 3
+LOG_LEVEL = os.environ.get("HOMEBASE_LOG_LEVEL", "INFO")
+# "json" or "text" for the console copy (the file is always JSON)
+CONSOLE_FORMAT = os.environ.get("HOMEBASE_LOG_CONSOLE", "")
+
+# At most RATE_LIMIT_BURST records per call site (or per category, when the
+# caller passes extra={"category": ...}) in any RATE_LIMIT_WINDOW_S
+RATE_LIMIT_BURST = 10
+RATE_LIMIT_WINDOW_S = 60
+
+_listener = None
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Drops repeats of the same message source past a burst per window, and
+    notes how many were dropped on the first record of the next window.
+    Records are keyed by their "category" attribute, else by call site, so
+    e.g. every reconnect failure counts against one budget.
+    """
+
+    def __init__(self, burst: int = RATE_LIMIT_BURST, window_s: float = RATE_LIMIT_WINDOW_S):
+        super().__init__()
+        self.burst = burst
+        self.window_s = window_s
+        self._lock = threading.Lock()  # GLib thread and event loop both log
+        self._windows = {}             # key -> [window start, count, suppressed]
+
+    def filter(self, record) -> bool:
+        key = getattr(record, "category", None) or (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.window_s:
+                suppressed = window[2] if window is not None else 0
+                self._windows[key] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            if window[1] < self.burst:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line: ts, level, logger, msg plus category,
+    suppressed and exc when present.
+    """
+
+    def format(self, record) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for attr in ("category", "suppressed"):
+            if hasattr(record, attr):
+                entry[attr] = getattr(record, attr)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__("%(asctime)s [%(name)s] %(levelname)s %(message)s",
+                         "%Y-%m-%d %H:%M:%S")
+
+    def format(self, record) -> str:
+        line = super().format(record)
+        if getattr(record, "suppressed", 0):
+            line += f" ({record.suppressed} similar suppressed)"
+        return line
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # Render the message now (args may change later) but keep the
+        # traceback out of it, so JSON output gets it as its own field
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(path: str = LOG_PATH, level: str = LOG_LEVEL, console: str = CONSOLE_FORMAT):
+    """
+    Route the root logger through a queue to a writer thread, so a log call
+    on the event loop or GLib thread never waits on the SD card. Safe to
+    call more than once; only the first call configures anything.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    handlers = []
+    try:
+        file_handler = logging.handlers.RotatingFileHandler(
+            path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding="utf-8")
+        file_handler.setFormatter(JsonFormatter())
+        handlers.append(file_handler)
+    except OSError as e:
+        print(f"[log] Could not open {path}, logging to stderr: {e}", file=sys.stderr)
+        console = console or "text"
+    if console or sys.stderr.isatty():
+        console_handler = logging.StreamHandler(sys.stderr)
+        console_handler.setFormatter(JsonFormatter() if console == "json" else TextFormatter())
+        handlers.append(console_handler)
+
+    records = queue.SimpleQueue()
+    queue_handler = _QueueHandler(records)
+    queue_handler.addFilter(RateLimitFilter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(level)
+    # bluezero/bleak/websockets are chatty at INFO
+    for noisy in ("websockets", "bleak", "bluezero", "aiohttp"):
+        logging.getLogger(noisy).setLevel(logging.WARNING)
+
+    _listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging():
+    """
+    Write out everything still queued. atexit does this, but exec() skips
+    atexit, so call it before replacing the process.
+    """
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
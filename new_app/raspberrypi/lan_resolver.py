@@ -0,0 +1,85 @@
+import asyncio
+import logging
+import socket
+import time
+
+log = logging.getLogger("resolver")
+
+
+class LanResolver:
+    """
+    Caches lanName -> IP so each ESP32 request doesn't pay for an mDNS lookup.
+
+    Successful lookups live for <ttl_s>, failed ones for <negative_ttl_s>.
+    A background task re-resolves entries that are still in use before they
+    expire, so the hot path almost never has to wait on Avahi.
+    """
+
+    def __init__(self, ttl_s: float = 300, negative_ttl_s: float = 30,
+                 refresh_ahead_s: float = 60, lookup_timeout_s: float = 3):
+        self.ttl_s = ttl_s
+        self.negative_ttl_s = negative_ttl_s
+        self.refresh_ahead_s = refresh_ahead_s
+        self.lookup_timeout_s = lookup_timeout_s
+        self._cache = {}      # lanName -> (ip or None, expires_at)
+        self._last_used = {}  # lanName -> time.monotonic()
+        self._inflight = {}   # lanName -> asyncio.Task, so lookups aren't duplicated
+        self._refresher = None
+
+    async def _lookup(self, lan: str):
+        loop = asyncio.get_running_loop()
+        try:
+            infos = await asyncio.wait_for(
+                loop.getaddrinfo(lan, 80, family=socket.AF_INET, type=socket.SOCK_STREAM),
+                self.lookup_timeout_s,
+            )
+            ip = infos[0][4][0]
+        except (OSError, asyncio.TimeoutError, IndexError) as e:
+            log.warning(f"Could not resolve {lan}: {e}")
+            ip = None
+        ttl = self.ttl_s if ip else self.negative_ttl_s
+        self._cache[lan] = (ip, time.monotonic() + ttl)
+        return ip
+
+    async def _lookup_once(self, lan: str):
+        task = self._inflight.get(lan)
+        if task is None:
+            task = self._inflight[lan] = asyncio.create_task(self._lookup(lan))
+            task.add_done_callback(lambda _: self._inflight.pop(lan, None))
+        return await asyncio.shield(task)
+
+    async def resolve(self, lan: str, fresh: bool = False):
+        """
+        IP for <lan>, or None if it recently failed to resolve.
+        Pass fresh=True to skip the cache (e.g. after a connection failure).
+        """
+        self._last_used[lan] = time.monotonic()
+        if not fresh:
+            entry = self._cache.get(lan)
+            if entry and entry[1] > time.monotonic():
+                return entry[0]
+        return await self._lookup_once(lan)
+
+    def invalidate(self, lan: str):
+        self._cache.pop(lan, None)
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_ahead_s / 2)
+            now = time.monotonic()
+            for lan, (ip, expires_at) in list(self._cache.items()):
+                # Only keep warm what someone has asked for within a TTL
+                if now - self._last_used.get(lan, 0) > self.ttl_s:
+                    self._cache.pop(lan, None)
+                    self._last_used.pop(lan, None)
+                elif expires_at - now <= self.refresh_ahead_s:
+                    asyncio.create_task(self._lookup_once(lan))
+
+    def start(self):
+        if self._refresher is None:
+            self._refresher = asyncio.create_task(self._refresh_loop())
+
+    def stop(self):
+        if self._refresher is not None:
+            self._refresher.cancel()
+            self._refresher = None
@@ -0,0 +1,133 @@
+import logging
+import time
+
+from metrics import metrics
+
+
+MESSAGES = metrics.counter(
+    "homebase_messages_total", "Backend messages by type and outcome (ok, invalid, error)",
+    labels=("type", "outcome"))
+# Receive until the handler returns, i.e. its reply is queued
+HANDLER_SECONDS = metrics.histogram(
+    "homebase_receive_to_ack_seconds", "Backend message received until its handler returned",
+    labels=("type",))
+
+
+class InvalidMessage(ValueError):
+    pass
+
+
+class OptionalField:
+    """
+    Marks a schema field as optional; None is accepted as absent.
+    """
+
+    def __init__(self, *types):
+        self.types = types
+
+
+def compile_schema(schema: dict):
+    """
+    Turn {"field": type | (types,) | OptionalField(types)} into a validator that
+    raises InvalidMessage, so each message is checked without re-reading the
+    schema.
+    """
+    checks = []
+    for field, spec in (schema or {}).items():
+        required = not isinstance(spec, OptionalField)
+        types = spec.types if not required else spec if isinstance(spec, tuple) else (spec,)
+        # JSON true/false must not pass as a number
+        strict_bool = bool not in types and any(issubclass(int, t) for t in types)
+        checks.append((field, required, types, strict_bool))
+
+    def validate(data: dict):
+        for field, required, types, strict_bool in checks:
+            value = data.get(field)
+            if value is None:
+                if required:
+                    raise InvalidMessage(f"missing {field}")
+                continue
+            if not isinstance(value, types) or (strict_bool and isinstance(value, bool)):
+                raise InvalidMessage(f"{field} is {type(value).__name__}")
+
+    return validate
+
+
+class _Handler:
+    def __init__(self, fn, validate, on_invalid=None):
+        self.fn = fn
+        self.validate = validate
+        self.on_invalid = on_invalid
+
+
+class MessageRegistry:
+    """
+    Message type -> handler coroutine, with the payload schema checked before
+    the handler runs. Per-type outcomes and handler latency go to metrics.py.
+
+    New message kinds register themselves with @registry.handler(...); the
+    receive loop only ever calls dispatch().
+    """
+
+    def __init__(self, name: str = "ws_client"):
+        self.name = name
+        self.log = logging.getLogger(name)
+        self._handlers = {}
+
+    def handler(self, msg_type: str, schema: dict = None, on_invalid=None):
+        """
+        Register fn(*context, data) for msg_type. on_invalid(*context, data,
+        error), if given, answers a message that fails the schema (e.g. with
+        a failure ack) instead of just dropping it.
+        """
+        def register(fn):
+            if msg_type in self._handlers:
+                raise ValueError(f"{msg_type} already has a handler")
+            self._handlers[msg_type] = _Handler(fn, compile_schema(schema), on_invalid)
+            return fn
+        return register
+
+    def types(self) -> list:
+        return list(self._handlers)
+
+    def __contains__(self, msg_type) -> bool:
+        return msg_type in self._handlers
+
+    async def dispatch(self, data: dict, *context):
+        """
+        Run the handler for data["type"] as handler(*context, data). Returns
+        False if the message was unknown, invalid or its handler raised.
+        """
+        if not isinstance(data, dict) or not isinstance(data.get("type"), str):
+            MESSAGES.inc(type="unknown", outcome="invalid")
+            self.log.warning(f"Dropping message without a type: {data!r:.100}")
+            return False
+        entry = self._handlers.get(data["type"])
+        if entry is None:
+            # Unknown types share one series so a bad peer can't add labels
+            MESSAGES.inc(type="unknown", outcome="unknown")
+            self.log.warning(f"No handler for message type {data['type']!r}")
+            return False
+        try:
+            entry.validate(data)
+        except InvalidMessage as e:
+            MESSAGES.inc(type=data["type"], outcome="invalid")
+            self.log.warning(f"Dropping invalid {data['type']}: {e}")
+            if entry.on_invalid is not None:
+                try:
+                    await entry.on_invalid(*context, data, e)
+                except Exception:
+                    self.log.exception(f"Error rejecting {data['type']}")
+            return False
+        started = time.monotonic()
+        outcome = "error"
+        try:
+            await entry.fn(*context, data)
+            outcome = "ok"
+            return True
+        except Exception:
+            self.log.exception(f"Error processing {data['type']}")
+            return False
+        finally:
+            MESSAGES.inc(type=data["type"], outcome=outcome)
+            HANDLER_SECONDS.observe(time.monotonic() - started, type=data["type"])
@@ -0,0 +1,231 @@
+import asyncio
+import logging
+import os
+
+log = logging.getLogger("metrics")
+
+# Local scrape endpoint: http://127.0.0.1:<port>/metrics in the Prometheus
+# text format. "0" turns it off.
+METRICS_PORT = int(os.environ.get("HOMEBASE_METRICS_PORT", "9101"))
+METRICS_HOST = "127.0.0.1"
+
+# Upper bounds (seconds) for latency histograms; ESP32s and the backend are
+# both in the 10 ms - few s range
+LATENCY_BUCKETS_S = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._values = {}  # label values tuple -> value
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(n, "") for n in self.label_names)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in self._values.items():
+            lines.append(f"{self.name}{_labels(self.label_names, key)} {value}")
+        return lines
+
+    def snapshot(self):
+        if not self.label_names:
+            return self._values.get((), 0)
+        return {"/".join(key): value for key, value in self._values.items()}
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """
+    set() it, or give it a function that is read at scrape time (queue
+    depths and the like, so the hot path doesn't update anything).
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help_text: str, labels=(), fn=None):
+        super().__init__(name, help_text, labels)
+        self.fn = fn
+
+    def set(self, value: float, **labels):
+        self._values[self._key(labels)] = value
+
+    def _read(self):
+        if self.fn is not None:
+            try:
+                self._values[()] = self.fn()
+            except Exception:
+                pass  # e.g. the outbox is closed during shutdown
+
+    def render(self) -> list:
+        self._read()
+        return super().render()
+
+    def snapshot(self):
+        self._read()
+        return super().snapshot()
+
+
+class Histogram(_Metric):
+    """
+    Cumulative fixed buckets since start, as Prometheus expects; rates and
+    quantiles are computed by whoever scrapes it.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels=(), buckets=LATENCY_BUCKETS_S):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        series = self._values.get(key)
+        if series is None:
+            series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        counts = series[0]
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[i] += 1
+                break
+        else:
+            counts[-1] += 1
+        series[1] += value
+        series[2] += 1
+
+    def quantile(self, q: float, **labels):
+        """
+        Upper bound of the bucket holding the q-th quantile (None with no
+        samples, inf past the last bucket). Coarse, but enough for a log line.
+        """
+        series = self._values.get(self._key(labels))
+        if series is None:
+            return None
+        counts, _, count = series
+        rank, seen = q * count, 0
+        for bound, n in zip(self.buckets + (float("inf"),), counts):
+            seen += n
+            if n and seen >= rank:
+                return bound
+        return float("inf")
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        names = self.label_names + ("le",)
+        for key, (counts, total, count) in self._values.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets + ("+Inf",), counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_labels(names, key + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, key)} {total}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, key)} {count}")
+        return lines
+
+    def snapshot(self):
+        out = {}
+        for key, (counts, total, count) in self._values.items():
+            out["/".join(key) or "all"] = {
+                "count": count,
+                "sumS": round(total, 4),
+                "buckets": dict(zip([str(b) for b in self.buckets] + ["+Inf"], counts)),
+            }
+        return out
+
+
+class MetricsRegistry:
+    """
+    In-process counters, gauges and histograms. Updating one is a dict
+    lookup and an add, so they can sit on the message hot path where a
+    log line would not.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _add(self, metric):
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing  # modules imported twice (daemon + script) share it
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help_text: str, labels=()) -> Counter:
+        return self._add(Counter(name, help_text, labels))
+
+    def gauge(self, name: str, help_text: str, labels=(), fn=None) -> Gauge:
+        return self._add(Gauge(name, help_text, labels, fn))
+
+    def histogram(self, name: str, help_text: str, labels=(),
+                  buckets=LATENCY_BUCKETS_S) -> Histogram:
+        return self._add(Histogram(name, help_text, labels, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> dict:
+        """
+        Compact JSON form for pongPi.
+        """
+        return {name: m.snapshot() for name, m in self._metrics.items()}
+
+    # ---- local endpoint ---------------------------------------------------
+
+    async def _serve_client(self, reader, writer):
+        try:
+            request = await asyncio.wait_for(reader.readline(), 5)
+            path = request.split()[1].decode() if len(request.split()) > 1 else "/"
+            if path == "/metrics":
+                body, status = self.render().encode(), "200 OK"
+            else:
+                body, status = b"not found\n", "404 Not Found"
+            writer.write(f"HTTP/1.0 {status}\r\n"
+                         "Content-Type: text/plain; version=0.0.4\r\n"
+                         f"Content-Length: {len(body)}\r\n\r\n".encode() + body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError, UnicodeDecodeError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, port: int = METRICS_PORT, host: str = METRICS_HOST):
+        """
+        Start the scrape endpoint; returns the asyncio server, or None if
+        disabled or the port is taken.
+        """
+        if not port:
+            return None
+        try:
+            server = await asyncio.start_server(self._serve_client, host, port)
+        except OSError as e:
+            log.warning(f"Could not listen on {host}:{port}: {e}")
+            return None
+        log.info(f"Serving http://{host}:{port}/metrics")
+        return server
+
+
+metrics = MetricsRegistry()
@@ -1,6 +1,19 @@
 #!/bin/bash
+# The daemon logs to /home/admin/homebase.log (rotated by homebase_logging.py);
+# this file only gets bash output and crashes, but rotate it too so it can't
+# grow without bound across boots
+BOOT_LOG=/home/admin/onboot.log
+BOOT_LOG_MAX_BYTES=1000000
+BOOT_LOG_BACKUPS=3
+if [ -f "$BOOT_LOG" ] && [ "$(stat -c %s "$BOOT_LOG")" -gt "$BOOT_LOG_MAX_BYTES" ]; then
+    for i in $(seq $((BOOT_LOG_BACKUPS - 1)) -1 1); do
+        [ -f "$BOOT_LOG.$i" ] && mv -f "$BOOT_LOG.$i" "$BOOT_LOG.$((i + 1))"
+    done
+    mv -f "$BOOT_LOG" "$BOOT_LOG.1"
+fi
+
 # Log everything to file
-exec >> /home/admin/onboot.log 2>&1
+exec >> "$BOOT_LOG" 2>&1
 echo "[boot] Launching at $(date)"
 
 # Bluetooth setup
@@ -12,10 +25,7 @@ EOF
 sleep 2 
 bluetoothctl show
 
-if [ -f /etc/homebase-token ]; then
-    echo "[boot] Found token, launching WebSocket client..."
-    sudo python3 /home/admin/ws_client.py
-else
-    echo "[boot] No token, starting BLE provisioning..."
-    sudo python3 /home/admin/pyserver.py
-fi
\ No newline at end of file
+# One process for everything: it picks provisioning or online mode from
+# /etc/homebase.json and switches in-process (see homebase_daemon.py)
+echo "[boot] Launching HomeBase daemon..."
+sudo python3 /home/admin/homebase_daemon.py
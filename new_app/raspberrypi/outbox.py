@@ -0,0 +1,56 @@
+import json
+import sqlite3
+import time
+
+OUTBOX_DB = "/home/admin/ws_outbox.db"
+
+
+class Outbox:
+    """
+    Small SQLite store on the Pi for outbound frames (acks, telemetry) that
+    couldn't be sent because the backend socket was down; they're drained
+    in order after the next register.
+    """
+
+    def __init__(self, path: str = OUTBOX_DB, max_pending: int = 1000):
+        self.max_pending = max_pending
+        self.db = sqlite3.connect(path, isolation_level=None)  # autocommit
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id      INTEGER PRIMARY KEY AUTOINCREMENT,
+                payload TEXT NOT NULL,
+                created REAL NOT NULL
+            )""")
+        # The backend never resends a msgId, so per-command results were
+        # never read back; drop the table older versions created
+        self.db.execute("DROP TABLE IF EXISTS commands")
+
+    # ---- store-and-forward ----------------------------------------------
+
+    def put(self, payload: dict):
+        self.db.execute("INSERT INTO outbox (payload, created) VALUES (?, ?)",
+                        (json.dumps(payload), time.time()))
+        # Bounded: if we're offline for days, keep the newest frames
+        self.db.execute("""
+            DELETE FROM outbox WHERE id NOT IN
+                (SELECT id FROM outbox ORDER BY id DESC LIMIT ?)""",
+                        (self.max_pending,))
+
+    def peek(self, limit: int = 50):
+        """
+        Oldest <limit> queued frames as [(id, payload), ...].
+        """
+        rows = self.db.execute(
+            "SELECT id, payload FROM outbox ORDER BY id LIMIT ?", (limit,)).fetchall()
+        return [(row_id, json.loads(payload)) for row_id, payload in rows]
+
+    def remove(self, ids):
+        self.db.executemany("DELETE FROM outbox WHERE id = ?", [(i,) for i in ids])
+
+    def pending(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def close(self):
+        self.db.close()
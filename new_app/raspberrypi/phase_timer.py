@@ -0,0 +1,82 @@
+import json
+import logging
+import os
+import time
+import uuid
+from contextlib import contextmanager
+
+log = logging.getLogger("timing")
+
+PHASE_LOG = "/home/admin/onboarding-phases.jsonl"
+
+# Carries "<session>:<start>" across os.execlp so ws_client.py can finish
+# the same onboarding session. time.monotonic() is system-wide on Linux,
+# so the start stamp stays valid in the new process.
+SESSION_ENV = "HOMEBASE_ONBOARDING_SESSION"
+
+
+class PhaseTimer:
+    """
+    Monotonic timestamps for each onboarding phase of one session, appended
+    to <path> as JSON lines and summarised for the claim / register messages.
+    """
+
+    def __init__(self, session: str = None, started: float = None, path: str = PHASE_LOG):
+        self.session = session or uuid.uuid4().hex[:12]
+        self.started = started if started is not None else time.monotonic()
+        self.path = path
+        self.durations = {}  # phase -> seconds
+        self.marks = {}      # event -> seconds since session start
+
+    @classmethod
+    def resume(cls, path: str = PHASE_LOG):
+        """
+        The session handed over by the previous process, or None.
+        """
+        handed_over = os.environ.get(SESSION_ENV)
+        if not handed_over:
+            return None
+        session, started = handed_over.rsplit(":", 1)
+        return cls(session, float(started), path)
+
+    def handoff(self):
+        """
+        Export the session so a process started via exec/Popen can resume it.
+        """
+        os.environ[SESSION_ENV] = f"{self.session}:{self.started}"
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def _log(self, record: dict):
+        record = {"session": self.session, "ts": time.time(), **record}
+        try:
+            with open(self.path, "a") as f:
+                f.write(json.dumps(record) + "\n")
+        except OSError as e:
+            log.warning(f"Could not write {self.path}: {e}")
+
+    def mark(self, event: str):
+        at = round(self.elapsed(), 3)
+        self.marks[event] = at
+        self._log({"event": event, "at": at})
+
+    def record(self, phase: str, seconds: float):
+        self.durations[phase] = round(seconds, 3)
+        self._log({"phase": phase, "at": round(self.elapsed(), 3), "duration": self.durations[phase]})
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(name, time.monotonic() - started)
+
+    def summary(self) -> dict:
+        return {
+            "session": self.session,
+            "phasesMs": {k: round(v * 1000) for k, v in self.durations.items()},
+            "marksMs": {k: round(v * 1000) for k, v in self.marks.items()},
+            "elapsedMs": round(self.elapsed() * 1000),
+        }
@@ -0,0 +1,205 @@
+import asyncio
+import logging
+import threading
+
+from gi.repository import GLib
+
+from phase_timer import PhaseTimer
+import wifi_backend
+
+log = logging.getLogger("server")
+
+# Status codes on the status characteristic
+STATUS_IDLE = 0x00
+STATUS_WIFI_CONNECTING = 0x01
+STATUS_WIFI_SUCCESS = 0x02
+STATUS_CLAIM_SUCCESS = 0x03
+STATUS_WIFI_FAILED = 0x04
+STATUS_CLAIM_FAILED = 0x05
+# Intermediate Wi-Fi progress, streamed while connecting
+STATUS_WIFI_ASSOCIATING = 0x06
+STATUS_WIFI_AUTHENTICATING = 0x07
+STATUS_WIFI_GETTING_IP = 0x08
+# Bundled credentials write was malformed; the app should resend it
+STATUS_CREDENTIALS_INVALID = 0x09
+
+WIFI_PROGRESS_STATUS = {
+    wifi_backend.ASSOCIATING: (STATUS_WIFI_ASSOCIATING, "WiFi associating"),
+    wifi_backend.AUTHENTICATING: (STATUS_WIFI_AUTHENTICATING, "WiFi authenticating"),
+    wifi_backend.GETTING_IP: (STATUS_WIFI_GETTING_IP, "WiFi getting IP"),
+}
+
+# States
+# Time between the final status notification and on_finish. on_finish may
+# exec ws_client or unregister the GATT app, and a notification still
+# queued for bluetoothd would be lost; the phone then reports failure.
+FINISH_GRACE_MS = 1000
+
+IDLE = "idle"
+WIFI_CONNECTING = "wifi_connecting"
+CLAIMING = "claiming"
+DONE = "done"
+
+
+class ProvisioningStateMachine:
+    """
+    Drives one provisioning session: idle -> wifi_connecting -> claiming -> done.
+
+    bluezero owns the GLib main loop, so the machine runs its coroutines on
+    an asyncio loop in a companion thread. BLE write callbacks (GLib thread)
+    post into it under a lock; status updates and the finish hook are posted
+    back to the GLib thread with GLib.idle_add, since bluezero objects must
+    only be touched there. Each step starts the moment the previous one
+    finishes.
+
+    A PhaseTimer session starts with the first credential write; <timer>
+    holds it so the claim can carry the summary and a successful session
+    can be handed over to ws_client.py.
+
+    <wifi> is a wifi_backend.WifiBackend; its connect() runs on the loop and
+    its progress is streamed as intermediate status codes. wait_network()
+    -> bool and claim(token) -> bool may block; they run in the executor.
+    """
+
+    FIELDS = ("ssid", "password", "token")
+
+    def __init__(self, wifi, claim, set_status, on_finish=None, on_wifi_ok=None,
+                 wait_network=None):
+        self.wifi = wifi
+        self.wait_network = wait_network  # optional: block until an address/route is up
+        self.claim = claim
+        self.set_status = set_status      # (code) -> None, called on the GLib thread
+        self.on_finish = on_finish        # (success) -> None, called on the GLib thread
+        self.on_wifi_ok = on_wifi_ok      # (ssid, password) -> None, e.g. persist creds
+        self.state = IDLE
+        self.credentials = dict.fromkeys(self.FIELDS)
+        self.notifications_enabled = False
+        self.timer = None                 # PhaseTimer for the current session
+        self._lock = threading.Lock()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever,
+                                        name="provisioning", daemon=True)
+        self._thread.start()
+
+    # ---- events from BLE callbacks (GLib thread) ------------------------
+
+    def set_credential(self, field: str, value: str):
+        self.set_credentials({field: value})
+
+    def set_credentials(self, fields: dict):
+        """
+        Set several fields at once (the bundled characteristic), so the
+        session is considered for starting once rather than per field.
+        """
+        with self._lock:
+            if self.state != IDLE:
+                log.info(f"Ignoring {', '.join(fields)} write while {self.state}")
+                return
+            if self.timer is None:
+                self.timer = PhaseTimer()
+                self.timer.mark("ble_first_write")
+            self.credentials.update((k, v) for k, v in fields.items() if k in self.FIELDS)
+            self._maybe_start()
+
+    def reject_credentials(self, reason: str):
+        log.warning(f"Rejected credentials bundle: {reason}")
+        GLib.idle_add(self._call_once, self.set_status, STATUS_CREDENTIALS_INVALID)
+
+    def set_notifying(self, notifying: bool):
+        with self._lock:
+            self.notifications_enabled = notifying
+            if notifying and self.state == IDLE:
+                self._maybe_start()
+
+    def _maybe_start(self):
+        # Caller holds the lock
+        if self.notifications_enabled and all(self.credentials.values()):
+            self.state = WIFI_CONNECTING
+            self.timer.mark("ble_credentials_complete")
+            session = dict(self.credentials)
+            asyncio.run_coroutine_threadsafe(self._run(session), self._loop)
+
+    def submit(self, coro):
+        """
+        Run a background coroutine (e.g. the Wi-Fi scanner) on the machine's loop.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def is_idle(self) -> bool:
+        return self.state == IDLE
+
+    def reset(self):
+        """
+        Back to idle for a new session, e.g. when the daemon re-enters
+        provisioning mode after a previous session finished.
+        """
+        with self._lock:
+            if self.state in (WIFI_CONNECTING, CLAIMING):
+                log.info(f"Not resetting mid-session ({self.state})")
+                return
+            self.state = IDLE
+            self.credentials = dict.fromkeys(self.FIELDS)
+            self.timer = None
+
+    # ---- the session itself (asyncio thread) -----------------------------
+
+    def _status(self, code: int, message: str):
+        log.info(f"Sent status: 0x{code:02X} ({message})")
+        GLib.idle_add(self._call_once, self.set_status, code)
+
+    @staticmethod
+    def _call_once(fn, *args):
+        fn(*args)
+        return False  # don't repeat the idle callback
+
+    def _enter(self, state: str):
+        with self._lock:
+            self.state = state
+
+    async def _timed(self, phase: str, fn, *args):
+        with self.timer.phase(phase):
+            return await self._loop.run_in_executor(None, fn, *args)
+
+    def _wifi_progress(self, stage: str):
+        if stage in WIFI_PROGRESS_STATUS:
+            self._status(*WIFI_PROGRESS_STATUS[stage])
+
+    async def _run(self, session: dict):
+        success = False
+        try:
+            self._status(STATUS_WIFI_CONNECTING, "WiFi connecting")
+            with self.timer.phase("wifi_connect"):
+                wifi_ok = await self.wifi.connect(session["ssid"], session["password"],
+                                                  progress=self._wifi_progress)
+            if not wifi_ok:
+                self._status(STATUS_WIFI_FAILED, "WiFi failed")
+                return
+            if self.on_wifi_ok:
+                self.on_wifi_ok(session["ssid"], session["password"])
+            self._status(STATUS_WIFI_SUCCESS, "WiFi success")
+            if self.wait_network:
+                await self._timed("network_ready", self.wait_network)
+
+            self._enter(CLAIMING)
+            if not await self._timed("claim", self.claim, session["token"]):
+                self._status(STATUS_CLAIM_FAILED, "Claim failed")
+                return
+            self._status(STATUS_CLAIM_SUCCESS, "Claim success")
+            success = True
+        except Exception as e:
+            log.warning(f"Provisioning error: {e}")
+            self._status(STATUS_IDLE, "Error")
+        finally:
+            self.timer.mark("provisioning_done" if success else "provisioning_failed")
+            log.info(f"Provisioning {'succeeded' if success else 'failed'}; timings: {self.timer.summary()}")
+            self._finish(success)
+
+    def _finish(self, success: bool):
+        with self._lock:
+            self.state = DONE if success else IDLE
+            self.credentials = dict.fromkeys(self.FIELDS)
+            if not success:
+                self.timer = None  # next attempt is a new session
+        log.info("Provisioning session reset.")
+        if self.on_finish:
+            GLib.timeout_add(FINISH_GRACE_MS, self._call_once, self.on_finish, success)
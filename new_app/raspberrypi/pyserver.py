@@ -1,11 +1,21 @@
+import startup_profile  # first, so HOMEBASE_PROFILE_STARTUP times everything below
+from gi.repository import GLib
 import logging
-import requests
-from bluezero import async_tools, adapter, peripheral
-import time
-import threading
 import sys
-import subprocess
-import os, signal
+import os
+import socket
+import time
+
+import chunked_transfer
+from chunked_transfer import TransferReceiver
+from credential_bundle import CredentialAssembler, decode_bundle
+from homebase_config import backend_http_url, config
+from homebase_logging import setup_logging, stop_logging
+from provisioning import ProvisioningStateMachine
+import wifi_backend
+from wifi_scanner import WifiScanner
+
+log = logging.getLogger("server")
 
 # UUIDs
 WIFI_SERVICE_UUID = '12345678-1234-5678-1234-56789abcdef0'
@@ -14,176 +24,182 @@ WIFI_PASSWORD_UUID = '12345678-1234-5678-1234-56789abcdef2'
 WIFI_STATUS_UUID = '12345678-1234-5678-1234-56789abcdef3'
 HOMEBASE_ID_UUID = '12345678-1234-5678-1234-56789abcdef4'
 USER_TOKEN_UUID = '12345678-1234-5678-1234-56789abcdef5'
+WIFI_SCAN_UUID = '12345678-1234-5678-1234-56789abcdef6'
+CREDENTIALS_UUID = '12345678-1234-5678-1234-56789abcdef7'
+TRANSFER_UUID = '12345678-1234-5678-1234-56789abcdef8'
 
 # Globals
-wifi_ssid = None
-wifi_password = None
-user_token = None
 status_characteristic = None
 homebase_id_characteristic = None
 homebase_id = None
-
-provisioning_in_progress = False
-notifications_enabled = False
+provisioning = None
+scanner = None
+scan_characteristic = None
+credential_assembler = CredentialAssembler()
+transfer_characteristic = None
+transfer_receiver = None
 
 
-BACKEND_URL = "http://35.223.147.76:3001/homebase/claim"  # Update as needed
+BACKEND_URL = backend_http_url("/homebase/claim")
 
 def read_homebase_id():
-    try:
-        with open('/etc/homebase-id', 'r') as f:
-            return f.read().strip()
-    except Exception as e:
-        print(f"Error reading HomeBase ID: {e}")
+    homebase_id = config.get("homebaseId")
+    if not homebase_id:
+        log.warning(f"Error reading HomeBase ID: not set in {config.path}")
         return "UNKNOWN-HOMEBASE-ID"
-
-def connect_to_wifi(ssid, password):
-    print(f"Connecting to SSID: {ssid}, Password: {password}")
-    try:
-        # Remove old connection if it exists
-        subprocess.run(['nmcli', 'connection', 'delete', ssid], check=False, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        # Try to connect
-        result = subprocess.run(
-            ['nmcli', 'device', 'wifi', 'connect', ssid, 'password', password],
-            capture_output=True, text=True, timeout=20
-        )
-        if result.returncode == 0:
-            print("✅ Connected to WiFi successfully.")
-            return True
-        else:
-            print(f"❌ Failed to connect to WiFi: {result.stderr}")
-            return False
-    except Exception as e:
-        print(f"Error connecting to WiFi: {e}")
-        return False
-
-
-def claim_homebase(homebase_id, token):
+    return homebase_id
+
+def wait_for_network(timeout_s=10):
+    """
+    Block until there's a route to the backend (DHCP done), up to <timeout_s>.
+    """
+    host = BACKEND_URL.split("//", 1)[1].split(":", 1)[0].split("/", 1)[0]
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        try:
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+                s.connect((host, 80))  # UDP: no packet sent, just a route lookup
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def claim_homebase(homebase_id, token, timings=None):
+    import requests  # slow to import and only needed once, at claim time
     try:
         res = requests.post(
             BACKEND_URL,
-            json={"homebaseId": homebase_id, "online": True},
+            json={"homebaseId": homebase_id, "online": True, "onboarding": timings},
             headers={"Authorization": f"Bearer {token}"},
             timeout=5
         )
         if res.status_code == 200:
-            print("✅ HomeBase claimed")
+            log.info("✅ HomeBase claimed")
             try:
-                with open('/etc/homebase-token', 'w') as f:
-                    data = res.json()
-                    print(data)
-                    f.write(data["homeBase"]["homebaseToken"])
+                data = res.json()
+                config.update(homebaseToken=data["homeBase"]["homebaseToken"])
             except Exception as e:
-                print(f"Failed to save to homebase credentials: {e}")
+                log.warning(f"Failed to save to homebase credentials: {e}")
             return True
         else:
-            print(f"❌ Claim failed: {res.status_code} {res.text}")
+            log.warning(f"❌ Claim failed: {res.status_code} {res.text}")
             return False
     except Exception as e:
-        print(f"Error claiming HomeBase: {e}")
+        log.warning(f"Error claiming HomeBase: {e}")
         return False
 
-def try_connect():
-    global wifi_ssid, wifi_password, user_token, provisioning_in_progress
-    provisioning_in_progress = True
-
-    def send_status(status, message, delay=1.0, next_func=None):
-        def inner():
-            status_characteristic.set_value([status])
-            print(f"Sent status: 0x{status:02X} ({message})")
-            if next_func:
-                threading.Timer(delay, next_func).start()
-        return inner
-
-    def finish(success):
-        global wifi_ssid, wifi_password, user_token, provisioning_in_progress
-        provisioning_in_progress = False
-        wifi_ssid = None
-        wifi_password = None
-        user_token = None
-        print("Provisioning session reset.")
-
-        # ---- LAUNCH WEBSOCKET CLIENT AND EXIT ----
-        if success:
-            print("Provisioning successful. Launching websocket client...")
-            #subprocess.Popen(['python3', '/home/admin/ws_client.py'])
-            #sys.exit(0)  # Clean exit so BLE server stops here
-            sys.stdout.flush(); sys.stderr.flush()
-
-            # TERMINATE **THIS** helper
-            os.execlp("python", "python", "/home/admin/ws_client.py")
-
-    def claim_homebase_step():
-        claimed = claim_homebase(homebase_id, user_token)
-        if claimed:
-            send_status(0x03, "Claim success", next_func=lambda: finish(True))()
-        else:
-            send_status(0x05, "Claim failed", next_func=lambda: finish(False))()
+def save_wifi_creds(ssid, password):
+    try:
+        config.update(wifiSsid=ssid, wifiPassword=password)
+        log.info(f"WiFi credentials saved to {config.path}")
+    except Exception as e:
+        log.warning(f"Failed to save WiFi credentials: {e}")
 
-    def wifi_success_step():
-        wifi_ok = connect_to_wifi(wifi_ssid, wifi_password)
-        if wifi_ok:
-            # --- Save Wi-Fi credentials to disk ---
-            try:
-                with open('/etc/wifi-ssid', 'w') as f:
-                    f.write(wifi_ssid)
-                with open('/etc/wifi-pass', 'w') as f:
-                    f.write(wifi_password)
-                print("WiFi credentials saved to /etc/wifi-ssid and /etc/wifi-pass")
-            except Exception as e:
-                print(f"Failed to save WiFi credentials: {e}")
-            # --- End save step ---
 
-            send_status(0x02, "WiFi success", next_func=claim_homebase_step)()
-        else:
-            send_status(0x04, "WiFi failed", next_func=lambda: finish(False))()
+def set_status(code):
+    status_characteristic.set_value([code])
 
 
-    # Start the chain
-    send_status(0x01, "WiFi connecting", next_func=wifi_success_step)()
+def finish(success):
+    # ---- LAUNCH WEBSOCKET CLIENT AND EXIT ----
+    if success:
+        log.info("Provisioning successful. Launching websocket client...")
+        stop_logging()
+        sys.stdout.flush(); sys.stderr.flush()
 
+        # ws_client.py finishes the onboarding timing session
+        provisioning.timer.mark("handoff")
+        provisioning.timer.handoff()
+
+        # TERMINATE **THIS** helper
+        os.execlp("python", "python", "/home/admin/ws_client.py")
 
-def maybe_try_connect():
-    global wifi_ssid, wifi_password, user_token, provisioning_in_progress, notifications_enabled
-    if provisioning_in_progress:
-        return
-    if wifi_ssid and wifi_password and user_token and notifications_enabled:
-        try_connect()
 
 def ssid_write_callback(value, options):
-    global wifi_ssid
-    wifi_ssid = bytes(value).decode('utf-8')
-    print("Received SSID:", wifi_ssid)
-    maybe_try_connect()
+    ssid = bytes(value).decode('utf-8')
+    log.info(f"Received SSID: {ssid}")
+    provisioning.set_credential('ssid', ssid)
 
 def password_write_callback(value, options):
-    global wifi_password
-    wifi_password = bytes(value).decode('utf-8')
-    print("Received Password:", wifi_password)
-    maybe_try_connect()
+    password = bytes(value).decode('utf-8')
+    log.info("Received password")
+    provisioning.set_credential('password', password)
 
 def token_write_callback(value, options):
-    global user_token
-    user_token = bytes(value).decode('utf-8')
-    maybe_try_connect()
+    provisioning.set_credential('token', bytes(value).decode('utf-8'))
+
+def credentials_write_callback(value, options):
+    # SSID, password and token in one framed write (see credential_bundle.py)
+    try:
+        fields = credential_assembler.feed(bytes(value))
+    except ValueError as e:
+        provisioning.reject_credentials(str(e))
+        return
+    if fields:
+        log.info(f"Received credentials bundle for SSID: {fields['ssid']}")
+        provisioning.set_credentials(fields)
+
+def transfer_complete(target, payload):
+    # Large values over the chunked transfer characteristic (see chunked_transfer.py)
+    try:
+        if target == chunked_transfer.TARGET_TOKEN:
+            provisioning.set_credential('token', payload.decode('utf-8'))
+        elif target == chunked_transfer.TARGET_CREDENTIALS:
+            provisioning.set_credentials(decode_bundle(payload))
+    except ValueError as e:
+        provisioning.reject_credentials(str(e))
+
+def send_transfer_ack(frame):
+    transfer_characteristic.set_value(list(frame))
+
+def transfer_write_callback(value, options):
+    transfer_receiver.feed(bytes(value))
+
+
+def scan_read_callback():
+    return list(scanner.read_page())
+
+def scan_write_callback(value, options):
+    # 1 byte: which page the next read returns
+    scanner.select_page(bytes(value)[0] if value else 0)
+
+def publish_scan_update(frame):
+    # Called on the provisioning loop; characteristics belong to the GLib thread
+    def once():
+        scan_characteristic.set_value(list(frame))
+        return False
+    GLib.idle_add(once)
 
 
 def notify_callback(notifying, characteristic):
-    global notifications_enabled
     if notifying:
-        print("Client subscribed to status notifications")
-        notifications_enabled = True
+        log.info("Client subscribed to status notifications")
         characteristic.set_value([0x00])
-    else:
-        notifications_enabled = False
+    provisioning.set_notifying(notifying)
 
 
 
-def main(adapter_address):
+def build(adapter_address, on_finish=finish):
+    """
+    Set up the provisioning peripheral without publishing it. homebase_daemon.py
+    passes its own on_finish to switch modes in-process instead of exec'ing.
+    """
     #subprocess.run(['bluetoothctl', 'pairable', 'off'], check=False, shell=True)
-    global status_characteristic, homebase_id_characteristic, homebase_id
+    global status_characteristic, homebase_id_characteristic, homebase_id, provisioning
+    global scanner, scan_characteristic, transfer_characteristic, transfer_receiver
     homebase_id = read_homebase_id()
-
+    backend = wifi_backend.default_backend()
+    provisioning = ProvisioningStateMachine(
+        wifi=backend,
+        claim=lambda token: claim_homebase(homebase_id, token, provisioning.timer.summary()),
+        set_status=set_status,
+        on_finish=on_finish,
+        on_wifi_ok=save_wifi_creds,
+        wait_network=wait_for_network,
+    )
+
+    from bluezero import peripheral
     wifi = peripheral.Peripheral(adapter_address, local_name='WiFi Config', appearance=0x0200)
     wifi.add_service(srv_id=1, uuid=WIFI_SERVICE_UUID, primary=True)
 
@@ -206,13 +222,46 @@ def main(adapter_address):
     wifi.add_characteristic(srv_id=1, chr_id=5, uuid=USER_TOKEN_UUID,
                             value=[], notifying=False,
                             flags=['write'], write_callback=token_write_callback)
+    # Pre-scanned SSID list (see wifi_scanner.py for the encoding)
+    wifi.add_characteristic(srv_id=1, chr_id=6, uuid=WIFI_SCAN_UUID,
+                            value=[], notifying=False,
+                            flags=['read', 'write', 'notify'],
+                            read_callback=scan_read_callback,
+                            write_callback=scan_write_callback)
+    # All credentials in one (possibly chunked) write; 1, 2 and 5 stay for older apps
+    wifi.add_characteristic(srv_id=1, chr_id=7, uuid=CREDENTIALS_UUID,
+                            value=[], notifying=False,
+                            flags=['write', 'write-without-response'],
+                            write_callback=credentials_write_callback)
+    # Chunked transfer with acks for values beyond one MTU, e.g. long tokens
+    wifi.add_characteristic(srv_id=1, chr_id=8, uuid=TRANSFER_UUID,
+                            value=[], notifying=False,
+                            flags=['write', 'write-without-response', 'notify'],
+                            write_callback=transfer_write_callback)
 #D8:3A:DD:A0:BF:4B
     status_characteristic = wifi.characteristics[2]
     homebase_id_characteristic = wifi.characteristics[3]
+    scan_characteristic = wifi.characteristics[5]
+    transfer_characteristic = wifi.characteristics[7]
+    transfer_receiver = TransferReceiver(
+        transfer_complete, send_transfer_ack,
+        targets=(chunked_transfer.TARGET_TOKEN, chunked_transfer.TARGET_CREDENTIALS))
+
+    # Keep the SSID list warm, but never scan in the middle of a connect
+    scanner = WifiScanner(backend, on_update=publish_scan_update,
+                          should_scan=provisioning.is_idle)
+    provisioning.submit(scanner.run())
+    return wifi
 
-    wifi.publish()
-    print("BLE server running. Waiting for credentials...")
+
+def main(adapter_address):
+    wifi = build(adapter_address)
+    log.info("BLE server running. Waiting for credentials...")
+    startup_profile.mark("advertising", report=True)
+    wifi.publish()  # runs the GLib main loop
 
 if __name__ == '__main__':
+    setup_logging()
+    from bluezero import adapter
     adapters = list(adapter.Adapter.available())
     main(adapters[0].address)
@@ -0,0 +1,84 @@
+import asyncio
+import logging
+import random
+import time
+
+log = logging.getLogger("ws_client")
+
+
+class ReconnectPolicy:
+    """
+    Capped exponential backoff with full jitter for the backend websocket.
+
+    The first retry after a drop waits at most <first_retry_s> so a blip
+    recovers almost immediately; after that the window doubles from <base_s>
+    up to <cap_s> and the actual delay is drawn uniformly from [0, window],
+    which spreads a fleet-wide reconnect over the whole window.
+
+    A connection only resets the backoff once it has proved itself: stable()
+    (the backend answered our register) or <stable_after_s> of uptime. A
+    backend that accepts the socket and then closes it (e.g. a revoked
+    token) therefore sees the full backoff, not a retry every half second.
+    """
+
+    def __init__(self, base_s: float = 1, cap_s: float = 60, first_retry_s: float = 0.5,
+                 stable_after_s: float = 30):
+        self.base_s = base_s
+        self.cap_s = cap_s
+        self.first_retry_s = first_retry_s
+        self.stable_after_s = stable_after_s
+        self.attempt = 0              # failed/lost attempts since the last stable connection
+        self.connects = 0
+        self.total_attempts = 0
+        self.connected_at = None      # time.monotonic() of the current connection
+        self.disconnected_at = None
+        self.last_time_to_reconnect_s = None
+        self.last_attempts = None     # attempts the current connection took
+
+    def next_delay(self) -> float:
+        if self.attempt == 0:
+            return random.uniform(0, self.first_retry_s)
+        window = min(self.cap_s, self.base_s * 2 ** self.attempt)
+        return random.uniform(0, window)
+
+    async def wait(self):
+        delay = self.next_delay()
+        self.attempt += 1
+        self.total_attempts += 1
+        log.info(f"Reconnecting in {delay:.1f}s (attempt {self.attempt})",
+                 extra={"category": "reconnect"})
+        await asyncio.sleep(delay)
+
+    def connected(self):
+        now = time.monotonic()
+        self.connects += 1
+        self.connected_at = now
+        self.last_attempts = self.attempt
+        if self.disconnected_at is not None:
+            self.last_time_to_reconnect_s = round(now - self.disconnected_at, 3)
+
+    def stable(self):
+        # The backend accepted us; the next drop is a blip, not a rejection
+        self.attempt = 0
+
+    def disconnected(self):
+        # Only the first failure after a good connection starts the outage clock
+        if self.connected_at is not None:
+            if time.monotonic() - self.connected_at >= self.stable_after_s:
+                self.stable()
+            self.disconnected_at = time.monotonic()
+            self.connected_at = None
+        elif self.disconnected_at is None:
+            self.disconnected_at = time.monotonic()
+
+    def stats(self) -> dict:
+        uptime = None
+        if self.connected_at is not None:
+            uptime = round(time.monotonic() - self.connected_at, 3)
+        return {
+            "connects": self.connects,
+            "totalAttempts": self.total_attempts,
+            "attempts": self.last_attempts,
+            "timeToReconnectS": self.last_time_to_reconnect_s,
+            "uptimeS": uptime,
+        }
@@ -0,0 +1,151 @@
+import asyncio
+import fcntl
+import logging
+import random
+
+from homebase_config import backend_http_url
+from outbox import Outbox
+
+log = logging.getLogger("backend")
+
+REGISTRATION_DB = "/home/admin/pending_registrations.db"
+REGISTER_PATH = "/device/register"
+REGISTER_BATCH_PATH = REGISTER_PATH + "/batch"
+REGISTER_BATCH_SIZE = 20
+REGISTER_RETRY_DELAYS_S = (1, 2, 4, 8, 16)
+
+# Per-record errors the backend will give again on every retry
+PERMANENT_ERRORS = {"Missing fields"}
+
+
+class RegistrationClient:
+    """
+    Registers provisioned ESP32s with the backend, many per request.
+
+    Records are queued on disk (an Outbox in its own database) before any
+    network I/O, so a device provisioned while the backend is unreachable is
+    registered by a later drain() instead of being left orphaned. The
+    backend upserts, so a record sent twice is harmless. Devices that failed
+    to provision are queued too and reported in the same batch request.
+
+    ws_client and ble_provision each have a client on the same queue; a
+    lock file next to it lets only one of them drain at a time, so the same
+    rows aren't posted twice.
+    """
+
+    def __init__(self, path: str = REGISTRATION_DB, url: str = None,
+                 batch_size: int = REGISTER_BATCH_SIZE,
+                 retry_delays_s=REGISTER_RETRY_DELAYS_S, timeout_s: float = 5):
+        self.queue = Outbox(path)
+        self.lock_path = f"{path}.lock"
+        self.url = url or backend_http_url(REGISTER_BATCH_PATH)
+        self.single_url = backend_http_url(REGISTER_PATH)
+        self.batch_size = batch_size
+        self.retry_delays_s = retry_delays_s
+        self.timeout_s = timeout_s
+
+    def enqueue(self, homebase_id: str, records: list, failures=()):
+        for record in records:
+            self.queue.put({"homeBaseId": homebase_id, **record})
+        for failure in failures:
+            log.warning(f"Not registering {failure['address']}: {failure['error']}")
+            self.queue.put({"homeBaseId": homebase_id,
+                            "failure": {"address": failure["address"], "error": failure["error"]}})
+
+    def pending(self) -> int:
+        return self.queue.pending()
+
+    def _post(self, homebase_id: str, records: list, failures=()):
+        """
+        One batch request. Returns a flag per record, then per failure: True
+        once it can leave the queue (registered or reported, or rejected for
+        good), False to retry it. Raises on network errors and 5xx so the
+        whole batch is retried.
+        """
+        import requests  # slow to import; only needed once something is queued
+        resp = requests.post(self.url, json={"homeBaseId": homebase_id, "devices": records,
+                                             "failures": list(failures)},
+                             timeout=self.timeout_s)
+        if resp.status_code == 404:
+            # Backend predates /register/batch: one request per device, and
+            # nowhere to report failures
+            return [self._post_single(homebase_id, r) for r in records] + [True] * len(failures)
+        if resp.status_code == 400:
+            log.info(f"Batch rejected, dropping it: {resp.text}")
+            return [True] * (len(records) + len(failures))
+        resp.raise_for_status()
+        results = resp.json().get("results", [])
+        done = []
+        for record, result in zip(records, results):
+            if not result.get("success") and result.get("error") not in PERMANENT_ERRORS:
+                log.warning(f"{record['deviceId']} not registered yet: {result.get('error')}")
+                done.append(False)
+                continue
+            if not result.get("success"):
+                log.warning(f"Dropping {record['deviceId']}: {result.get('error')}")
+            done.append(True)
+        return done + [False] * (len(records) - len(done)) + [True] * len(failures)
+
+    def _post_single(self, homebase_id: str, record: dict) -> bool:
+        import requests
+        resp = requests.post(self.single_url, json={"homeBaseId": homebase_id, **record},
+                             timeout=self.timeout_s)
+        return resp.status_code in (200, 400)
+
+    async def _send_batch(self) -> bool:
+        """
+        Send the oldest queued records for one HomeBase. True if anything
+        left the queue. Only the HTTP call runs off the loop; the queue's
+        SQLite connection stays on this thread.
+        """
+        rows = self.queue.peek(self.batch_size)
+        if not rows:
+            return False
+        homebase_id = rows[0][1]["homeBaseId"]
+        rows = [(row_id, rec) for row_id, rec in rows if rec["homeBaseId"] == homebase_id]
+        # Failures after devices, in the order _post() returns its flags
+        rows.sort(key=lambda row: "failure" in row[1])
+        records = [{k: v for k, v in rec.items() if k != "homeBaseId"}
+                   for _, rec in rows if "failure" not in rec]
+        failures = [rec["failure"] for _, rec in rows if "failure" in rec]
+        done = await asyncio.to_thread(self._post, homebase_id, records, failures)
+        sent = [row_id for (row_id, _), ok in zip(rows, done) if ok]
+        self.queue.remove(sent)
+        log.info(f"Sent {len(sent)}/{len(rows)} queued registration(s)")
+        return bool(sent)
+
+    async def drain(self) -> bool:
+        """
+        Send everything queued, backing off between failed attempts.
+        Returns True once the queue is empty. If another client is already
+        draining, leaves it to that one (it re-reads the queue as it goes).
+        """
+        with open(self.lock_path, "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                log.info("Registrations already being sent by another drain")
+                return False
+            return await self._drain()
+
+    async def _drain(self) -> bool:
+        attempt = 0
+        while self.pending():
+            try:
+                progressed = await self._send_batch()
+            except Exception as e:
+                log.warning(f"Registration failed: {e}")
+                progressed = False
+            if progressed:
+                attempt = 0
+                continue
+            if attempt >= len(self.retry_delays_s):
+                log.info(f"{self.pending()} registration(s) still queued for the next drain")
+                return False
+            delay = self.retry_delays_s[attempt] * random.uniform(0.5, 1)
+            attempt += 1
+            await asyncio.sleep(delay)
+        return True
+
+    def close(self):
+        self.queue.close()
@@ -0,0 +1,150 @@
+import json
+import logging
+import os
+import sys
+import time
+
+log = logging.getLogger("startup")
+
+# Set HOMEBASE_PROFILE_STARTUP=1 to time every import and the path to the
+# first websocket register; each run appends one line to PROFILE_LOG so
+# releases can be compared. Entry points import this module first.
+PROFILE_ENV = "HOMEBASE_PROFILE_STARTUP"
+PROFILE_LOG = "/home/admin/startup-profile.jsonl"
+RELEASE_ENV = "HOMEBASE_RELEASE"
+TOP_IMPORTS = 15
+
+enabled = os.environ.get(PROFILE_ENV, "") not in ("", "0")
+
+
+def process_age_s():
+    """
+    Seconds since the kernel started this process, so interpreter start-up
+    before any of our code ran is included. None off Linux.
+    """
+    try:
+        with open("/proc/self/stat") as f:
+            # comm may contain spaces; fields after it are fixed
+            started_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+    except (OSError, ValueError, IndexError):
+        return None
+    return uptime - started_ticks / os.sysconf("SC_CLK_TCK")
+
+
+class _TimedLoader:
+    """
+    Wraps a module's loader to time exec_module; everything else is the
+    real loader.
+    """
+
+    def __init__(self, loader, profile):
+        self._loader = loader
+        self._profile = profile
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        profile = self._profile
+        profile._stack.append(0.0)
+        started = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            total = time.perf_counter() - started
+            nested = profile._stack.pop()
+            if profile._stack:
+                profile._stack[-1] += total
+            profile.imports[module.__name__] = (total, total - nested)
+
+
+class StartupProfile:
+    """
+    Import timings (cumulative and self, per module) from the moment it is
+    installed, plus named milestones such as "registered".
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.age_at_start = process_age_s()
+        self.imports = {}   # module -> (cumulative_s, self_s)
+        self.marks = {}     # milestone -> seconds since process start
+        self._stack = []
+
+    # ---- import timing as a meta path finder ------------------------------
+
+    def find_spec(self, name, path=None, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                    spec.loader = _TimedLoader(spec.loader, self)
+                return spec
+        return None
+
+    def install(self):
+        if self not in sys.meta_path:
+            sys.meta_path.insert(0, self)
+
+    def uninstall(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    # ---- milestones ------------------------------------------------------
+
+    def elapsed(self) -> float:
+        """
+        Seconds since the process started (or since install if unknown).
+        """
+        return (self.age_at_start or 0.0) + time.monotonic() - self.started
+
+    def summary(self) -> dict:
+        top = sorted(self.imports.items(), key=lambda kv: kv[1][1], reverse=True)[:TOP_IMPORTS]
+        return {
+            "release": os.environ.get(RELEASE_ENV, "dev"),
+            "entry": os.path.basename(sys.argv[0]) if sys.argv else None,
+            "interpreterMs": round((self.age_at_start or 0) * 1000),
+            "marksMs": {k: round(v * 1000) for k, v in self.marks.items()},
+            "importMs": round(sum(s for _, s in self.imports.values()) * 1000),
+            "topImportsMs": {name: {"self": round(s * 1000, 1), "total": round(t * 1000, 1)}
+                             for name, (t, s) in top},
+        }
+
+    def mark(self, event: str, report: bool = False):
+        if event in self.marks:
+            return  # only the first occurrence counts (e.g. not reconnects)
+        self.marks[event] = self.elapsed()
+        if report:
+            self.report()
+
+    def report(self, path: str = PROFILE_LOG):
+        summary = self.summary()
+        log.info(f"{summary['marksMs']} interpreter {summary['interpreterMs']} ms, "
+                 f"imports {summary['importMs']} ms")
+        for name, ms in summary["topImportsMs"].items():
+            log.info(f"  {ms['self']:8.1f} ms self {ms['total']:8.1f} ms total  {name}")
+        try:
+            with open(path, "a") as f:
+                f.write(json.dumps({"ts": time.time(), **summary}) + "\n")
+        except OSError as e:
+            log.warning(f"Could not write {path}: {e}")
+
+
+profile = StartupProfile()
+if enabled:
+    profile.install()
+
+
+def mark(event: str, report: bool = False):
+    """
+    Record a milestone; a no-op unless profiling is enabled.
+    """
+    if enabled:
+        profile.mark(event, report)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The Pi scripts are top-level modules, deployed flat into /home/admin
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
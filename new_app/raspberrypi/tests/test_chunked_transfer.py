@@ -0,0 +1,87 @@
+import asyncio
+import random
+
+from chunked_transfer import (ACK_PROGRESS, FRAME_DATA, TARGET_TOKEN, TransferReceiver,
+                              TransferSender, parse_ack)
+
+
+def _transfer(payload: bytes, drop_ack):
+    """
+    Send payload through a sender/receiver pair; drop_ack(ack) decides
+    which acks are lost on the way back.
+    """
+    received = []
+
+    async def main():
+        sender = None
+
+        def send_ack(frame):
+            if not drop_ack(parse_ack(frame)):
+                sender.on_ack(frame)
+
+        receiver = TransferReceiver(lambda target, data: received.append(data), send_ack)
+
+        async def write(frame, response):
+            receiver.feed(frame)
+
+        sender = TransferSender(write, mtu=23, window=4, ack_timeout_s=0.05, retries=3)
+        return await sender.send(TARGET_TOKEN, payload)
+
+    return asyncio.run(main()), received
+
+
+def test_transfer_completes():
+    payload = bytes(range(256)) * 2
+    ok, received = _transfer(payload, lambda ack: False)
+    assert ok and received == [payload]
+
+
+def test_lost_progress_ack_is_repeated():
+    payload = bytes(range(200))
+    lost = []
+
+    def drop_first_progress(ack):
+        if ack[1] == ACK_PROGRESS and not lost:
+            lost.append(ack)
+            return True
+        return False
+
+    ok, received = _transfer(payload, drop_first_progress)
+    assert lost, "test did not drop an ack"
+    assert ok and received == [payload]
+
+
+def test_every_window_is_answered_under_loss():
+    # 30% loss both ways. Whenever the last frame of a window gets through
+    # an ack must go back, or the sender burns retries on a live receiver.
+    rng = random.Random(7)
+    unanswered = []
+
+    async def one(payload):
+        sender = None
+        acks = []
+
+        def send_ack(frame):
+            acks.append(frame)
+            if rng.random() >= 0.3:
+                sender.on_ack(frame)
+
+        receiver = TransferReceiver(lambda target, data: None, send_ack)
+
+        async def write(frame, response):
+            if not response and rng.random() < 0.3:
+                return
+            before = len(acks)
+            receiver.feed(frame)
+            if frame[0] == FRAME_DATA and frame[2] & 0x80 and len(acks) == before:
+                unanswered.append(frame[:4])
+
+        sender = TransferSender(write, mtu=23, window=4, ack_timeout_s=0.001, retries=10)
+        return await sender.send(TARGET_TOKEN, payload)
+
+    async def main():
+        return [await one(bytes(rng.randrange(256) for _ in range(rng.randrange(1, 400))))
+                for _ in range(100)]
+
+    assert all(asyncio.run(main()))
+    assert not unanswered
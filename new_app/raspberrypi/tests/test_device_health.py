@@ -0,0 +1,42 @@
+import asyncio
+
+from device_health import DeviceHealth
+
+
+def test_unrequested_devices_stop_being_probed():
+    probed = []
+
+    async def probe(lan):
+        probed.append(lan)
+        return True, 1.0
+
+    async def main():
+        health = DeviceHealth(probe, interval_s=0.02, jitter_s=0, expire_after=3)
+        health.start()
+        health.track("esp32-gone.local")
+        for _ in range(10):
+            health.track("esp32-kept.local")  # still asked about
+            await asyncio.sleep(0.02)
+        health.stop()
+        return health
+
+    health = asyncio.run(main())
+    assert "esp32-gone.local" not in health.snapshot()
+    assert "esp32-kept.local" in health.snapshot()
+    assert probed.count("esp32-gone.local") < probed.count("esp32-kept.local")
+
+
+def test_skipped_probe_keeps_last_state():
+    results = [(True, 12.0), (None, None)]
+
+    async def probe(lan):
+        return results.pop(0)
+
+    async def main():
+        health = DeviceHealth(probe)
+        await health.check("esp32-a.local")
+        return await health.check("esp32-a.local"), health.snapshot()["esp32-a.local"]
+
+    (online, rtt_ms), entry = asyncio.run(main())
+    assert online and rtt_ms == 12.0
+    assert entry["state"] == "up" and entry["failures"] == 0
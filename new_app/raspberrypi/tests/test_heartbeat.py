@@ -0,0 +1,12 @@
+from heartbeat import RttWindow
+
+
+def test_window_forgets_old_samples():
+    window = RttWindow(window=10)
+    for _ in range(100):
+        window.add(20)
+    for _ in range(10):
+        window.add(800)  # link got worse: the old fast samples must not hide it
+    snap = window.snapshot()
+    assert snap["samples"] == 10 and snap["p50"] == 800 and snap["p95"] == 800
+    assert snap["buckets"]["1000"] == 10
@@ -0,0 +1,33 @@
+import multiprocessing
+
+from homebase_config import HomebaseConfig
+
+
+def _start(path, legacy, results):
+    results.put(HomebaseConfig(path, legacy).get("homebaseId"))
+
+
+def test_concurrent_legacy_import(tmp_path):
+    legacy_id = tmp_path / "homebase-id"
+    legacy_id.write_text("hb-1\n")
+    path = str(tmp_path / "homebase.json")
+    legacy = {"homebaseId": str(legacy_id)}
+
+    results = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=_start, args=(path, legacy, results))
+             for _ in range(8)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(10)
+    assert [results.get(timeout=1) for _ in procs] == ["hb-1"] * len(procs)
+    assert HomebaseConfig(path, {}).get("homebaseId") == "hb-1"
+    assert not (tmp_path / "homebase.json.tmp").exists()
+
+
+def test_update_seeds_from_legacy_files(tmp_path):
+    legacy_id = tmp_path / "homebase-id"
+    legacy_id.write_text("hb-2")
+    config = HomebaseConfig(str(tmp_path / "homebase.json"), {"homebaseId": str(legacy_id)})
+    config.update(wifiSsid="Home")
+    assert config.load() == {"homebaseId": "hb-2", "wifiSsid": "Home"}
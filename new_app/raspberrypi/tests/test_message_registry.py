@@ -0,0 +1,48 @@
+import asyncio
+
+from message_registry import MessageRegistry, OptionalField
+
+
+def _registry(sent):
+    registry = MessageRegistry("test")
+
+    async def reject(ctx, data, error):
+        sent.append({"type": "ack", "msgId": data.get("msgId"), "success": False})
+
+    @registry.handler("cmd", {"zone": int, "on": bool, "msgId": OptionalField(str)},
+                      on_invalid=reject)
+    async def cmd(ctx, data):
+        sent.append({"type": "ack", "msgId": data.get("msgId"), "success": True})
+
+    return registry
+
+
+def test_valid_message_runs_handler():
+    sent = []
+    ok = asyncio.run(_registry(sent).dispatch({"type": "cmd", "zone": 1, "on": True, "msgId": "a"}, None))
+    assert ok and sent == [{"type": "ack", "msgId": "a", "success": True}]
+
+
+def test_invalid_message_is_answered_not_dropped():
+    sent = []
+    # JSON true must not pass as a zone number
+    ok = asyncio.run(_registry(sent).dispatch({"type": "cmd", "zone": True, "on": True, "msgId": "b"}, None))
+    assert not ok and sent == [{"type": "ack", "msgId": "b", "success": False}]
+
+
+def test_handler_outcomes_and_latency_go_to_metrics():
+    from message_registry import HANDLER_SECONDS, MESSAGES
+    before = MESSAGES.snapshot().get("cmd/invalid", 0)
+    registry = _registry([])
+    asyncio.run(registry.dispatch({"type": "cmd", "zone": "x", "on": True}, None))
+    asyncio.run(registry.dispatch({"type": "cmd", "zone": 1, "on": True}, None))
+    assert MESSAGES.snapshot()["cmd/invalid"] == before + 1
+    assert HANDLER_SECONDS.quantile(0.5, type="cmd") is not None
+
+
+def test_frames_without_a_string_type_are_dropped():
+    sent = []
+    registry = _registry(sent)
+    for data in ([1, 2], "cmd", {"type": ["cmd"]}, {"zone": 1}):
+        assert asyncio.run(registry.dispatch(data, None)) is False
+    assert sent == []
@@ -0,0 +1,96 @@
+import asyncio
+
+import pytest
+
+import reconnect_policy
+from reconnect_policy import ReconnectPolicy
+
+
+@pytest.fixture
+def midpoint_jitter(monkeypatch):
+    # Deterministic delays: the middle of each backoff window
+    monkeypatch.setattr(reconnect_policy.random, "uniform", lambda a, b: (a + b) / 2)
+
+
+def test_quick_close_keeps_backing_off(midpoint_jitter):
+    policy = ReconnectPolicy(base_s=1, cap_s=60, first_retry_s=0.5, stable_after_s=30)
+    windows = []
+    for _ in range(4):
+        policy.connected()
+        policy.disconnected()  # closed straight after the handshake
+        windows.append(policy.next_delay())
+        policy.attempt += 1
+    assert windows == [0.25, 1, 2, 4]
+
+
+def test_registered_resets_backoff(midpoint_jitter):
+    policy = ReconnectPolicy(stable_after_s=30)
+    policy.attempt = 5
+    policy.connected()
+    policy.stable()
+    policy.disconnected()
+    assert policy.attempt == 0
+    assert policy.next_delay() == 0.25
+
+
+def test_long_uptime_resets_backoff(monkeypatch):
+    policy = ReconnectPolicy(stable_after_s=30)
+    policy.attempt = 5
+    now = [1000.0]
+    monkeypatch.setattr(reconnect_policy.time, "monotonic", lambda: now[0])
+    policy.connected()
+    now[0] += 31
+    policy.disconnected()
+    assert policy.attempt == 0
+
+
+class _FakeOutbox:
+    def pending(self):
+        return 0
+
+
+class _FakeLink:
+    outbox = _FakeOutbox()
+
+    def attach(self, ws):
+        pass
+
+    def detach(self):
+        pass
+
+    async def flush(self):
+        pass
+
+
+class _NoRegistrations:
+    def pending(self):
+        return 0
+
+
+def test_server_that_accepts_then_closes(monkeypatch, midpoint_jitter):
+    websockets = pytest.importorskip("websockets")
+    pytest.importorskip("aiohttp")
+    import ws_client
+
+    policy = ReconnectPolicy(base_s=1, cap_s=60, first_retry_s=0.5, stable_after_s=30)
+    monkeypatch.setattr(ws_client, "reconnect", policy)
+    connections = []
+
+    async def reject(ws, *_):
+        # What ws-pi.js does with a missing or revoked token
+        connections.append(1)
+        await asyncio.sleep(0.05)
+        await ws.close()
+
+    async def main():
+        async with websockets.serve(reject, "127.0.0.1", 0) as server:
+            port = server.sockets[0].getsockname()[1]
+            client = ws_client.serve_backend(f"ws://127.0.0.1:{port}", "hb-test", _FakeLink(),
+                                             None, None, _NoRegistrations())
+            with pytest.raises(asyncio.TimeoutError):
+                await asyncio.wait_for(client, 3)
+
+    asyncio.run(main())
+    # Backoff 0.25 + 1 + 2 s: three connections in 3 s, not one per ~0.3 s
+    assert len(connections) <= 4
+    assert policy.attempt >= 3
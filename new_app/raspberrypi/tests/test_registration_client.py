@@ -0,0 +1,47 @@
+import asyncio
+
+from registration_client import RegistrationClient
+
+
+def test_concurrent_drains_post_each_record_once(tmp_path):
+    posted = []
+
+    def client():
+        c = RegistrationClient(str(tmp_path / "registrations.db"), url="http://backend.test")
+
+        def post(homebase_id, records, failures=()):
+            posted.extend(r["deviceId"] for r in records)
+            return [True] * (len(records) + len(failures))
+        c._post = post
+        return c
+
+    ws_side, ble_side = client(), client()
+    ble_side.enqueue("hb-1", [{"deviceId": f"dev-{i}"} for i in range(3)])
+
+    async def main():
+        return await asyncio.gather(ws_side.drain(), ble_side.drain())
+
+    results = asyncio.run(main())
+    assert sorted(posted) == ["dev-0", "dev-1", "dev-2"]
+    assert results.count(True) == 1
+    assert ws_side.pending() == 0
+    ws_side.close()
+    ble_side.close()
+
+
+def test_failures_are_queued_and_sent_with_the_batch(tmp_path):
+    bodies = []
+    c = RegistrationClient(str(tmp_path / "registrations.db"), url="http://backend.test")
+
+    def post(homebase_id, records, failures=()):
+        bodies.append({"devices": [r["deviceId"] for r in records], "failures": failures})
+        return [True] * (len(records) + len(failures))
+    c._post = post
+
+    c.enqueue("hb-1", [{"deviceId": "dev-0"}],
+              [{"address": "AA:BB", "ok": False, "error": "wifi_failed"}])
+    assert c.pending() == 2
+    assert asyncio.run(c.drain())
+    assert bodies == [{"devices": ["dev-0"],
+                       "failures": [{"address": "AA:BB", "error": "wifi_failed"}]}]
+    c.close()
@@ -0,0 +1,16 @@
+import pytest
+
+from wifi_backend import FakeWifiBackend, WifiBackend, key_mgmt_for
+
+
+def test_key_mgmt_follows_scanned_flags():
+    assert key_mgmt_for(0, 0) is None                  # open
+    assert key_mgmt_for(0, 0x100) == "wpa-psk"         # WPA2
+    assert key_mgmt_for(0, 0x500) == "wpa-psk"         # WPA2/WPA3 transition
+    assert key_mgmt_for(0, 0x400) == "sae"             # WPA3 only
+
+
+def test_backend_is_abstract():
+    with pytest.raises(TypeError):
+        WifiBackend()
+    FakeWifiBackend()
@@ -0,0 +1,17 @@
+import pytest
+
+import wire_codec
+
+
+def test_malformed_binary_frames_raise_value_error():
+    msgpack = pytest.importorskip("msgpack")
+    for frame in ([1], 5, [1, 2, 3], [1, [1, 2]], [12, {"messages": [7]}]):
+        with pytest.raises(ValueError):
+            wire_codec.decode(msgpack.packb(frame))
+    with pytest.raises(ValueError):
+        wire_codec.decode(b"\xc1")  # never used in msgpack
+
+
+def test_round_trip_json():
+    assert wire_codec.decode(wire_codec.encode({"type": "pingPi", "msgId": "a"})) == \
+        {"type": "pingPi", "msgId": "a"}
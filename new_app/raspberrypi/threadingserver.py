@@ -1,10 +1,15 @@
 import logging
-import requests
-from bluezero import async_tools, adapter, peripheral
-import time
-import threading
 import sys
-import subprocess
+
+import chunked_transfer
+from chunked_transfer import TransferReceiver
+from credential_bundle import CredentialAssembler, decode_bundle
+from homebase_config import config
+from homebase_logging import setup_logging
+from provisioning import ProvisioningStateMachine
+from wifi_backend import FakeWifiBackend
+
+log = logging.getLogger("server")
 
 # UUIDs
 WIFI_SERVICE_UUID = '12345678-1234-5678-1234-56789abcdef0'
@@ -13,35 +18,30 @@ WIFI_PASSWORD_UUID = '12345678-1234-5678-1234-56789abcdef2'
 WIFI_STATUS_UUID = '12345678-1234-5678-1234-56789abcdef3'
 HOMEBASE_ID_UUID = '12345678-1234-5678-1234-56789abcdef4'
 USER_TOKEN_UUID = '12345678-1234-5678-1234-56789abcdef5'
+CREDENTIALS_UUID = '12345678-1234-5678-1234-56789abcdef7'
+TRANSFER_UUID = '12345678-1234-5678-1234-56789abcdef8'
 
 # Globals
-wifi_ssid = None
-wifi_password = None
-user_token = None
 status_characteristic = None
 homebase_id_characteristic = None
 homebase_id = None
-
-provisioning_in_progress = False
-notifications_enabled = False
+provisioning = None
+credential_assembler = CredentialAssembler()
+transfer_characteristic = None
+transfer_receiver = None
 
 
 BACKEND_URL = "http://192.168.68.66:3001/homebase/claim"  # Update as needed
 
 def read_homebase_id():
-    try:
-        with open('/etc/homebase-id', 'r') as f:
-            return f.read().strip()
-    except Exception as e:
-        print(f"Error reading HomeBase ID: {e}")
+    homebase_id = config.get("homebaseId")
+    if not homebase_id:
+        log.warning(f"Error reading HomeBase ID: not set in {config.path}")
         return "UNKNOWN-HOMEBASE-ID"
-
-def connect_to_wifi(ssid, password):
-    print(f"Connecting to SSID: {ssid}, Password: {password}")
-    # Replace with actual Wi-Fi logic
-    return ssid == "TestNetwork" and password == "correctpassword"
+    return homebase_id
 
 def claim_homebase(homebase_id, token):
+    import requests  # slow to import and only needed once, at claim time
     try:
         res = requests.post(
             BACKEND_URL,
@@ -50,100 +50,89 @@ def claim_homebase(homebase_id, token):
             timeout=5
         )
         if res.status_code == 200:
-            print("✅ HomeBase claimed")
+            log.info("✅ HomeBase claimed")
             return True
         else:
-            print(f"❌ Claim failed: {res.status_code} {res.text}")
+            log.warning(f"❌ Claim failed: {res.status_code} {res.text}")
             return False
     except Exception as e:
-        print(f"Error claiming HomeBase: {e}")
+        log.warning(f"Error claiming HomeBase: {e}")
         return False
 
-def try_connect():
-    global wifi_ssid, wifi_password, user_token, provisioning_in_progress
-    provisioning_in_progress = True
-
-    def send_status(status, message, delay=1.0, next_func=None):
-        def inner():
-            status_characteristic.set_value([status])
-            print(f"Sent status: 0x{status:02X} ({message})")
-            if next_func:
-                threading.Timer(delay, next_func).start()
-        return inner
-
-    def finish(success):
-        global wifi_ssid, wifi_password, user_token, provisioning_in_progress
-        provisioning_in_progress = False
-        wifi_ssid = None
-        wifi_password = None
-        user_token = None
-        print("Provisioning session reset.")
-
-        # ---- LAUNCH WEBSOCKET CLIENT AND EXIT ----
-        if success:
-            print("Provisioning successful. Launching websocket client...")
-            subprocess.Popen(['python3', '/home/admin/ws_client.py'])
-            sys.exit(0)  # Clean exit so BLE server stops here
-
-    def claim_homebase_step():
-        claimed = claim_homebase(homebase_id, user_token)
-        if claimed:
-            send_status(0x03, "Claim success", next_func=lambda: finish(True))()
-        else:
-            send_status(0x05, "Claim failed", next_func=lambda: finish(False))()
+def set_status(code):
+    status_characteristic.set_value([code])
 
-    def wifi_success_step():
-        wifi_ok = connect_to_wifi(wifi_ssid, wifi_password)
-        if wifi_ok:
-            send_status(0x02, "WiFi success", next_func=claim_homebase_step)()
-        else:
-            send_status(0x04, "WiFi failed", next_func=lambda: finish(False))()
 
-    # Start the chain
-    send_status(0x01, "WiFi connecting", next_func=wifi_success_step)()
+def finish(success):
+    # ---- LAUNCH WEBSOCKET CLIENT AND EXIT ----
+    if success:
+        log.info("Provisioning successful. Launching websocket client...")
+        import subprocess
+        subprocess.Popen(['python3', '/home/admin/ws_client.py'])
+        sys.exit(0)  # Clean exit so BLE server stops here
 
 
-def maybe_try_connect():
-    global wifi_ssid, wifi_password, user_token, provisioning_in_progress, notifications_enabled
-    if provisioning_in_progress:
-        return
-    if wifi_ssid and wifi_password and user_token and notifications_enabled:
-        try_connect()
-
 def ssid_write_callback(value, options):
-    global wifi_ssid
-    wifi_ssid = bytes(value).decode('utf-8')
-    print("Received SSID:", wifi_ssid)
-    maybe_try_connect()
+    ssid = bytes(value).decode('utf-8')
+    log.info(f"Received SSID: {ssid}")
+    provisioning.set_credential('ssid', ssid)
 
 def password_write_callback(value, options):
-    global wifi_password
-    wifi_password = bytes(value).decode('utf-8')
-    print("Received Password:", wifi_password)
-    maybe_try_connect()
+    password = bytes(value).decode('utf-8')
+    log.info("Received password")
+    provisioning.set_credential('password', password)
 
 def token_write_callback(value, options):
-    global user_token
-    user_token = bytes(value).decode('utf-8')
-    print("Received User Token:", user_token)
-    maybe_try_connect()
+    token = bytes(value).decode('utf-8')
+    log.info("Received user token")
+    provisioning.set_credential('token', token)
+
+def credentials_write_callback(value, options):
+    try:
+        fields = credential_assembler.feed(bytes(value))
+    except ValueError as e:
+        provisioning.reject_credentials(str(e))
+        return
+    if fields:
+        log.info(f"Received credentials bundle for SSID: {fields['ssid']}")
+        provisioning.set_credentials(fields)
+
+def transfer_complete(target, payload):
+    try:
+        if target == chunked_transfer.TARGET_TOKEN:
+            provisioning.set_credential('token', payload.decode('utf-8'))
+        elif target == chunked_transfer.TARGET_CREDENTIALS:
+            provisioning.set_credentials(decode_bundle(payload))
+    except ValueError as e:
+        provisioning.reject_credentials(str(e))
+
+def send_transfer_ack(frame):
+    transfer_characteristic.set_value(list(frame))
+
+def transfer_write_callback(value, options):
+    transfer_receiver.feed(bytes(value))
 
 def notify_callback(notifying, characteristic):
-    global notifications_enabled
     if notifying:
-        print("Client subscribed to status notifications")
-        notifications_enabled = True
+        log.info("Client subscribed to status notifications")
         characteristic.set_value([0x00])
-    else:
-        notifications_enabled = False
+    provisioning.set_notifying(notifying)
 
 
 
 def main(adapter_address):
-    global status_characteristic, homebase_id_characteristic, homebase_id
+    global status_characteristic, homebase_id_characteristic, homebase_id, provisioning
+    global transfer_characteristic, transfer_receiver
 
     homebase_id = read_homebase_id()
-
+    provisioning = ProvisioningStateMachine(
+        wifi=FakeWifiBackend({"TestNetwork": "correctpassword"}),  # no real Wi-Fi here
+        claim=lambda token: claim_homebase(homebase_id, token),
+        set_status=set_status,
+        on_finish=finish,
+    )
+
+    from bluezero import peripheral
     wifi = peripheral.Peripheral(adapter_address, local_name='WiFi Config', appearance=0x0200)
     wifi.add_service(srv_id=1, uuid=WIFI_SERVICE_UUID, primary=True)
 
@@ -166,13 +155,29 @@ def main(adapter_address):
     wifi.add_characteristic(srv_id=1, chr_id=5, uuid=USER_TOKEN_UUID,
                             value=[], notifying=False,
                             flags=['write'], write_callback=token_write_callback)
+
+    wifi.add_characteristic(srv_id=1, chr_id=6, uuid=CREDENTIALS_UUID,
+                            value=[], notifying=False,
+                            flags=['write', 'write-without-response'],
+                            write_callback=credentials_write_callback)
+
+    wifi.add_characteristic(srv_id=1, chr_id=7, uuid=TRANSFER_UUID,
+                            value=[], notifying=False,
+                            flags=['write', 'write-without-response', 'notify'],
+                            write_callback=transfer_write_callback)
 #D8:3A:DD:A0:BF:4B
     status_characteristic = wifi.characteristics[2]
     homebase_id_characteristic = wifi.characteristics[3]
+    transfer_characteristic = wifi.characteristics[6]
+    transfer_receiver = TransferReceiver(
+        transfer_complete, send_transfer_ack,
+        targets=(chunked_transfer.TARGET_TOKEN, chunked_transfer.TARGET_CREDENTIALS))
 
     wifi.publish()
-    print("BLE server running. Waiting for credentials...")
+    log.info("BLE server running. Waiting for credentials...")
 
 if __name__ == '__main__':
+    setup_logging()
+    from bluezero import adapter
     adapters = list(adapter.Adapter.available())
     main(adapters[0].address)
@@ -0,0 +1,307 @@
+import abc
+import asyncio
+import logging
+import threading
+import time
+
+log = logging.getLogger("wifi")
+
+try:
+    from dbus_next import BusType, Variant
+    from dbus_next.aio import MessageBus
+except ImportError:  # falls back to async nmcli
+    MessageBus = None
+
+# Progress stages passed to connect(progress=...)
+ASSOCIATING = "associating"
+AUTHENTICATING = "authenticating"
+GETTING_IP = "ip_config"
+
+NM_BUS = "org.freedesktop.NetworkManager"
+NM_PATH = "/org/freedesktop/NetworkManager"
+NM_SETTINGS_PATH = "/org/freedesktop/NetworkManager/Settings"
+NM_DEVICE_TYPE_WIFI = 2
+
+# NMDeviceState values we care about
+NM_STATE_CONFIG = 50
+NM_STATE_NEED_AUTH = 60
+NM_STATE_IP_CONFIG = 70
+NM_STATE_ACTIVATED = 100
+NM_STATE_FAILED = 120
+
+NM_PROGRESS = {
+    NM_STATE_CONFIG: ASSOCIATING,
+    NM_STATE_NEED_AUTH: AUTHENTICATING,
+    NM_STATE_IP_CONFIG: GETTING_IP,
+}
+
+# NM80211ApSecurityFlags bits in an AP's WpaFlags/RsnFlags
+NM_AP_SEC_KEY_MGMT_PSK = 0x100
+NM_AP_SEC_KEY_MGMT_SAE = 0x400
+
+
+def key_mgmt_for(wpa_flags: int, rsn_flags: int):
+    """
+    802-11-wireless-security key-mgmt for an AP's advertised flags, or None
+    for an open network. WPA2/WPA3 transition networks take wpa-psk, which
+    every Pi Wi-Fi chip supports; only WPA3-only networks need sae.
+    """
+    flags = wpa_flags | rsn_flags
+    if not flags:
+        return None
+    if flags & NM_AP_SEC_KEY_MGMT_SAE and not flags & NM_AP_SEC_KEY_MGMT_PSK:
+        return "sae"
+    return "wpa-psk"
+
+
+def connection_settings(ssid: str, password: str, key_mgmt) -> dict:
+    """
+    Settings for AddAndActivateConnection; NM fills in the rest from the AP.
+    """
+    settings = {"connection": {"id": Variant("s", ssid)}}
+    if key_mgmt is not None:
+        settings["802-11-wireless-security"] = {
+            "key-mgmt": Variant("s", key_mgmt),
+            "psk": Variant("s", password),
+        }
+    return settings
+
+
+class WifiBackend(abc.ABC):
+    """
+    What the provisioning server needs from the Wi-Fi stack.
+
+    scan() returns [{"ssid", "strength" (0-100), "secure"}], strongest first,
+    reusing the previous result while it is younger than <max_age_s>.
+    connect() reports stages through progress(stage) and returns True once
+    the connection is fully up.
+    """
+
+    @abc.abstractmethod
+    async def scan(self, max_age_s: float = 30) -> list:
+        ...
+
+    @abc.abstractmethod
+    async def connect(self, ssid: str, password: str, progress=None,
+                      timeout_s: float = 20) -> bool:
+        ...
+
+
+class NMWifiBackend(WifiBackend):
+    """
+    NetworkManager over D-Bus (dbus-next), no process spawns.
+    """
+
+    def __init__(self):
+        self._bus = None
+        self._nm = None
+        self._device_path = None
+        self._wireless = None
+        self._device = None
+        self._scan = []        # last scan, see WifiBackend.scan
+        self._ap_paths = {}    # ssid -> AP object path from the last scan
+        self._key_mgmt = {}    # ssid -> key-mgmt from the last scan, None if open
+        self._scanned_at = 0.0
+
+    async def _iface(self, path: str, name: str):
+        introspection = await self._bus.introspect(NM_BUS, path)
+        return self._bus.get_proxy_object(NM_BUS, path, introspection).get_interface(name)
+
+    async def _setup(self):
+        if self._bus is not None:
+            return
+        self._bus = await MessageBus(bus_type=BusType.SYSTEM).connect()
+        self._nm = await self._iface(NM_PATH, "org.freedesktop.NetworkManager")
+        for path in await self._nm.call_get_devices():
+            device = await self._iface(path, "org.freedesktop.NetworkManager.Device")
+            if await device.get_device_type() == NM_DEVICE_TYPE_WIFI:
+                self._device_path = path
+                self._device = device
+                self._wireless = await self._iface(
+                    path, "org.freedesktop.NetworkManager.Device.Wireless")
+                return
+        raise RuntimeError("No Wi-Fi device found in NetworkManager")
+
+    async def scan(self, max_age_s: float = 30) -> list:
+        await self._setup()
+        if self._scan and time.monotonic() - self._scanned_at < max_age_s:
+            return self._scan
+
+        last_scan = await self._wireless.get_last_scan()
+        try:
+            await self._wireless.call_request_scan({})
+            # NM bumps LastScan when the scan completes
+            for _ in range(50):
+                await asyncio.sleep(0.1)
+                if await self._wireless.get_last_scan() != last_scan:
+                    break
+        except Exception as e:
+            # NM rate-limits scans; its current AP list is still useful
+            log.warning(f"Scan request refused, using NetworkManager's list: {e}")
+
+        best = {}
+        for path in await self._wireless.call_get_all_access_points():
+            ap = await self._iface(path, "org.freedesktop.NetworkManager.AccessPoint")
+            ssid = bytes(await ap.get_ssid()).decode("utf-8", "replace")
+            if not ssid:
+                continue
+            strength = await ap.get_strength()
+            if ssid not in best or strength > best[ssid]["strength"]:
+                key_mgmt = key_mgmt_for(await ap.get_wpa_flags(), await ap.get_rsn_flags())
+                best[ssid] = {"ssid": ssid, "strength": strength, "secure": key_mgmt is not None}
+                self._ap_paths[ssid] = path
+                self._key_mgmt[ssid] = key_mgmt
+
+        self._scan = sorted(best.values(), key=lambda ap: ap["strength"], reverse=True)
+        self._scanned_at = time.monotonic()
+        return self._scan
+
+    async def _delete_connections(self, ssid: str):
+        settings = await self._iface(NM_SETTINGS_PATH, "org.freedesktop.NetworkManager.Settings")
+        for path in await settings.call_list_connections():
+            conn = await self._iface(path, "org.freedesktop.NetworkManager.Settings.Connection")
+            cfg = await conn.call_get_settings()
+            if cfg.get("connection", {}).get("id", Variant("s", "")).value == ssid:
+                await conn.call_delete()
+
+    async def connect(self, ssid: str, password: str, progress=None,
+                      timeout_s: float = 20) -> bool:
+        await self._setup()
+        await self.scan()  # cached unless stale
+        ap_path = self._ap_paths.get(ssid)
+        if ap_path is None:
+            await self.scan(max_age_s=0)
+            ap_path = self._ap_paths.get(ssid)
+        if ap_path is None:
+            log.warning(f"{ssid} not in range")
+            return False
+
+        await self._delete_connections(ssid)
+
+        done = asyncio.get_running_loop().create_future()
+
+        def on_state_changed(new_state, old_state, reason):
+            if new_state in NM_PROGRESS and progress:
+                progress(NM_PROGRESS[new_state])
+            if new_state == NM_STATE_ACTIVATED and not done.done():
+                done.set_result(True)
+            elif new_state == NM_STATE_FAILED and not done.done():
+                log.warning(f"Activation failed, reason {reason}")
+                done.set_result(False)
+
+        self._device.on_state_changed(on_state_changed)
+        try:
+            await self._nm.call_add_and_activate_connection(
+                connection_settings(ssid, password, self._key_mgmt.get(ssid)),
+                self._device_path,
+                ap_path,
+            )
+            return await asyncio.wait_for(done, timeout_s)
+        except asyncio.TimeoutError:
+            log.warning(f"Timed out connecting to {ssid}")
+            return False
+        finally:
+            self._device.off_state_changed(on_state_changed)
+
+
+class NmcliWifiBackend(WifiBackend):
+    """
+    nmcli through asyncio subprocesses, for images without dbus-next.
+    Doesn't block the caller's loop, but can't stream progress.
+    """
+
+    def __init__(self):
+        self._scan = []
+        self._scanned_at = 0.0
+
+    @staticmethod
+    async def _nmcli(*args, timeout_s: float = 20):
+        proc = await asyncio.create_subprocess_exec(
+            "nmcli", *args,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
+        try:
+            out, err = await asyncio.wait_for(proc.communicate(), timeout_s)
+        except asyncio.TimeoutError:
+            proc.kill()
+            return 1, "", "timeout"
+        return proc.returncode, out.decode(), err.decode()
+
+    async def scan(self, max_age_s: float = 30) -> list:
+        if self._scan and time.monotonic() - self._scanned_at < max_age_s:
+            return self._scan
+        code, out, _ = await self._nmcli("-t", "-f", "SSID,SIGNAL,SECURITY",
+                                         "device", "wifi", "list", "--rescan", "auto")
+        best = {}
+        for line in out.splitlines() if code == 0 else []:
+            # SSIDs may contain ':', escaped as '\:' by -t
+            parts = line.replace("\\:", "\0").split(":")
+            if len(parts) < 3 or not parts[0]:
+                continue
+            ssid = parts[0].replace("\0", ":")
+            strength = int(parts[1] or 0)
+            if ssid not in best or strength > best[ssid]["strength"]:
+                best[ssid] = {"ssid": ssid, "strength": strength, "secure": bool(parts[2])}
+        self._scan = sorted(best.values(), key=lambda ap: ap["strength"], reverse=True)
+        self._scanned_at = time.monotonic()
+        return self._scan
+
+    async def connect(self, ssid: str, password: str, progress=None,
+                      timeout_s: float = 20) -> bool:
+        await self._nmcli("connection", "delete", ssid)
+        if progress:
+            progress(ASSOCIATING)
+        # nmcli picks the key management itself; it just can't take a
+        # password for an open network
+        secure = next((ap["secure"] for ap in self._scan if ap["ssid"] == ssid), True)
+        auth = ("password", password) if secure else ()
+        code, _, err = await self._nmcli("device", "wifi", "connect", ssid, *auth,
+                                         timeout_s=timeout_s)
+        if code != 0:
+            log.warning(f"❌ Failed to connect to WiFi: {err}")
+        return code == 0
+
+
+class FakeWifiBackend(WifiBackend):
+    """
+    In-memory stand-in for tests and bench setups. <networks> maps SSID to
+    password; <strengths> optionally maps SSID to 0-100.
+    """
+
+    def __init__(self, networks=None, strengths=None, step_s: float = 0.05):
+        self.networks = networks if networks is not None else {"TestNetwork": "correctpassword"}
+        self.strengths = strengths or {}
+        self.step_s = step_s
+        self.connected = None
+
+    async def scan(self, max_age_s: float = 30) -> list:
+        found = [{"ssid": ssid, "strength": self.strengths.get(ssid, 70), "secure": True}
+                 for ssid in self.networks]
+        return sorted(found, key=lambda ap: ap["strength"], reverse=True)
+
+    async def connect(self, ssid: str, password: str, progress=None,
+                      timeout_s: float = 20) -> bool:
+        for stage in (ASSOCIATING, AUTHENTICATING):
+            if progress:
+                progress(stage)
+            await asyncio.sleep(self.step_s)
+        if self.networks.get(ssid) != password:
+            return False
+        if progress:
+            progress(GETTING_IP)
+        await asyncio.sleep(self.step_s)
+        self.connected = ssid
+        return True
+
+
+def default_backend() -> WifiBackend:
+    return NMWifiBackend() if MessageBus is not None else NmcliWifiBackend()
+
+
+def start_loop_thread() -> asyncio.AbstractEventLoop:
+    """
+    An asyncio loop in a daemon thread, for GLib-driven servers to run
+    backend coroutines on via asyncio.run_coroutine_threadsafe.
+    """
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, name="wifi", daemon=True).start()
+    return loop
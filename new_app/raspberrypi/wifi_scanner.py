@@ -0,0 +1,122 @@
+import asyncio
+import logging
+
+log = logging.getLogger("wifi")
+
+# SSID list characteristic encoding (version 1)
+#
+#   page   : [ver][page][page_count][n] + n * entry
+#   update : [ver][op][n] + n * entry        op 0x01 = added/changed, 0x02 = removed
+#   entry  : [rssi int8 dBm][flags][len][ssid utf-8]   flags bit0 = secured
+#
+# Removed entries carry rssi 0 and flags 0. Pages are sized to fit one read
+# at a typical negotiated MTU; the client writes a page index (1 byte) to
+# select which page the next read returns.
+SSID_LIST_VERSION = 1
+SSID_PAGE_BYTES = 180
+OP_UPSERT = 0x01
+OP_REMOVE = 0x02
+FLAG_SECURE = 0x01
+
+# Only report a strength change once it moves this many dBm
+RSSI_HYSTERESIS_DB = 6
+
+
+def strength_to_rssi(strength: int) -> int:
+    """
+    NetworkManager's 0-100 quality back to an approximate dBm.
+    """
+    return max(-127, min(0, strength // 2 - 100))
+
+
+def encode_entry(ap: dict) -> bytes:
+    ssid = ap["ssid"].encode("utf-8")[:32]
+    flags = FLAG_SECURE if ap.get("secure") else 0
+    return bytes([ap["rssi"] & 0xFF, flags, len(ssid)]) + ssid
+
+
+def encode_pages(aps: list) -> list:
+    entries = [encode_entry(ap) for ap in aps]
+    pages, current = [], []
+    size = 4
+    for entry in entries:
+        if current and size + len(entry) > SSID_PAGE_BYTES:
+            pages.append(current)
+            current, size = [], 4
+        current.append(entry)
+        size += len(entry)
+    pages.append(current)
+    return [bytes([SSID_LIST_VERSION, i, len(pages), len(p)]) + b"".join(p)
+            for i, p in enumerate(pages)]
+
+
+def encode_updates(op: int, aps: list) -> list:
+    """
+    Update frames for <aps>, split so each fits in SSID_PAGE_BYTES.
+    """
+    frames, current, size = [], [], 3
+    for entry in (encode_entry(ap) for ap in aps):
+        if current and size + len(entry) > SSID_PAGE_BYTES:
+            frames.append(current)
+            current, size = [], 3
+        current.append(entry)
+        size += len(entry)
+    if current:
+        frames.append(current)
+    return [bytes([SSID_LIST_VERSION, op, len(f)]) + b"".join(f) for f in frames]
+
+
+class WifiScanner:
+    """
+    Keeps an RSSI-sorted, de-duplicated SSID list fresh in the background.
+
+    Every <interval_s> (while should_scan() allows it, e.g. not mid-connect)
+    it rescans through the Wi-Fi backend, re-encodes the pages and calls
+    on_update(frame) for each update frame describing what changed.
+    """
+
+    def __init__(self, backend, interval_s: float = 20, on_update=None, should_scan=None):
+        self.backend = backend
+        self.interval_s = interval_s
+        self.on_update = on_update
+        self.should_scan = should_scan or (lambda: True)
+        self.aps = {}                  # ssid -> {"ssid", "rssi", "secure"}
+        self.pages = encode_pages([])
+        self.selected_page = 0
+
+    def select_page(self, index: int):
+        self.selected_page = index if 0 <= index < len(self.pages) else 0
+
+    def read_page(self) -> bytes:
+        pages = self.pages
+        return pages[self.selected_page if self.selected_page < len(pages) else 0]
+
+    def apply(self, scan: list):
+        fresh = {ap["ssid"]: {"ssid": ap["ssid"],
+                              "rssi": strength_to_rssi(ap["strength"]),
+                              "secure": ap["secure"]} for ap in scan}
+        removed = [self.aps[ssid] for ssid in self.aps.keys() - fresh.keys()]
+        upserted = [ap for ssid, ap in fresh.items()
+                    if ssid not in self.aps
+                    or abs(self.aps[ssid]["rssi"] - ap["rssi"]) >= RSSI_HYSTERESIS_DB
+                    or self.aps[ssid]["secure"] != ap["secure"]]
+        for ap in upserted:
+            self.aps[ap["ssid"]] = ap
+        for ap in removed:
+            del self.aps[ap["ssid"]]
+        if not (upserted or removed):
+            return
+        self.pages = encode_pages(sorted(self.aps.values(), key=lambda ap: ap["rssi"], reverse=True))
+        if self.on_update:
+            gone = [dict(ap, rssi=0, secure=False) for ap in removed]
+            for frame in encode_updates(OP_UPSERT, upserted) + encode_updates(OP_REMOVE, gone):
+                self.on_update(frame)
+
+    async def run(self):
+        while True:
+            if self.should_scan():
+                try:
+                    self.apply(await self.backend.scan(max_age_s=self.interval_s / 2))
+                except Exception as e:
+                    log.warning(f"Background scan failed: {e}")
+            await asyncio.sleep(self.interval_s)
@@ -0,0 +1,68 @@
+import json
+
+try:
+    import msgpack
+except ImportError:  # JSON-only Pi; the backend falls back too
+    msgpack = None
+
+# Encodings we can speak, best first; sent with "register"
+ENCODINGS = ["msgpack", "json"] if msgpack else ["json"]
+
+# Binary frames are msgpack [tag, body] with the "type" string swapped for a
+# small integer. Keep in sync with websockets/wire-codec.js.
+TYPE_TAGS = {
+    "register": 1,
+    "registered": 2,
+    "sprinklerCmd": 3,
+    "sprinklerAck": 4,
+    "pingEsp": 5,
+    "pongEsp": 6,
+    "pingEspBatch": 7,
+    "pongEspBatch": 8,
+    "pingPi": 9,
+    "pongPi": 10,
+    "start_provisioning": 11,
+    "batch": 12,
+}
+TYPE_NAMES = {tag: name for name, tag in TYPE_TAGS.items()}
+
+
+def _pack(payload: dict):
+    body = dict(payload)
+    msg_type = body.pop("type", None)
+    if msg_type == "batch":
+        body["messages"] = [_pack(m) for m in body.get("messages", [])]
+    return [TYPE_TAGS.get(msg_type, msg_type), body]
+
+
+def _unpack(frame) -> dict:
+    tag, body = frame
+    msg_type = TYPE_NAMES.get(tag, tag)
+    if msg_type == "batch":
+        body["messages"] = [_unpack(m) for m in body.get("messages", [])]
+    return {"type": msg_type, **body}
+
+
+def encode(payload: dict, encoding: str = "json"):
+    """
+    str for JSON (text frame), bytes for msgpack (binary frame).
+    """
+    if encoding == "msgpack" and msgpack is not None:
+        return msgpack.packb(_pack(payload), use_bin_type=True)
+    return json.dumps(payload)
+
+
+def decode(frame) -> dict:
+    """
+    Text frames are JSON, binary frames msgpack, whatever was negotiated.
+    Raises ValueError for anything that doesn't decode.
+    """
+    if isinstance(frame, (bytes, bytearray)):
+        if msgpack is None:
+            raise ValueError("Got a binary frame but msgpack is not installed")
+        try:
+            return _unpack(msgpack.unpackb(frame, raw=False))
+        except (TypeError, ValueError, AttributeError, msgpack.UnpackException) as e:
+            # e.g. not a [tag, body] pair; the caller skips frames it can't decode
+            raise ValueError(f"Malformed binary frame: {e}") from e
+    return json.loads(frame)
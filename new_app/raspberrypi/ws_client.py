@@ -1,136 +1,443 @@
+import startup_profile  # first, so HOMEBASE_PROFILE_STARTUP times everything below
 import asyncio
+import contextlib
+import logging
+import os
 import websockets
 import json
 import time
-import subprocess
-import requests
+import aiohttp
 
-WEBSOCKET_URL_BASE = "ws://35.223.147.76:8081"  # Just the base, no query yet
+from esp_pool import EspPool
+from lan_resolver import LanResolver
+from device_health import DeviceHealth
+from reconnect_policy import ReconnectPolicy
+from heartbeat import Heartbeat
+from outbox import Outbox, OUTBOX_DB
+from backend_link import BackendLink
+import wire_codec
+from phase_timer import PhaseTimer, SESSION_ENV
+from registration_client import RegistrationClient
+from homebase_config import backend_ws_url, config
+from message_registry import MessageRegistry, OptionalField
+from metrics import metrics
+from homebase_logging import setup_logging
 
-HOMEBASE_ID_FILE = "/etc/homebase-id"
-HOMEBASE_TOKEN_FILE = "/etc/homebase-token"
+log = logging.getLogger("ws_client")
 
+WEBSOCKET_URL_BASE = backend_ws_url()  # Just the base, no query yet
 
-def read_file(path):
+# Max in-flight HTTP requests to a single ESP32. Its web server handles one
+# request at a time, so anything above 1 just queues up on the device.
+ESP32_MAX_INFLIGHT = 1
+ESP32_TIMEOUT_S = 3
+
+# Keep-alive pool shared by the command and ping paths
+ESP32_POOL_MAX_CONNECTIONS = 2
+ESP32_POOL_KEEPALIVE_S = 30
+ESP32_POOL_IDLE_EVICT_S = 120
+
+# lanName -> IP cache so requests skip the mDNS lookup
+LAN_RESOLVE_TTL_S = 300
+LAN_RESOLVE_NEGATIVE_TTL_S = 30
+
+# Background health table; pingEsp answers from it while entries are fresh
+HEALTH_PROBE_INTERVAL_S = 30
+HEALTH_PROBE_JITTER_S = 5
+HEALTH_FRESH_S = 45
+
+# Backend reconnect: fast first retry, then jittered exponential backoff
+RECONNECT_FIRST_RETRY_S = 0.5
+RECONNECT_BASE_S = 1
+RECONNECT_CAP_S = 60
+# Backoff resets on the backend's "registered" reply, or after this much uptime
+RECONNECT_STABLE_AFTER_S = 30
+
+reconnect = ReconnectPolicy(RECONNECT_BASE_S, RECONNECT_CAP_S, RECONNECT_FIRST_RETRY_S,
+                            RECONNECT_STABLE_AFTER_S)
+
+# "ping" = our own websocket ping/pong with latency tracking, "off" = library keepalive
+HEARTBEAT_MODE = os.environ.get("HOMEBASE_HEARTBEAT", "ping")
+HEARTBEAT_INTERVAL_S = 15
+HEARTBEAT_TIMEOUT_S = 10
+
+heartbeat = Heartbeat(HEARTBEAT_MODE, HEARTBEAT_INTERVAL_S, HEARTBEAT_TIMEOUT_S)
+
+# Retry delays when an ESP32 can't be reached for a sprinklerCmd, and the
+# total time a command may take. The budget must stay below the backend's
+# SPRINKLER_ACK_TIMEOUT_MS (5 s, ws-pi.js) so a zone never toggles after
+# the backend has already reported the command as failed.
+ESP32_CMD_RETRY_DELAYS_S = (0.25, 0.5)
+ESP32_CMD_BUDGET_S = 4
+# Queued frames sent per batch when flushing the outbox after register
+OUTBOX_FLUSH_BATCH = 50
+
+# Outbound messages produced within this window share one websocket frame
+COALESCE_WINDOW_S = 0.02
+COALESCE_MAX_BATCH = 50
+
+# permessage-deflate on the backend socket: "deflate" or "off"
+WS_COMPRESSION = os.environ.get("HOMEBASE_WS_COMPRESSION", "deflate")
+
+# Include the metrics registry (see metrics.py) in pongPi
+PONG_METRICS = os.environ.get("HOMEBASE_PONG_METRICS", "1") != "0"
+
+RECONNECTS = metrics.counter("homebase_ws_reconnects_total", "Backend connections lost or failed")
+CONNECTED = metrics.gauge("homebase_ws_connected", "1 while registered with the backend")
+IN_FLIGHT = metrics.gauge("homebase_handlers_in_flight", "Message handlers still running")
+SEND_QUEUE = metrics.gauge("homebase_send_queue_depth", "Outbound messages waiting for the writer")
+OUTBOX_PENDING = metrics.gauge("homebase_outbox_pending", "Durable frames parked in the outbox")
+REGISTRATIONS_PENDING = metrics.gauge("homebase_registrations_pending",
+                                      "ESP32 registrations queued for the backend")
+
+# Optional message types this client understands, announced at register time
+CLIENT_FEATURES = ["pingEspBatch"]
+
+class DeviceSlot:
+    """
+    Requests in flight to one ESP32, at most ESP32_MAX_INFLIGHT. Commands
+    come first: a probe is skipped while a command is waiting or running,
+    and a command that finds a probe in flight cancels it instead of
+    waiting out the probe's timeout.
+    """
+
+    def __init__(self):
+        self.lock = asyncio.Semaphore(ESP32_MAX_INFLIGHT)
+        self.commands = 0        # commands waiting for or holding the lock
+        self.probe = None        # the in-flight probe request, if any
+        self.preempted = None    # the probe request a command cancelled
+
+    def idle(self) -> bool:
+        return not self.commands and not self.lock.locked()
+
+
+_device_slots = {}  # lanName -> DeviceSlot, only while in use
+
+
+def device_slot(lan: str) -> DeviceSlot:
+    slot = _device_slots.get(lan)
+    if slot is None:
+        slot = _device_slots[lan] = DeviceSlot()
+    return slot
+
+
+def release_slot(lan: str):
+    # Drop idle slots so devices removed on the backend don't linger here
+    slot = _device_slots.get(lan)
+    if slot is not None and slot.idle():
+        del _device_slots[lan]
+
+
+@contextlib.asynccontextmanager
+async def command_slot(lan: str):
+    slot = device_slot(lan)
+    slot.commands += 1
     try:
-        with open(path, 'r') as f:
-            return f.read().strip()
-    except Exception as e:
-        print(f"[ws_client] Could not read {path}: {e}")
-        return None
-    
-def ping_esp32(host: str, timeout_s: int = 3) -> bool:
+        if slot.probe is not None:
+            slot.preempted = slot.probe
+            slot.probe.cancel()
+        async with slot.lock:
+            yield
+    finally:
+        slot.commands -= 1
+        release_slot(lan)
+
+
+async def probe_esp32(pool: EspPool, host: str, timeout_s: int = ESP32_TIMEOUT_S):
+    """
+    GET http://<host>/ping. Returns (online, rtt_ms); rtt_ms is None when
+    offline, and both are None if the probe gave way to a command.
+    """
+    slot = device_slot(host)
+    if not slot.idle():
+        return None, None
+    try:
+        async with slot.lock:
+            started = time.monotonic()
+            request = slot.probe = asyncio.ensure_future(pool.get(host, "/ping", timeout_s))
+            try:
+                ok = await request == 200
+            except asyncio.CancelledError:
+                if slot.preempted is request:
+                    return None, None
+                raise
+            finally:
+                slot.probe = slot.preempted = None
+            rtt_ms = round((time.monotonic() - started) * 1000, 1)
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        return False, None
+    finally:
+        release_slot(host)
+    return ok, (rtt_ms if ok else None)
+
+
+async def ping_esp32(pool: EspPool, host: str, timeout_s: int = ESP32_TIMEOUT_S) -> bool:
     """
     Return True iff GET http://<host>/ping answers 200 within <timeout_s>.
     """
+    online, _ = await probe_esp32(pool, host, timeout_s)
+    return online
+
+
+async def send_sprinkler_cmd(pool: EspPool, lan: str, zone: int, on: bool, key: str,
+                             budget_s: float = ESP32_CMD_BUDGET_S) -> bool:
+    """
+    POST the zone toggle to the ESP32. True iff it answered 200 within
+    <budget_s>, retries included.
+    """
+    path = f"/led{zone}/" + ("on" if on else "off")
+    log.debug("→ http://%s%s", lan, path)
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + budget_s
+
+    # ESP32 expects a JSON body. /ledN/on|off is idempotent, so retrying an
+    # unreachable device is safe; a non-200 answer is final.
+    async def attempts():
+        for attempt, delay in enumerate((0, *ESP32_CMD_RETRY_DELAYS_S), start=1):
+            await asyncio.sleep(delay)
+            try:
+                async with command_slot(lan):
+                    timeout_s = min(ESP32_TIMEOUT_S, deadline - loop.time())
+                    return await pool.post(lan, path, {"key": key}, timeout_s) == 200
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                log.warning(f"{lan} unreachable (attempt {attempt}): {e!r}")
+        return False
+
     try:
-        r = requests.get(f"http://{host}/ping", timeout=timeout_s)
-        return r.status_code == 200
-    except requests.RequestException:
+        return await asyncio.wait_for(attempts(), budget_s)
+    except asyncio.TimeoutError:
+        log.warning(f"{lan} did not answer within {budget_s}s")
         return False
 
-async def connect_and_run():
-    homebase_id = read_file(HOMEBASE_ID_FILE)
-    homebase_token = read_file(HOMEBASE_TOKEN_FILE)
-    if not homebase_id or not homebase_token:
-        print("[ws_client] Missing homebase ID or homebase token. Exiting.")
-        return
 
-    #ws_url = f"{WEBSOCKET_URL_BASE}?token={homebase_token}"
-    ws_url = f"{WEBSOCKET_URL_BASE}?token={homebase_token}"
+messages = MessageRegistry("ws_client")
+
+
+@messages.handler("registered", {"encoding": OptionalField(str)})
+async def on_registered(link, pool, health, data):
+    # Backend picked the framing for the rest of this connection
+    link.encoding = data.get("encoding", "json")
+    reconnect.stable()
+    log.info(f"Registered, using {link.encoding} framing")
+
+
+@messages.handler("start_provisioning", {"expected": OptionalField(int)})
+async def on_start_provisioning(link, pool, health, data):
+    log.info("Starting BLE provisioning mode …")
+    start_esp32_provisioning(int(data.get("expected") or 1))
+
+
+async def reject_sprinkler_cmd(link, pool, health, data, error):
+    # Fail fast instead of leaving the backend to wait out its ack timer
+    await link.send({
+        "type": "sprinklerAck",
+        "msgId": data.get("msgId"),
+        "success": False,
+        "error": str(error),
+    })
+
+
+# expected payload the backend sends **to this Pi**
+# {
+#   "type": "sprinklerCmd",
+#   "lanName": "esp32-frontyard.local",
+#   "zone": 3,
+#   "on": true,
+#   "key": "123456"          # same shared secret
+# }
+@messages.handler("sprinklerCmd", {
+    "lanName": str,                     # mDNS / IP of ESP32
+    "zone": (int, str),
+    "on": bool,
+    "key": str,
+    "msgId": OptionalField(str, int),
+}, on_invalid=reject_sprinkler_cmd)
+async def on_sprinkler_cmd(link, pool, health, data):
+    lan = data["lanName"]
+    success = await send_sprinkler_cmd(pool, lan, data["zone"], data["on"], data["key"])
+    health.track(lan)
+    if success:
+        health.record(lan, True)
+    # Durable: if the socket dropped meanwhile the ack waits in the outbox
+    await link.send({
+        "type": "sprinklerAck",
+        "msgId": data.get("msgId"),
+        "success": success
+    }, durable=True)
+
+
+# message from backend cron
+# { "type":"pingEsp", "lanName":"esp32-frontyard.local", "msgId":"abc123" }
+@messages.handler("pingEsp", {"lanName": str, "msgId": OptionalField(str, int)})
+async def on_ping_esp(link, pool, health, data):
+    lan = data["lanName"]
+    online, _ = await health.status(lan)
+
+    # send result back to backend
+    await link.send({
+        "type"   : "pongEsp",
+        "lanName": lan,
+        "online" : online,
+        "msgId"  : data.get("msgId"),   # echo so backend matches responses
+    })
+
+
+# { "type":"pingEspBatch", "lanNames":["esp32-a.local", ...], "msgId":"abc123" }
+@messages.handler("pingEspBatch", {"lanNames": list, "msgId": OptionalField(str, int)})
+async def on_ping_esp_batch(link, pool, health, data):
+    lans = data["lanNames"]
+    probes = await asyncio.gather(*(health.status(lan) for lan in lans))
 
+    await link.send({
+        "type"   : "pongEspBatch",
+        "msgId"  : data.get("msgId"),
+        "results": [
+            {"lanName": lan, "online": online, "rttMs": rtt_ms}
+            for lan, (online, rtt_ms) in zip(lans, probes)
+        ],
+    })
+
+
+@messages.handler("pingPi", {"msgId": OptionalField(str, int)})
+async def on_ping_pi(link, pool, health, data):
+    await link.send({
+        "type": "pongPi",
+        "msgId": data.get("msgId"),
+        "espPool": pool.stats(),      # per-device connection reuse counters
+        "reconnect": reconnect.stats(),
+        "heartbeat": heartbeat.stats(),  # rolling RTT histogram to the backend
+        "outboxPending": link.outbox.pending(),
+        "writer": link.stats(),       # coalescing: messages vs frames, frames/s
+        # Histograms (heartbeat RTT, per-type handler latency) and counters
+        **({"metrics": metrics.snapshot()} if PONG_METRICS else {}),
+    })
+
+
+async def serve_backend(ws_url, homebase_id, link, pool, health, registrations,
+                        onboarding=None):
+    # Handler tasks outlive a dropped socket: they finish and queue their acks
+    in_flight = set()
+    IN_FLIGHT.fn = lambda: len(in_flight)
     while True:
+        hb_task = None
         try:
-            print(f"[ws_client] Connecting to backend at {ws_url} ...")
-            async with websockets.connect(ws_url) as ws:
+            log.info(f"Connecting to backend at {WEBSOCKET_URL_BASE} ...")  # ws_url carries the token
+            # Our heartbeat replaces the library keepalive when it's enabled
+            ping_interval = None if heartbeat.enabled else 20
+            compression = "deflate" if WS_COMPRESSION == "deflate" else None
+            async with websockets.connect(ws_url, ping_interval=ping_interval,
+                                          compression=compression) as ws:
                 # Identify yourself to the backend
-                hello_msg = json.dumps({
+                hello = {
                     "type": "register",
-                    "homebaseId": homebase_id
-                })
+                    "homebaseId": homebase_id,
+                    "features": CLIENT_FEATURES,
+                    "encodings": wire_codec.ENCODINGS,
+                }
+                if onboarding is not None:
+                    # First register after provisioning closes the timing session
+                    onboarding.mark("registered")
+                    hello["onboarding"] = onboarding.summary()
+                    log.info(f"Time to online: {onboarding.summary()}")
+                    onboarding = None
+                hello_msg = json.dumps(hello)
                 await ws.send(hello_msg)
-                print(f"[ws_client] Sent registration: {hello_msg}")
+                log.info(f"Sent registration for {homebase_id}")
+                startup_profile.mark("registered", report=True)
+                reconnect.connected()
+                CONNECTED.set(1)
+                link.attach(ws)
+                await link.flush()
+                if registrations.pending():
+                    # Backend is reachable again: finish registering ESP32s
+                    # that ble_provision.py couldn't
+                    task = asyncio.create_task(registrations.drain())
+                    in_flight.add(task)
+                    task.add_done_callback(in_flight.discard)
+                hb_task = asyncio.create_task(heartbeat.run(ws))
                 while True:
                     msg = await ws.recv()
-                    print(f"[ws_client] Received from server: {msg}")
 
                     try:
-                        data = json.loads(msg)
-
-                        # ----- 1️⃣ already-existing branch -----
-                        if data.get("type") == "start_provisioning":
-                            print("[ws_client] Starting BLE provisioning mode …")
-                            subprocess.Popen(
-                                ['python3', '/home/admin/ble_provision.py']
-                            )
-
-                        # ----- 2️⃣ NEW branch for sprinkler commands -----
-                        elif data.get("type") == "sprinklerCmd":
-                            msg_id = data.get("msgId")
-                            # expected payload the backend sends **to this Pi**
-                            # {
-                            #   "type": "sprinklerCmd",
-                            #   "lanName": "esp32-frontyard.local",
-                            #   "zone": 3,
-                            #   "on": true,
-                            #   "key": "123456"          # same shared secret
-                            # }
-                            lan  = data["lanName"]          # mDNS / IP of ESP32
-                            zone = data["zone"]             # 1-4
-                            on   = data["on"]               # True/False
-                            key  = data["key"]              # auth key
-
-                            path = f"/led{zone}/" + ("on" if on else "off")
-                            url  = f"http://{lan}{path}"
-
-                            print(f"[ws_client]  → {url}")
-
-                            # form-URL-encoded or JSON – ESP32 expects JSON body
-                            import requests, json as pj
-                            try:
-                                resp = requests.post(url, json={"key": key}, timeout=3)
-                                success = resp.status_code == 200
-                                result_msg = {
-                                    "type": "sprinklerAck",
-                                    "msgId": msg_id,
-                                    "success": success
-                                }
-                            except requests.RequestException as e:
-                                result_msg = {
-                                    "type": "sprinklerAck",
-                                    "msgId": msg_id,
-                                    "success": False
-                                }
-
-                            await ws.send(json.dumps(result_msg))
-                        elif data.get("type") == "pingEsp":
-                            # message from backend cron
-                            # { "type":"pingEsp", "lanName":"esp32-frontyard.local", "msgId":"abc123" }
-                            lan    = data["lanName"]
-                            msg_id = data.get("msgId")
-
-                            online = ping_esp32(lan)          # ←  ✅  use the helper here
-
-                            # send result back to backend
-                            await ws.send(json.dumps({
-                                "type"   : "pongEsp",
-                                "lanName": lan,
-                                "online" : online,
-                                "msgId"  : msg_id,            # echo so backend matches responses
-                            }))
-                        elif data.get("type") == "pingPi":
-                            await ws.send(json.dumps({
-                                "type": "pongPi",
-                                "msgId": data.get("msgId")
-                            }))
-
-                    except Exception as ex:
-                        print("[ws_client] Error processing message:", ex)           
-                          
+                        data = wire_codec.decode(msg)
+                    except ValueError as ex:
+                        log.warning(f"Could not decode message: {ex}")
+                        continue
+                    # Full payloads only at debug level, formatted lazily
+                    log.debug("Received from server: %s", data)
+
+                    # Each message runs as its own task so one slow ESP32
+                    # doesn't hold up the socket; acks go out as they finish.
+                    task = asyncio.create_task(messages.dispatch(data, link, pool, health))
+                    in_flight.add(task)
+                    task.add_done_callback(in_flight.discard)
+
         except Exception as e:
-            print(f"[ws_client] Connection lost or failed: {e}")
-            print("[ws_client] Reconnecting in 5 seconds...")
-            time.sleep(5)
+            log.warning(f"Connection lost or failed: {e}", extra={"category": "reconnect"})
+            RECONNECTS.inc()
+            CONNECTED.set(0)
+            link.detach()
+            if hb_task is not None:
+                hb_task.cancel()
+            reconnect.disconnected()
+            await reconnect.wait()
+
+
+def spawn_ble_provision(expected):
+    import subprocess
+    subprocess.Popen(
+        ['python3', '/home/admin/ble_provision.py', '--expected', str(expected)]
+    )
+
+# homebase_daemon.py swaps this for its in-process ESP32 central
+start_esp32_provisioning = spawn_ble_provision
+
+
+async def connect_and_run(onboarding=None):
+    # Handed over by homebase_daemon.py, or set when pyserver.py exec'd us
+    # at the end of onboarding
+    if onboarding is None:
+        onboarding = PhaseTimer.resume()
+    if onboarding is not None:
+        onboarding.mark("ws_client_start")
+        os.environ.pop(SESSION_ENV, None)  # not for our children
+
+    settings = config.load()
+    homebase_id = settings.get("homebaseId")
+    homebase_token = settings.get("homebaseToken")
+    if not homebase_id or not homebase_token:
+        log.warning("Missing homebase ID or homebase token. Exiting.")
+        return
+
+    #ws_url = f"{WEBSOCKET_URL_BASE}?token={homebase_token}"
+    ws_url = f"{WEBSOCKET_URL_BASE}?token={homebase_token}"
+
+    async with EspPool(ESP32_POOL_MAX_CONNECTIONS,
+                       ESP32_POOL_KEEPALIVE_S,
+                       ESP32_POOL_IDLE_EVICT_S,
+                       LanResolver(LAN_RESOLVE_TTL_S, LAN_RESOLVE_NEGATIVE_TTL_S)) as pool:
+        health = DeviceHealth(lambda lan: probe_esp32(pool, lan),
+                              HEALTH_PROBE_INTERVAL_S,
+                              HEALTH_PROBE_JITTER_S,
+                              HEALTH_FRESH_S)
+        health.start()
+        link = BackendLink(Outbox(OUTBOX_DB), COALESCE_WINDOW_S,
+                           COALESCE_MAX_BATCH, OUTBOX_FLUSH_BATCH)
+        registrations = RegistrationClient()
+        SEND_QUEUE.fn = link.queued
+        OUTBOX_PENDING.fn = link.outbox.pending
+        REGISTRATIONS_PENDING.fn = registrations.pending
+        metrics_server = await metrics.serve()
+        try:
+            await serve_backend(ws_url, homebase_id, link, pool, health, registrations,
+                                onboarding)
+        finally:
+            if metrics_server is not None:
+                metrics_server.close()
+            health.stop()
+            link.outbox.close()
+            registrations.close()
 
 if __name__ == "__main__":
+    setup_logging()
     asyncio.run(connect_and_run())
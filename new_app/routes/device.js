@@ -7,6 +7,41 @@ const router = express.Router();
 const prisma = new PrismaClient();
 
 
+// Upsert one device record for a HomeBase and tell the app about it
+async function registerDevice(homeBaseId, { deviceId, name, type, lanName, online }) {
+  const device = await prisma.device.upsert({
+    where:  { id: deviceId },
+    update: { name, type, homeBaseId, lanName, online },     // ← add here
+    create: {
+      id: deviceId,
+      name,
+      type,
+      lanName,                                       // ← and here
+      homeBase: { connect: { id: homeBaseId } },
+      online
+    }
+  });
+
+  // ─────────── Sprinkler 1-to-1 state ───────────
+  if (device.type === "sprinkler") {
+    await prisma.sprinklerState.upsert({
+      where:   { deviceId: device.id },   // PK == FK
+      update:  {},                        // nothing to update on re-provision
+      create:  { deviceId: device.id }    // all zones default to false
+    });
+  }
+
+  // Notify the app via WebSocket
+  notifyAppOfProvisioning(homeBaseId, {
+    name: device.name,
+    uuid: device.id,
+    deviceType: device.type,
+    lanName: device.lanName,     // ✅ added
+    online: device.online
+  });
+  return device;
+}
+
 router.post("/register", async (req, res) => {
   const { homeBaseId, deviceId, name, type, lanName, online } = req.body;
 
@@ -14,50 +49,8 @@ router.post("/register", async (req, res) => {
     return res.status(400).json({ error: 'Missing fields' });
   }
   try {
-    // Upsert device
-    const device = await prisma.device.upsert({
-      where:  { id: deviceId },
-      update: { name, type, homeBaseId, lanName, online },     // ← add here
-      create: {
-        id: deviceId,
-        name,
-        type,
-        lanName,                                       // ← and here
-        homeBase: { connect: { id: homeBaseId } },
-        online
-      }
-    });
-
-    console.log('hit here')
-    console.log('device', device)
-        // ─────────── Sprinkler 1-to-1 state ───────────
-    if (device.type === "sprinkler") {
-      await prisma.sprinklerState.upsert({
-        where:   { deviceId: device.id },   // PK == FK
-        update:  {},                        // nothing to update on re-provision
-        create:  { deviceId: device.id }    // all zones default to false
-      });
-    }
-
-
-    // Debug what we are about to notify
-    console.log("[/register] NOT UPDATED Notifying app of new device:", {
-      name: device.name,
-      uuid: device.id,
-      deviceType: device.type,
-      online: device.online,
-      homeBaseId
-    });
-
-    // Notify the app via WebSocket
-    notifyAppOfProvisioning(homeBaseId, {
-      name: device.name,
-      uuid: device.id,
-      deviceType: device.type,
-      lanName: device.lanName,     // ✅ added
-      online: device.online
-    });
-
+    const device = await registerDevice(homeBaseId, { deviceId, name, type, lanName, online });
+    console.log('[/register] Registered device', device.id);
     res.json({ success: true, device });
   } catch (e) {
     console.error("[/register] Error:", e);
@@ -65,6 +58,38 @@ router.post("/register", async (req, res) => {
   }
 });
 
+// POST /device/register/batch
+// { homeBaseId, devices: [{ deviceId, name, type, lanName, online }], failures: [{ address, error }] }
+// Every device is registered independently; the reply carries one result per record.
+router.post("/register/batch", async (req, res) => {
+  const { homeBaseId, devices, failures = [] } = req.body;
+
+  if (!homeBaseId || !Array.isArray(devices)) {
+    return res.status(400).json({ error: 'Missing fields' });
+  }
+  for (const f of failures) {
+    console.warn(`[/register/batch] ${homeBaseId}: ${f.address} failed to provision: ${f.error}`);
+  }
+
+  const results = [];
+  for (const record of devices) {
+    const { deviceId, name, type, lanName } = record;
+    if (!deviceId || !name || !type || !lanName) {
+      results.push({ deviceId, success: false, error: 'Missing fields' });
+      continue;
+    }
+    try {
+      const device = await registerDevice(homeBaseId, record);
+      results.push({ deviceId: device.id, success: true });
+    } catch (e) {
+      console.error(`[/register/batch] ${deviceId}:`, e);
+      results.push({ deviceId, success: false, error: 'Failed to register device' });
+    }
+  }
+  console.log(`[/register/batch] ${homeBaseId}: ${results.filter(r => r.success).length}/${devices.length} registered`);
+  res.json({ success: results.every(r => r.success), results });
+});
+
 
 // routes/device.js (add this route)
 router.get('/list', authenticateToken, async (req, res) => {
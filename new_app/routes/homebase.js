@@ -109,8 +109,13 @@ router.post('/start-device-provision', authenticateToken, async (req, res) => {
       return res.status(404).json({ error: 'HomeBase is offline' });
     }
 
-    // 3. Send a message to the Pi
-    ws.send(JSON.stringify({ type: "start_provisioning" }));
+    // 3. Send a message to the Pi. <expected> lets it provision several
+    // controllers from one scan; without it the Pi takes the first one found.
+    const expected = Number.parseInt(req.body?.expected, 10);
+    ws.send(JSON.stringify({
+      type: "start_provisioning",
+      ...(expected > 0 && { expected })
+    }));
 
     res.json({ success: true });
   } catch (e) {
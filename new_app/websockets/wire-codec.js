@@ -0,0 +1,53 @@
+// Pi <-> backend frame encoding. JSON text frames always work; Pis that offer
+// "msgpack" at register get binary [typeTag, body] frames instead.
+// Keep the tags in sync with raspberrypi/wire_codec.py.
+
+let msgpack = null;
+try {
+  msgpack = await import("@msgpack/msgpack");
+} catch {
+  console.warn("[WS-PI] @msgpack/msgpack not installed — JSON framing only");
+}
+
+export const TYPE_TAGS = {
+  register          : 1,
+  registered        : 2,
+  sprinklerCmd      : 3,
+  sprinklerAck      : 4,
+  pingEsp           : 5,
+  pongEsp           : 6,
+  pingEspBatch      : 7,
+  pongEspBatch      : 8,
+  pingPi            : 9,
+  pongPi            : 10,
+  start_provisioning: 11,
+  batch             : 12
+};
+const TYPE_NAMES = Object.fromEntries(Object.entries(TYPE_TAGS).map(([k, v]) => [v, k]));
+
+export const pickEncoding = (offered) =>
+  msgpack && Array.isArray(offered) && offered.includes("msgpack") ? "msgpack" : "json";
+
+const pack = ({ type, ...body }) => {
+  if (type === "batch") body.messages = (body.messages ?? []).map(pack);
+  return [TYPE_TAGS[type] ?? type, body];
+};
+
+const unpack = ([tag, body]) => {
+  const type = TYPE_NAMES[tag] ?? tag;
+  if (type === "batch") body.messages = (body.messages ?? []).map(unpack);
+  return { type, ...body };
+};
+
+export function encode(payload, encoding = "json") {
+  if (encoding === "msgpack" && msgpack) return msgpack.encode(pack(payload));
+  return JSON.stringify(payload);
+}
+
+export function decode(msg, isBinary) {
+  if (isBinary) {
+    if (!msgpack) throw new Error("Binary frame but msgpack is not installed");
+    return unpack(msgpack.decode(msg));
+  }
+  return JSON.parse(msg);
+}
@@ -1,11 +1,20 @@
 import { WebSocketServer } from 'ws';
 import jwt from 'jsonwebtoken';
 import { PrismaClient } from "@prisma/client";
+import { encode, decode, pickEncoding } from "./wire-codec.js";
 
 export const piSockets = new Map(); // homebaseId -> ws
 export const pendingPings = new Map(); // msgId -> { deviceId, expiresAt }
+export const pendingBatchPings = new Map(); // msgId -> { devices: { lanName: deviceId }, expiresAt }
 export const pendingPiPings = new Map(); // msgId -> { homeBaseId, expiresAt }
 export const PING_TIMEOUT_MS = 20_000;
+export const pendingSprinklerAcks = new Map(); // msgId -> { resolve, timer }
+export const lateSprinklerAcks = new Map(); // msgId -> { homebaseId, payload, cmdSeq, expiresAt }
+// "homebaseId/lanName/zone" -> cmdSeq of the newest command sent for that zone
+const latestSprinklerCmds = new Map();
+let sprinklerCmdSeq = 0;
+const SPRINKLER_ACK_TIMEOUT_MS = 5000;
+const LATE_ACK_TTL_MS = 10 * 60_000;
 
 const prisma = new PrismaClient();
 
@@ -13,7 +22,7 @@ const prisma = new PrismaClient();
 export const sendToPi = (homebaseId, payload) => {
   const ws = piSockets.get(homebaseId);
   if (!ws || ws.readyState !== ws.OPEN) return false;
-  ws.send(JSON.stringify(payload));
+  ws.send(encode(payload, ws._encoding));
   return true;
 };
 
@@ -25,27 +34,178 @@ export function notifyPiOfSprinklerCmd(homebaseId, payload) {
 
   return new Promise((resolve, reject) => {
     const msgId = Math.random().toString(36).slice(2);
-    const listener = (msg) => {
-      try {
-        const data = JSON.parse(msg);
-        if (data.type === "sprinklerAck" && data.msgId === msgId) {
-          ws.off("message", listener);
-          resolve(data.success);
-        }
-      } catch {}
-    };
-    ws.on("message", listener);
-    ws.send(JSON.stringify({ type: "sprinklerCmd", msgId, ...payload }));
-
-    setTimeout(() => {
-      ws.off("message", listener);
+    const cmdSeq = ++sprinklerCmdSeq;
+    latestSprinklerCmds.set(sprinklerZoneKey(homebaseId, payload), cmdSeq);
+    const timer = setTimeout(() => {
+      pendingSprinklerAcks.delete(msgId);
+      // The Pi keeps unsent acks in its outbox; remember the command so a
+      // late ack can still bring the DB in line with the ESP32.
+      lateSprinklerAcks.set(msgId, {
+        homebaseId,
+        payload,
+        cmdSeq,
+        expiresAt: Date.now() + LATE_ACK_TTL_MS
+      });
       reject("Timeout waiting for ack from Pi");
-    }, 5000);
+    }, SPRINKLER_ACK_TIMEOUT_MS);
+
+    pendingSprinklerAcks.set(msgId, { resolve, timer });
+    ws.send(encode({ type: "sprinklerCmd", msgId, ...payload }, ws._encoding));
   });
 }
 
+function sprinklerZoneKey(homebaseId, payload) {
+  return `${homebaseId}/${payload.lanName}/${payload.zone}`;
+}
+
+async function applyLateSprinklerAck(meta) {
+  const { homebaseId, payload, cmdSeq } = meta;
+  // A newer command for this zone was sent after this one: its state wins
+  if (latestSprinklerCmds.get(sprinklerZoneKey(homebaseId, payload)) !== cmdSeq) {
+    console.log(`[WS-PI] Late ack ignored: zone ${payload.zone} on ${payload.lanName} has a newer command`);
+    return;
+  }
+  const device = await prisma.device.findFirst({
+    where: { homeBaseId: homebaseId, lanName: payload.lanName }
+  });
+  if (!device) return;
+  await prisma.sprinklerState.update({
+    where: { deviceId: device.id },
+    data : { [`zone${payload.zone}`]: payload.on }
+  }).catch(console.error);
+  console.log(`[WS-PI] Late ack applied: zone ${payload.zone} ${payload.on ? "ON" : "OFF"} on ${device.id}`);
+}
+
+async function handlePiMessage(ws, data, userId) {
+  if (data.type === 'register' && data.homebaseId) {
+    piSockets.set(data.homebaseId, ws);
+    ws._homebaseId = data.homebaseId;
+    ws._userId = userId;
+    ws._features = new Set(Array.isArray(data.features) ? data.features : []);
+    // Negotiate framing; the reply itself is JSON so any Pi can read it
+    const encoding = pickEncoding(data.encodings);
+    ws.send(encode({ type: "registered", encoding }));
+    ws._encoding = encoding;
+    console.log(`[WebSocket] Homebase connected: ${data.homebaseId} (${encoding})`);
+    if (data.onboarding) {
+      // End-to-end onboarding timings from the Pi (first register after provisioning)
+      console.log(`[ONBOARDING] ${data.homebaseId} ${JSON.stringify(data.onboarding)}`);
+    }
+    return;
+  }
+
+  // Several frames in one, e.g. acks the Pi queued while it was offline
+  if (data.type === "batch") {
+    for (const inner of data.messages ?? []) {
+      await handlePiMessage(ws, inner, userId);
+    }
+    return;
+  }
+
+  if (data.type === "sprinklerAck") {
+    const pending = pendingSprinklerAcks.get(data.msgId);
+    if (pending) {
+      clearTimeout(pending.timer);
+      pendingSprinklerAcks.delete(data.msgId);
+      pending.resolve(data.success);
+      return;
+    }
+    const late = lateSprinklerAcks.get(data.msgId);
+    if (late) {
+      lateSprinklerAcks.delete(data.msgId);
+      if (data.success) await applyLateSprinklerAck(late);
+    }
+    return;
+  }
+
+  if (data.type === "pongEsp") {
+    const meta = pendingPings.get(data.msgId);
+    if (meta) {
+      pendingPings.delete(data.msgId);
+      console.log(`[PING-ESP32] Received pong for device ${meta.deviceId} — ONLINE: ${data.online}`);
+
+      await prisma.device.update({
+        where: { id: meta.deviceId },
+        data : {
+          online: data.online
+        }
+      }).catch((err) => {
+        console.error(`[PING] Failed to update device ${meta.deviceId} online status:`, err);
+      });
+    } else {
+      console.warn(`[PING] Received pong with unknown msgId: ${data.msgId}`);
+    }
+    return;
+  }
+  if (data.type === "pongEspBatch") {
+    const meta = pendingBatchPings.get(data.msgId);
+    if (!meta) {
+      console.warn(`[PING] Received batch pong with unknown msgId: ${data.msgId}`);
+      return;
+    }
+    pendingBatchPings.delete(data.msgId);
+
+    const seen = new Set();
+    for (const r of data.results ?? []) {
+      const deviceId = meta.devices[r.lanName];
+      if (!deviceId) continue;
+      seen.add(r.lanName);
+      console.log(`[PING-ESP32] Batch pong for device ${deviceId} — ONLINE: ${r.online}${r.rttMs != null ? ` (${r.rttMs} ms)` : ''}`);
+      await prisma.device.update({
+        where: { id: deviceId },
+        data : { online: !!r.online }
+      }).catch((err) => {
+        console.error(`[PING] Failed to update device ${deviceId} online status:`, err);
+      });
+    }
+
+    // Anything the Pi didn't report on is treated as offline
+    const missing = Object.entries(meta.devices)
+      .filter(([lanName]) => !seen.has(lanName))
+      .map(([, deviceId]) => deviceId);
+    if (missing.length) {
+      await prisma.device.updateMany({
+        where: { id: { in: missing } },
+        data : { online: false }
+      }).catch(console.error);
+    }
+    return;
+  }
+  if (data.type === "pongPi") {
+    const hbId = ws._homebaseId;
+    if (hbId) {
+      // 🧹 cleanup ping
+      for (const [msgId, meta] of pendingPiPings.entries()) {
+        if (meta.homeBaseId === hbId) {
+          pendingPiPings.delete(msgId);
+        }
+      }
+
+      // Link quality from the Pi's heartbeat (rolling RTT histogram)
+      if (data.heartbeat) ws._heartbeat = data.heartbeat;
+      const p95 = data.heartbeat?.p95;
+      console.log(`[PING-PI] ✅ Homebase ${hbId} is ONLINE${p95 != null ? ` (heartbeat p95 ${p95} ms, stalls ${data.heartbeat.stalls})` : ''}`);
+      await prisma.homeBase.update({
+        where: { id: hbId },
+        data : {
+          online     : true,
+          lastPingAt : new Date()
+        }
+      }).catch(console.error);
+    }
+    return;
+  }
+
+  // You can handle more types here if needed
+}
+
 export function createPiWebSocketServer(port = 8081) {
-  const wss = new WebSocketServer({ port });
+  // permessage-deflate is off by default in ws; Pis that offer it get it.
+  // Small frames (pongs, single acks) aren't worth compressing.
+  const wss = new WebSocketServer({
+    port,
+    perMessageDeflate: { threshold: 256 }
+  });
 
   wss.on('connection', (ws, req) => {
     const url = new URL(req.url, `ws://${req.headers.host}`);
@@ -60,64 +220,15 @@ export function createPiWebSocketServer(port = 8081) {
       return ws.close();
     }
 
-    ws.on('message', async (msg) => {
+    ws.on('message', async (msg, isBinary) => {
       let data;
       try {
-        data = JSON.parse(msg);
+        data = decode(msg, isBinary);
       } catch {
-        return ws.close(1003, "Invalid JSON");
-      }
-
-      if (data.type === 'register' && data.homebaseId) {
-        piSockets.set(data.homebaseId, ws);
-        ws._homebaseId = data.homebaseId;
-        ws._userId = userId;
-        console.log(`[WebSocket] Homebase connected: ${data.homebaseId}`);
-        return;
+        return ws.close(1003, "Invalid frame");
       }
 
-      if (data.type === "pongEsp") {
-        const meta = pendingPings.get(data.msgId);
-        if (meta) {
-          pendingPings.delete(data.msgId);
-          console.log(`[PING-ESP32] Received pong for device ${meta.deviceId} — ONLINE: ${data.online}`);
-
-          await prisma.device.update({
-            where: { id: meta.deviceId },
-            data : {
-              online: data.online
-            }
-          }).catch((err) => {
-            console.error(`[PING] Failed to update device ${meta.deviceId} online status:`, err);
-          });
-        } else {
-          console.warn(`[PING] Received pong with unknown msgId: ${data.msgId}`);
-        }
-        return;
-      }
-      if (data.type === "pongPi") {
-        const hbId = ws._homebaseId;
-        if (hbId) {
-          // 🧹 cleanup ping
-          for (const [msgId, meta] of pendingPiPings.entries()) {
-            if (meta.homeBaseId === hbId) {
-              pendingPiPings.delete(msgId);
-            }
-          }
-
-          console.log(`[PING-PI] ✅ Homebase ${hbId} is ONLINE`);
-          await prisma.homeBase.update({
-            where: { id: hbId },
-            data : {
-              online     : true,
-              lastPingAt : new Date()
-            }
-          }).catch(console.error);
-        }
-        return;
-      }
-
-      // You can handle more types here if needed
+      await handlePiMessage(ws, data, userId);
     });
 
     ws.on('close', (code, reason) => {
@@ -149,6 +260,22 @@ export function createPiWebSocketServer(port = 8081) {
     }
   }, 60_000);
 
+  setInterval(async () => {
+    const now = Date.now();
+    for (const [id, meta] of lateSprinklerAcks) {
+      if (now > meta.expiresAt) lateSprinklerAcks.delete(id);
+    }
+    for (const [id, meta] of pendingBatchPings) {
+      if (now > meta.expiresAt) {
+        pendingBatchPings.delete(id);
+        await prisma.device.updateMany({
+          where: { id: { in: Object.values(meta.devices) } },
+          data : { online: false }
+        }).catch(console.error);
+      }
+    }
+  }, 60_000);
+
   setInterval(async () => {
     const now = Date.now();
     for (const [msgId, meta] of pendingPiPings) {
@@ -20,12 +20,13 @@ def handle_status(_, data):
 
 async def main():
     print("Scanning for ESP32...")
-    devices = await BleakScanner.discover()
-    esp_device = None
-    for d in devices:
-        if d.name and "ESP32" in d.name:
-            esp_device = d
-            break
+    # Returns as soon as a matching advertisement arrives instead of
+    # waiting out the whole discover() window
+    esp_device = await BleakScanner.find_device_by_filter(
+        lambda d, adv: SERVICE_UUID in adv.service_uuids
+        or "ESP32" in (adv.local_name or d.name or ""),
+        timeout=10,
+    )
 
     if not esp_device:
         print("ESP32 not found.")
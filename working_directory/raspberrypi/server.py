@@ -8,6 +8,12 @@ BACKEND_WS = "wss://meltix.onrender.com"
 ESP32_BASE_URL = "http://esp32-1.local"
 AUTH_KEY = "123456"
 
+# Keep-alive session so each command reuses the TCP connection to the ESP32
+ESP32_MAX_CONNECTIONS = 2
+esp32_session = requests.Session()
+esp32_session.mount("http://", requests.adapters.HTTPAdapter(
+    pool_connections=1, pool_maxsize=ESP32_MAX_CONNECTIONS))
+
 async def forward_to_esp32(path):
     try:
         url = f"{ESP32_BASE_URL}{path}"
@@ -16,7 +22,7 @@ async def forward_to_esp32(path):
             'Authorization': f"Bearer {AUTH_KEY}"
         }
         payload = json.dumps({"key": AUTH_KEY})
-        r = requests.post(url, headers=headers, data=payload, timeout=3)
+        r = esp32_session.post(url, headers=headers, data=payload, timeout=3)
         print(f"[ESP32] {path} → {r.status_code}")
     except Exception as e:
         print(f"[ESP32 Error] {e}")